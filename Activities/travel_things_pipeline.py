@@ -2,67 +2,54 @@
 
 import os
 import json
-import re
+import asyncio
 from concurrent.futures import ThreadPoolExecutor, as_completed
 from dotenv import load_dotenv
-from serpapi import GoogleSearch
-from anthropic import Anthropic
+
+from Shared.serp_cache import cached_search, cached_search_async, swr_search, swr_search_async
+from Shared.llm_cache import memoize_llm, memoize_llm_async
+from Shared.llm import complete, complete_async, stream_items, stream_items_async, STREAM_SELECTION
+from Shared.ranking import selection_mode, rank_items, is_excluded, HYBRID_TOP_K
+from Shared.tracing import span, traced, submit
+from Shared.prompts import get_prompt
+from Shared.parsing import safe_parse
+from Shared.selection import index_candidates, rehydrate, rehydrating
+from Shared.compact import compact_payload, COMPACT_PAYLOADS
+from Shared.pagination import fetch_pages, fetch_pages_async
 
 # --------------------------------------------------------------------
 # 1. SETUP
 # --------------------------------------------------------------------
 load_dotenv()
 
-CLAUDE_API_KEY = os.environ.get("CLAUDE_API_KEY")
 SERPAPI_KEY = os.environ.get("SERPAPI_KEY")
 
-client = Anthropic(api_key=CLAUDE_API_KEY)
-
-# --------------------------------------------------------------------
-# 2. HELPER — GENERIC SAFE PARSER
-# --------------------------------------------------------------------
-def safe_parse(text):
-    """
-    Extremely robust JSON extractor that:
-    - Removes markdown code fences
-    - Extracts the largest JSON array or object
-    - Parses even if Claude adds noise before/after
-    """
-    if not isinstance(text, str):
-        return text
-
-    s = text.strip()
+# TripAdvisor lists barely change day to day:
+#   swr → serve the stored list at once, refresh it in the background after
+#         the soft TTL, refetch before answering only after the hard TTL
+#   ttl → plain cache (SERP_CACHE_TTLS["tripadvisor"])
+TRIPADVISOR_CACHE_MODE = os.environ.get("TPM_TRIPADVISOR_CACHE_MODE", "swr").lower()
+TRIPADVISOR_SOFT_TTL = int(os.environ.get("TPM_TRIPADVISOR_SOFT_TTL", str(24 * 60 * 60)))
+TRIPADVISOR_HARD_TTL = int(os.environ.get("TPM_TRIPADVISOR_HARD_TTL", str(7 * 24 * 60 * 60)))
 
-    s = re.sub(r"```(?:json)?", "", s).replace("```", "").strip()
+# Result pages to read (offset = page * limit, fetched concurrently), stopping
+# once TPM_TRIPADVISOR_TARGET usable items are in; 1 = first page only
+TRIPADVISOR_PAGES = int(os.environ.get("TPM_TRIPADVISOR_PAGES", "1"))
+TRIPADVISOR_TARGET = int(os.environ.get("TPM_TRIPADVISOR_TARGET", "100"))
 
-    try:
-        return json.loads(s)
-    except Exception:
-        pass
+# Top picks are cached per (city, category, preferences rounded to this step),
+# so a popular city skips both the fetch and the selection
+SELECTION_CACHE_TTL = int(os.environ.get("TPM_ACTIVITIES_SELECTION_TTL", str(24 * 60 * 60)))
+PREFERENCE_BUCKET = int(os.environ.get("TPM_PREFERENCE_BUCKET", "10"))
 
-    arrays = re.findall(r'\[[\s\S]*?]', s, flags=re.MULTILINE)
-    if arrays:
-        best = max(arrays, key=len)
-        try:
-            return json.loads(best)
-        except Exception:
-            pass
+# URLs the LLM never needs: picks come back by index and are rebuilt locally
+LLM_HIDDEN_FIELDS = ("link", "thumbnail")
 
-    objs = re.findall(r'\{[\s\S]*?}', s, flags=re.MULTILINE)
-    if objs:
-        best = max(objs, key=len)
-        try:
-            return json.loads(best)
-        except Exception:
-            pass
 
-    s2 = re.sub(r",(\s*[\]}])", r"\1", s)
-    try:
-        return json.loads(s2)
-    except:
-        pass
-
-    return None
+# --------------------------------------------------------------------
+# 2. HELPER — GENERIC SAFE PARSER
+# --------------------------------------------------------------------
+# LLM output is parsed by Shared/parsing.py (safe_parse, per-stage schemas)
 
 
 # --------------------------------------------------------------------
@@ -70,30 +57,46 @@ def safe_parse(text):
 # --------------------------------------------------------------------
 def fix_city_name(user_input):
     try:
-        with open("Activities/prompts/fix_city_prompt.txt", "r", encoding="utf-8") as f:
-            system_prompt = f.read()
+        system_prompt = get_prompt("fix_city")
     except FileNotFoundError:
         print("fix_city_prompt.txt not found")
         return {"city": user_input}
 
-    response = client.messages.create(
-        model="claude-sonnet-4-20250514",
-        max_tokens=300,
-        system=system_prompt,
-        messages=[{"role": "user", "content": user_input}]
-    )
+    def generate():
+        raw = complete(system_prompt, user_input, 300, "fix_city")
+        return _parse_city(raw)
+
+    return memoize_llm("fix_city", system_prompt, user_input, generate) or {"city": user_input}
 
-    raw = response.content[0].text.strip()
-    parsed = safe_parse(raw)
-    if parsed and isinstance(parsed, dict) and "city" in parsed:
-        return parsed
-    return {"city": user_input}
+
+def _parse_city(raw):
+    return safe_parse(raw, "fix_city")
 
 # --------------------------------------------------------------------
 # 4. FETCH ACTIVITIES / RESTAURANTS
 # --------------------------------------------------------------------
-def fetch_tripadvisor(city, ssrc="A", limit=50):
-    """ssrc: A=Things to Do, r=Restaurants"""
+def fetch_tripadvisor(city, ssrc="A", limit=50, bypass_cache=None, pages=None):
+    """
+    ssrc: A=Things to Do, r=Restaurants
+    pages: result pages of `limit` items (default TPM_TRIPADVISOR_PAGES), see _enough_items.
+    """
+    params_list = _page_params(city, ssrc, limit, pages)
+
+    def search(params):
+        if TRIPADVISOR_CACHE_MODE == "swr":
+            return swr_search(params, TRIPADVISOR_SOFT_TTL, TRIPADVISOR_HARD_TTL, bypass=bypass_cache)
+        return cached_search(params, bypass=bypass_cache)
+
+    if len(params_list) == 1:
+        items = search(params_list[0]).get("locations", [])
+    else:
+        items = merge_item_pages(fetch_pages("tripadvisor", params_list, search, _enough_items()))
+    print(f"Fetched {len(items)} items for city: {city}, ssrc: {ssrc}")
+
+    return items
+
+
+def _tripadvisor_params(city, ssrc, limit, offset=0):
     params = {
         "engine": "tripadvisor",
         "q": city,
@@ -101,70 +104,170 @@ def fetch_tripadvisor(city, ssrc="A", limit=50):
         "limit": limit,
         "api_key": SERPAPI_KEY
     }
+    if offset:
+        params["offset"] = offset
+    return params
 
-    search = GoogleSearch(params)
-    results = search.get_dict()
-    print(f"Fetched {len(results.get('locations', []))} items for city: {city}, ssrc: {ssrc}")
 
-    return results.get("locations", [])
+def _page_params(city, ssrc, limit, pages=None):
+    pages = TRIPADVISOR_PAGES if pages is None else pages
+    return [_tripadvisor_params(city, ssrc, limit, offset=page * limit) for page in range(max(pages, 1))]
+
+
+def _item_key(item):
+    return item.get("location_id") or item.get("title")
+
+
+def _enough_items():
+    """
+    Stop paging once TRIPADVISOR_TARGET distinct items that survive the
+    exclusion filter are in. Each page is checked once, when it is appended.
+    """
+    checked, usable = [0], set()
+
+    def enough(responses):
+        for response in responses[checked[0]:]:
+            usable.update(_item_key(item) for item in response.get("locations", []) if not is_excluded(item))
+        checked[0] = len(responses)
+        return len(usable) >= TRIPADVISOR_TARGET
+    return enough
+
+
+def merge_item_pages(responses):
+    """Locations of every page in page order, without repeats."""
+    seen, items = set(), []
+    for response in responses:
+        for item in response.get("locations", []):
+            key = _item_key(item)
+            if key and key in seen:
+                continue
+            seen.add(key)
+            items.append(item)
+    return items
 
 # --------------------------------------------------------------------
 # 5. LLM FUNCTION — SELECT TOP ITEMS
 # --------------------------------------------------------------------
-def select_top_items(items, preferences, top_n=10):
+@traced("activities.select")
+def select_top_items(items, preferences, top_n=10, mode=None, kind="activities", stream=None, on_item=None):
+    """
+    mode: "llm", "local" or "hybrid" (see Shared/ranking.py); defaults to TPM_ACTIVITIES_SELECTION.
+    kind: "activities" or "restaurants" (restaurants are only filtered, never re-ordered).
+    stream: parse the reply while it streams, stopping after top_n items (default TPM_LLM_STREAM).
+    The LLM answers with item indices and reasons; the picked items are copies of the originals.
+    """
+    mode = selection_mode("activities", mode)
+    if mode == "local":
+        return rank_items(items, preferences, top_n, kind=kind)
+    if mode == "hybrid":
+        items = rank_items(items, preferences, max(HYBRID_TOP_K, top_n), kind=kind)
+        if not items:
+            return []
+
     try:
-        with open("Activities/prompts/top_items_prompt.txt", "r", encoding="utf-8") as f:
-            system_prompt = f.read()
+        system_prompt = get_prompt("top_items")
     except FileNotFoundError:
         print("top_items_prompt.txt not found")
         return []
 
-    # Send strict JSON input to LLM
-    user_input = json.dumps({
-        "items": items,
-        "preferences": preferences,
-        "top_n": top_n
-    }, ensure_ascii=False)
+    user_input = _select_items_input(items, preferences, top_n)
 
     try:
-        response = client.messages.create(
-            model="claude-sonnet-4-20250514",
-            max_tokens=2000,
-            system=system_prompt,
-            messages=[{"role": "user", "content": user_input}]
-        )
+        if stream is None:
+            stream = STREAM_SELECTION
+        if stream:
+            picks, raw = stream_items(system_prompt, user_input, 500, (), top_n, rehydrating(items, on_item),
+                                      "top_items")
+            if picks:
+                return rehydrate(picks, items, top_n)
+        else:
+            raw = complete(system_prompt, user_input, 500, "top_items", top_n)
     except Exception as e:
         print(f"❌ LLM request failed: {e}")
         return []
 
-    raw = response.content[0].text.strip()
-    parsed = safe_parse(raw)
+    return rehydrate(_parse_items(raw), items, top_n)
 
-   
-    if isinstance(parsed, list):
-        return parsed[:top_n]
-    else:
-        print("Failed to parse LLM output.")
-        return []
+
+def _select_items_input(items, preferences, top_n):
+    candidates = index_candidates(items, drop=LLM_HIDDEN_FIELDS)
+    if COMPACT_PAYLOADS:
+        return (
+            f"items:\n{compact_payload('items', candidates)}\n"
+            f"preferences: {json.dumps(preferences, ensure_ascii=False)}\n"
+            f"top_n: {top_n}"
+        )
+
+    # Send strict JSON input to LLM
+    return json.dumps({
+        "items": candidates,
+        "preferences": preferences,
+        "top_n": top_n
+    }, ensure_ascii=False)
+
+
+def _parse_items(raw):
+    parsed = safe_parse(raw, "top_items")
+    return parsed if isinstance(parsed, list) else []
+
+def preference_bucket(preferences):
+    """Preferences rounded to PREFERENCE_BUCKET, so near-identical sliders share cached picks."""
+    step = PREFERENCE_BUCKET or 1
+    bucket = {}
+    for name, value in sorted((preferences or {}).items()):
+        try:
+            bucket[name] = int(round(float(value) / step) * step)
+        except (TypeError, ValueError):
+            bucket[name] = value
+    return bucket
+
+
+def _selection_key(city, preferences, kind, top_n):
+    return json.dumps({
+        "city": city,
+        "kind": kind,
+        "top_n": top_n,
+        "mode": selection_mode("activities"),
+        "pages": TRIPADVISOR_PAGES,
+        "preferences": preference_bucket(preferences),
+    }, sort_keys=True, ensure_ascii=False)
+
+
+def _selection_prompt():
+    # Part of the cache key: editing the prompt invalidates cached picks
+    try:
+        return get_prompt("top_items")
+    except FileNotFoundError:
+        return ""
 
 # --------------------------------------------------------------------
 # 6. WORKER FUNCTIONS FOR THREADS
 # --------------------------------------------------------------------
+def process_category(city, user_percentages, kind, top_n=3):
+    """Fetch + select for one category, cached per (city, kind, preference bucket)."""
+    ssrc = "r" if kind == "restaurants" else "A"
+
+    def generate():
+        items = fetch_tripadvisor(city, ssrc=ssrc, limit=50)
+        if not items:
+            return []
+        return select_top_items(items, user_percentages, top_n=top_n, kind=kind)
+
+    return memoize_llm(f"top_{kind}", _selection_prompt(), _selection_key(city, user_percentages, kind, top_n),
+                       generate, SELECTION_CACHE_TTL) or []
+
+@traced("tripadvisor.activities")
 def process_activities(city, user_percentages):
-    activities = fetch_tripadvisor(city, ssrc="A", limit=50)
-    if not activities:
-        return []
-    return select_top_items(activities, user_percentages, top_n=3)
+    return process_category(city, user_percentages, "activities")
 
+@traced("tripadvisor.restaurants")
 def process_restaurants(city, user_percentages):
-    restaurants = fetch_tripadvisor(city, ssrc="r", limit=50)
-    if not restaurants:
-        return []
-    return select_top_items(restaurants, user_percentages, top_n=3)
+    return process_category(city, user_percentages, "restaurants")
 
 # --------------------------------------------------------------------
 # 7. RUNNER FUNCTION — PARALLEL
 # --------------------------------------------------------------------
+@traced("pipeline.tripadvisor")
 def run_tripadvisor(city_input, user_percentages):
     # Fix city name first
     print("🔹 Fixing city name...")
@@ -176,8 +279,8 @@ def run_tripadvisor(city_input, user_percentages):
     # Run activities & restaurants in parallel
     with ThreadPoolExecutor(max_workers=2) as executor:
         futures = {
-            executor.submit(process_activities, city, user_percentages): "activities",
-            executor.submit(process_restaurants, city, user_percentages): "restaurants"
+            submit(executor, process_activities, city, user_percentages): "activities",
+            submit(executor, process_restaurants, city, user_percentages): "restaurants"
         }
 
         for future in as_completed(futures):
@@ -191,3 +294,110 @@ def run_tripadvisor(city_input, user_percentages):
 
     return results
 
+
+# --------------------------------------------------------------------
+# 8. ASYNC VARIANTS
+# --------------------------------------------------------------------
+async def fix_city_name_async(user_input):
+    try:
+        system_prompt = get_prompt("fix_city")
+    except FileNotFoundError:
+        print("fix_city_prompt.txt not found")
+        return {"city": user_input}
+
+    async def generate():
+        return _parse_city(await complete_async(system_prompt, user_input, 300, "fix_city"))
+
+    return await memoize_llm_async("fix_city", system_prompt, user_input, generate) or {"city": user_input}
+
+
+async def fetch_tripadvisor_async(city, ssrc="A", limit=50, bypass_cache=None, pages=None):
+    params_list = _page_params(city, ssrc, limit, pages)
+
+    async def search(params):
+        if TRIPADVISOR_CACHE_MODE == "swr":
+            return await swr_search_async(params, TRIPADVISOR_SOFT_TTL, TRIPADVISOR_HARD_TTL, bypass=bypass_cache)
+        return await cached_search_async(params, bypass=bypass_cache)
+
+    if len(params_list) == 1:
+        items = (await search(params_list[0])).get("locations", [])
+    else:
+        items = merge_item_pages(await fetch_pages_async("tripadvisor", params_list, search, _enough_items()))
+    print(f"Fetched {len(items)} items for city: {city}, ssrc: {ssrc}")
+
+    return items
+
+
+@traced("activities.select")
+async def select_top_items_async(items, preferences, top_n=10, mode=None, kind="activities", stream=None, on_item=None):
+    mode = selection_mode("activities", mode)
+    if mode == "local":
+        return rank_items(items, preferences, top_n, kind=kind)
+    if mode == "hybrid":
+        items = rank_items(items, preferences, max(HYBRID_TOP_K, top_n), kind=kind)
+        if not items:
+            return []
+
+    try:
+        system_prompt = get_prompt("top_items")
+    except FileNotFoundError:
+        print("top_items_prompt.txt not found")
+        return []
+
+    user_input = _select_items_input(items, preferences, top_n)
+
+    try:
+        if stream is None:
+            stream = STREAM_SELECTION
+        if stream:
+            picks, raw = await stream_items_async(system_prompt, user_input, 500, (), top_n,
+                                                  rehydrating(items, on_item), "top_items")
+            if picks:
+                return rehydrate(picks, items, top_n)
+        else:
+            raw = await complete_async(system_prompt, user_input, 500, "top_items", top_n)
+    except Exception as e:
+        print(f"❌ LLM request failed: {e}")
+        return []
+
+    return rehydrate(_parse_items(raw), items, top_n)
+
+
+async def process_category_async(city, user_percentages, kind, top_n=3):
+    ssrc = "r" if kind == "restaurants" else "A"
+
+    async def generate():
+        items = await fetch_tripadvisor_async(city, ssrc=ssrc, limit=50)
+        if not items:
+            return []
+        return await select_top_items_async(items, user_percentages, top_n=top_n, kind=kind)
+
+    with span(f"tripadvisor.{kind}"):
+        return await memoize_llm_async(f"top_{kind}", _selection_prompt(),
+                                       _selection_key(city, user_percentages, kind, top_n),
+                                       generate, SELECTION_CACHE_TTL) or []
+
+
+@traced("pipeline.tripadvisor")
+async def run_tripadvisor_async(city_input, user_percentages):
+    """Async run_tripadvisor: activities and restaurants run as concurrent tasks."""
+    print("🔹 Fixing city name...")
+    city = (await fix_city_name_async(city_input)).get("city", city_input)
+    print(f"✅ City fixed: {city}")
+
+    keys = ["activities", "restaurants"]
+    outcomes = await asyncio.gather(
+        *(process_category_async(city, user_percentages, key) for key in keys),
+        return_exceptions=True,
+    )
+
+    results = {}
+    for key, outcome in zip(keys, outcomes):
+        if isinstance(outcome, Exception):
+            print(f"❌ Error processing {key}: {outcome}")
+            results[key] = []
+        else:
+            results[key] = outcome
+            print(f"✅ {key} processed, {len(outcome)} items")
+
+    return results
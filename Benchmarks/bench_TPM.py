@@ -0,0 +1,354 @@
+# bench_TPM.py
+#
+# Offline benchmark: replays the recorded SerpAPI / Anthropic responses with
+# injected latency and reports run_TPM latency percentiles, throughput under
+# concurrent searches and peak memory. Run from the repo root:
+#
+#   python -m Benchmarks.bench_TPM --iterations 20 --concurrency 8
+#   python -m Benchmarks.bench_TPM --output bench.json
+#   python -m Benchmarks.bench_TPM --baseline bench.json   # exit 1 on regression
+
+import os, io, sys, json, time, shutil, asyncio, argparse, tempfile, datetime, tracemalloc, resource
+from contextlib import redirect_stdout
+from concurrent.futures import ThreadPoolExecutor
+
+from Benchmarks.fixtures import REPO_DIR, Latency
+
+# --------------------------------------------------------------------
+# 1. SETUP
+# --------------------------------------------------------------------
+PIPELINES = ("hotels", "flights", "tripadvisor")
+PERCENTILES = (50, 90, 95, 99)
+PREFERENCES = {"Nature": 60, "Human-built": 40, "Historical": 70, "Modern": 30}
+
+def prepare_workdir():
+    """Scratch working directory; caches and artifacts stay inside it."""
+    workdir = tempfile.mkdtemp(prefix="tpm_bench_")
+
+    # The repo stays importable after chdir (python -m puts "" on sys.path)
+    if REPO_DIR not in sys.path:
+        sys.path.insert(0, REPO_DIR)
+
+    # Read at import time by the Shared modules: set before importing TPM_runner
+    os.environ["TPM_CACHE_DIR"] = os.path.join(workdir, ".tpm_cache")
+    os.environ["TPM_ARTIFACT_DIR"] = os.path.join(workdir, ".tpm_artifacts")
+    os.environ.setdefault("TPM_TRACE_EXPORT", "false")
+    return workdir
+
+
+def percentile(values, p):
+    """Linear-interpolated percentile (p in 0..100)."""
+    if not values:
+        return None
+    values = sorted(values)
+    k = (len(values) - 1) * p / 100
+    lo, hi = int(k), min(int(k) + 1, len(values) - 1)
+    return values[lo] + (values[hi] - values[lo]) * (k - lo)
+
+
+def summarize(samples):
+    return {
+        "count": len(samples),
+        "mean": sum(samples) / len(samples) if samples else None,
+        **{f"p{p}": percentile(samples, p) for p in PERCENTILES},
+    }
+
+
+# --------------------------------------------------------------------
+# 2. ONE SEARCH
+# --------------------------------------------------------------------
+def _timings(trace):
+    """End-to-end and per-pipeline durations from the search's trace spans."""
+    timings = {}
+    for s in trace.summary():
+        if s["name"] in ("run_TPM", "run_TPM_async"):
+            timings["run_TPM"] = s["duration"]
+        elif s["name"].startswith("pipeline."):
+            timings[s["name"].split(".", 1)[1]] = s["duration"]
+    return timings
+
+
+def _first_result(first):
+    def on_event(event):
+        if event["type"] == "result" and "first_result" not in first:
+            first["first_result"] = event["elapsed"]
+    return on_event
+
+
+def search_sync(args):
+    from TPM_runner import run_TPM
+    from Shared.tracing import start_trace
+
+    first = {}
+    with start_trace("bench") as trace:
+        results = run_TPM(args.from_city, args.to_city, args.travelers, args.dates, PREFERENCES,
+                          fast_params=not args.llm_params, on_event=_first_result(first), budget=args.budget)
+    return dict(_timings(trace), **first), results
+
+
+async def search_async(args):
+    from TPM_runner import run_TPM_async
+    from Shared.tracing import start_trace
+
+    first = {}
+    with start_trace("bench") as trace:
+        results = await run_TPM_async(args.from_city, args.to_city, args.travelers, args.dates, PREFERENCES,
+                                      fast_params=not args.llm_params, on_event=_first_result(first),
+                                      budget=args.budget)
+    return dict(_timings(trace), **first), results
+
+
+def _failed(results):
+    return [k for k in PIPELINES if not results.get(k)]
+
+
+# --------------------------------------------------------------------
+# 3. PHASES
+# --------------------------------------------------------------------
+def run_batch(args, n, concurrency):
+    """Runs n searches, concurrency at a time. Returns (timings list, failures, wall seconds)."""
+    start = time.perf_counter()
+
+    if args.mode == "async":
+        async def batch():
+            from Shared.clients import close_async_clients
+            sem = asyncio.Semaphore(concurrency)
+
+            async def one():
+                async with sem:
+                    return await search_async(args)
+
+            outcomes = await asyncio.gather(*(one() for _ in range(n)))
+            await close_async_clients()
+            return outcomes
+
+        outcomes = asyncio.run(batch())
+    else:
+        with ThreadPoolExecutor(max_workers=concurrency) as pool:
+            outcomes = list(pool.map(lambda _: search_sync(args), range(n)))
+
+    wall = time.perf_counter() - start
+    timings = [t for t, _ in outcomes]
+    failures = sum(1 for _, r in outcomes if _failed(r))
+    return timings, failures, wall
+
+
+def latency_report(timings):
+    report = {"run_TPM": summarize([t["run_TPM"] for t in timings if "run_TPM" in t])}
+    for name in ("first_result",) + PIPELINES:
+        samples = [t[name] for t in timings if name in t]
+        if samples:
+            report[name] = summarize(samples)
+    return report
+
+
+def run_benchmark(args):
+    workdir = prepare_workdir()
+    os.chdir(workdir)
+
+    from Benchmarks import fixtures
+    from Shared.singleflight import single_flight_stats
+    from Shared.rate_limit import rate_limit_stats
+    from Shared.resilience import resilience_stats
+    from Shared.parsing import parse_stats
+    from Shared.compact import compact_stats
+    serpapi, anthropic, async_anthropic = fixtures.install(Latency(
+        serpapi=args.serpapi_latency, llm=args.llm_latency,
+        llm_per_1k_tokens=args.llm_per_1k_tokens, llm_tokens_per_s=args.llm_tokens_per_s,
+        jitter=args.jitter, seed=args.seed, error_rate=args.error_rate, tail_rate=args.tail_rate,
+    ))
+
+    out = sys.stdout if args.verbose else io.StringIO()
+    tracemalloc.start()
+    with redirect_stdout(out):
+        # Warm-up: imports, prompt reads, client setup
+        run_batch(args, 1, 1)
+        tracemalloc.reset_peak()
+
+        sequential, seq_failures, _ = run_batch(args, args.iterations, 1)
+        concurrent, conc_failures, wall = run_batch(args, max(args.iterations, args.concurrency), args.concurrency)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    from Shared.artifacts import flush_artifacts
+    flush_artifacts(timeout=30)
+    shutil.rmtree(workdir, ignore_errors=True)
+
+    n_concurrent = len(concurrent)
+    return {
+        "config": {
+            "mode": args.mode,
+            "iterations": args.iterations,
+            "concurrency": args.concurrency,
+            "serpapi_latency": args.serpapi_latency,
+            "llm_latency": args.llm_latency,
+            "llm_per_1k_tokens": args.llm_per_1k_tokens,
+            "llm_tokens_per_s": args.llm_tokens_per_s,
+            "jitter": args.jitter,
+            "error_rate": args.error_rate,
+            "tail_rate": args.tail_rate,
+            "budget": args.budget,
+            "llm_params": args.llm_params,
+        },
+        "latency": latency_report(sequential),
+        "concurrent": {
+            "searches": n_concurrent,
+            "wall": wall,
+            "throughput": n_concurrent / wall if wall else None,
+            "latency": latency_report(concurrent),
+        },
+        "failures": seq_failures + conc_failures,
+        "upstream": {
+            "serpapi_calls": serpapi.calls,
+            "llm_calls": anthropic.calls + async_anthropic.calls,
+            "llm_input_tokens": anthropic.input_tokens + async_anthropic.input_tokens,
+            "llm_cached_tokens": anthropic.cached_tokens + async_anthropic.cached_tokens,
+            "llm_output_tokens": anthropic.output_tokens + async_anthropic.output_tokens,
+            "single_flight": single_flight_stats(),
+            "rate_limits": rate_limit_stats(),
+            "resilience": resilience_stats(),
+            "parse": parse_stats(),
+            "compact": compact_stats(),
+        },
+        "memory": {
+            "python_peak_mb": peak / 1024 / 1024,
+            "max_rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+        },
+    }
+
+
+# --------------------------------------------------------------------
+# 4. REPORTING / GATING
+# --------------------------------------------------------------------
+def _fmt(value):
+    return f"{value:8.3f}" if value is not None else "       -"
+
+
+def print_report(report):
+    c = report["config"]
+    print(f"\n📊 run_TPM benchmark ({c['mode']}, serpapi {c['serpapi_latency']}s, "
+          f"llm {c['llm_latency']}s + {c['llm_per_1k_tokens']}s/1k tokens, jitter ±{c['jitter']:.0%})")
+
+    for title, latency in (("Sequential", report["latency"]),
+                           (f"Under {c['concurrency']} concurrent", report["concurrent"]["latency"])):
+        print(f"\n{title} latency (s)")
+        print(f"{'':14}" + "".join(f"{'p' + str(p):>9}" for p in PERCENTILES) + f"{'mean':>9}")
+        for name, stats in latency.items():
+            print(f"{name:14}" + "".join(" " + _fmt(stats[f"p{p}"]) for p in PERCENTILES)
+                  + f" {_fmt(stats['mean'])}")
+
+    conc = report["concurrent"]
+    print(f"\n🚀 Throughput: {conc['throughput']:.2f} searches/s "
+          f"({conc['searches']} searches in {conc['wall']:.2f}s)")
+    up = report["upstream"]
+    print(f"🔌 Upstream: {up['serpapi_calls']} SerpAPI calls, {up['llm_calls']} LLM calls, "
+          f"~{up['llm_input_tokens']} uncached + ~{up['llm_cached_tokens']} cached LLM input tokens, "
+          f"~{up['llm_output_tokens']} output tokens")
+    shared = {name: stats["shared"] for name, stats in up.get("single_flight", {}).items() if stats["shared"]}
+    if shared:
+        print("🤝 Shared in-flight calls: " + ", ".join(f"{name} {n}" for name, n in shared.items()))
+    for name, stats in up.get("rate_limits", {}).items():
+        print(f"🚦 {name}: {stats['queued']}/{stats['requests']} requests queued, "
+              f"wait mean {stats['wait_mean_s']:.3f}s / max {stats['wait_max_s']:.3f}s, {stats['throttled']} throttled")
+    res = up.get("resilience")
+    if res:
+        print(f"🔁 Resilience: {res['retries']} retries, {res['hedged']} hedged ({res['hedge_wins']} won), "
+              f"{res['deadline_exceeded']} calls past the deadline")
+    parse = up.get("parse", {})
+    if parse:
+        failed = sum(stats["no_json"] + stats["syntax"] + stats["schema"] for stats in parse.values())
+        print(f"🧩 Parsing: {sum(stats['calls'] for stats in parse.values())} LLM replies parsed, "
+              f"{failed} failed, {sum(stats['seconds'] for stats in parse.values()) * 1000:.1f} ms total")
+    compact = up.get("compact")
+    if compact and compact["calls"]:
+        print(f"🗜️ Compact payloads: {compact['calls']} candidate lists, "
+              f"~{compact['tokens_json']} → ~{compact['tokens_compact']} tokens")
+    mem = report["memory"]
+    print(f"🧠 Memory: {mem['python_peak_mb']:.1f} MB peak Python allocations, {mem['max_rss_mb']:.1f} MB max RSS")
+    if report["failures"]:
+        print(f"❌ {report['failures']} searches returned no results for at least one pipeline")
+
+
+def compare(report, baseline, tolerance):
+    """Returns the list of regressions beyond tolerance (fraction) against a baseline report."""
+    regressions = []
+    checks = [
+        ("sequential run_TPM p95", report["latency"]["run_TPM"]["p95"], baseline["latency"]["run_TPM"]["p95"], True),
+        ("concurrent run_TPM p95", report["concurrent"]["latency"]["run_TPM"]["p95"],
+         baseline["concurrent"]["latency"]["run_TPM"]["p95"], True),
+        ("throughput", report["concurrent"]["throughput"], baseline["concurrent"]["throughput"], False),
+        ("peak memory", report["memory"]["python_peak_mb"], baseline["memory"]["python_peak_mb"], True),
+    ]
+    for name, current, base, lower_is_better in checks:
+        if not current or not base:
+            continue
+        change = (current - base) / base if lower_is_better else (base - current) / base
+        if change > tolerance:
+            regressions.append(f"{name}: {base:.3f} → {current:.3f} ({change:+.0%})")
+    return regressions
+
+
+def parse_args(argv=None):
+    in_30_days = datetime.date.today() + datetime.timedelta(days=30)
+    default_dates = f"{in_30_days} to {in_30_days + datetime.timedelta(days=7)}"
+
+    parser = argparse.ArgumentParser(description="Offline run_TPM benchmark on recorded fixtures.")
+    parser.add_argument("--mode", choices=("sync", "async"), default="sync", help="run_TPM or run_TPM_async")
+    parser.add_argument("--iterations", type=int, default=10, help="sequential searches to time")
+    parser.add_argument("--concurrency", type=int, default=8, help="concurrent searches in the throughput phase")
+    parser.add_argument("--serpapi-latency", type=float, default=0.3, help="seconds per SerpAPI call")
+    parser.add_argument("--llm-latency", type=float, default=0.8, help="seconds per LLM call")
+    parser.add_argument("--llm-per-1k-tokens", type=float, default=0.05, help="extra LLM seconds per 1k input tokens")
+    parser.add_argument("--llm-tokens-per-s", type=float, default=80, help="LLM output tokens per second (0: instant)")
+    parser.add_argument("--jitter", type=float, default=0.2, help="± fraction of random latency jitter")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--error-rate", type=float, default=0.0, help="fraction of upstream calls failing transiently")
+    parser.add_argument("--tail-rate", type=float, default=0.0, help="fraction of upstream calls 10x slower")
+    parser.add_argument("--budget", type=float, help="run_TPM time budget in seconds (default TPM_SEARCH_BUDGET)")
+    parser.add_argument("--from-city", default="Dammam")
+    parser.add_argument("--to-city", default="Almaty")
+    parser.add_argument("--travelers", type=int, default=2)
+    parser.add_argument("--dates", default=default_dates)
+    parser.add_argument("--llm-params", action="store_true", help="generate params with the LLM (fast_params=False)")
+    parser.add_argument("--cache", action="store_true", help="keep the SerpAPI / LLM caches on (default: bypassed)")
+    parser.add_argument("--output", help="write the JSON report here")
+    parser.add_argument("--baseline", help="JSON report to compare against; exits 1 on regression")
+    parser.add_argument("--tolerance", type=float, default=0.15, help="allowed regression vs baseline (fraction)")
+    parser.add_argument("--verbose", action="store_true", help="show pipeline output")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    if not args.cache:
+        os.environ["TPM_SERP_CACHE_BYPASS"] = "1"
+        os.environ["TPM_LLM_CACHE_BYPASS"] = "1"
+    cwd = os.getcwd()
+
+    report = run_benchmark(args)
+    os.chdir(cwd)
+    print_report(report)
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+        print(f"✅ Report written to {args.output}")
+
+    if args.baseline:
+        with open(args.baseline, "r", encoding="utf-8") as f:
+            baseline = json.load(f)
+        regressions = compare(report, baseline, args.tolerance)
+        if regressions:
+            print("❌ Regressions vs baseline:")
+            for r in regressions:
+                print(f"   {r}")
+            return 1
+        print("✅ No regressions vs baseline")
+
+    if report["failures"]:
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,414 @@
+# fixtures.py
+
+import os, re, json, time, random, asyncio, threading
+
+import httpx
+
+from Shared.resilience import TransientError
+
+# --------------------------------------------------------------------
+# 1. SETUP
+# --------------------------------------------------------------------
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Recorded SerpAPI responses shipped with the repo
+RECORDED = {
+    "outbound": "Flights/JSONs/outbound.json",
+    "return": "Flights/JSONs/return.json",
+    "booking": "Flights/JSONs/booking.json",
+    "hotels": "hotels/JSONs/hotels.json",
+    "flight_params": "Flights/JSONs/flight_params.json",
+    "hotel_params": "hotels/JSONs/hotel_params.json",
+}
+
+# System prompt file -> stage answered by the stand-in LLM
+PROMPT_STAGES = {
+    "Flights/prompts/flights_request_gen_prompt.txt": "flight_params",
+    "Flights/prompts/flights_prompt.txt": "top_flights",
+    "hotels/prompts/hotels_request_gen_prompt.txt": "hotel_params",
+    "hotels/prompts/top_hotels_prompt.txt": "top_hotels",
+    "Activities/prompts/fix_city_prompt.txt": "fix_city",
+    "Activities/prompts/top_items_prompt.txt": "top_items",
+}
+
+PLACE_WORDS = ["Park", "Museum", "Gallery", "Old Town", "Tower", "Bazaar", "Cathedral", "Lake",
+               "Gorge", "Market", "Theatre", "Mall", "Observatory", "Garden", "Mosque", "Fortress"]
+FOOD_WORDS = ["Grill", "Cafe", "Bistro", "Kitchen", "Steakhouse", "Teahouse", "Bakery", "Noodle Bar"]
+
+
+def load_recorded():
+    """Reads the recorded responses into memory."""
+    data = {}
+    for name, path in RECORDED.items():
+        with open(os.path.join(REPO_DIR, path), "r", encoding="utf-8") as f:
+            data[name] = json.load(f)
+    return data
+
+
+def tripadvisor_locations(city, ssrc, limit=50, offset=0):
+    """No TripAdvisor recording ships with the repo: deterministic synthetic locations per city/category/page."""
+    rng = random.Random(f"{city}:{ssrc}:{offset}" if offset else f"{city}:{ssrc}")
+    words = FOOD_WORDS if ssrc == "r" else PLACE_WORDS
+    return [{
+        "title": f"{city} {rng.choice(words)} {i}",
+        "description": f"A popular {rng.choice(words).lower()} in {city}.",
+        "rating": round(rng.uniform(3.0, 5.0), 1),
+        "reviews": rng.randint(5, 5000),
+        "place_type": "EATERY" if ssrc == "r" else "ATTRACTION",
+    } for i in range(offset, offset + limit)]
+
+
+# The recorded hotels response is one page; later pages repeat its hotels
+# under page-specific tokens, up to HOTEL_PAGES pages
+HOTEL_PAGES = 5
+
+
+def hotels_page(first_page, token):
+    """The page a next_page_token points to: "page-N" for the fake's own tokens, page 2 for the recorded one."""
+    page = int(token.split("-")[1]) if token.startswith("page-") else 2
+    response = dict(first_page)
+    response["properties"] = [
+        {**hotel, "property_token": f"{hotel.get('property_token')}-p{page}"}
+        for hotel in first_page.get("properties", [])
+    ]
+    response["serpapi_pagination"] = {"next_page_token": f"page-{page + 1}"} if page < HOTEL_PAGES else {}
+    return response
+
+
+# --------------------------------------------------------------------
+# 2. LATENCY MODEL
+# --------------------------------------------------------------------
+class Latency:
+    """
+    Injected upstream latency: a base delay per call (seconds) with +/- jitter
+    (fraction of base), plus, for the LLM, prefill time per 1k input tokens
+    and generation time at llm_tokens_per_s output tokens per second.
+    Faults: error_rate of calls fail with a transient error, tail_rate of
+    calls take tail_factor times longer.
+    """
+
+    def __init__(self, serpapi=0.3, llm=0.8, llm_per_1k_tokens=0.05, llm_tokens_per_s=80, jitter=0.2, seed=0,
+                 error_rate=0.0, tail_rate=0.0, tail_factor=10):
+        self.serpapi = serpapi
+        self.llm = llm
+        self.llm_per_1k_tokens = llm_per_1k_tokens
+        self.llm_tokens_per_s = llm_tokens_per_s
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.tail_rate = tail_rate
+        self.tail_factor = tail_factor
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+
+    def _jittered(self, base):
+        with self._lock:
+            factor = 1 + self._rng.uniform(-self.jitter, self.jitter)
+            if self._rng.random() < self.tail_rate:
+                factor *= self.tail_factor
+        return max(base * factor, 0.0)
+
+    def fail(self, upstream):
+        """Raises a transient error for error_rate of calls."""
+        with self._lock:
+            failed = self._rng.random() < self.error_rate
+        if failed:
+            raise TransientError(f"Injected {upstream} failure")
+
+    def serpapi_delay(self):
+        return self._jittered(self.serpapi)
+
+    def llm_delay(self, input_tokens):
+        """Time to first token."""
+        return self._jittered(self.llm) + self.llm_per_1k_tokens * input_tokens / 1000
+
+    def generation_delay(self, output_tokens):
+        return output_tokens / self.llm_tokens_per_s if self.llm_tokens_per_s else 0.0
+
+
+# --------------------------------------------------------------------
+# 3. STAND-INS
+# --------------------------------------------------------------------
+class FakeSerpAPI:
+    """Answers SerpAPI queries from the recorded responses, after the injected delay."""
+
+    def __init__(self, recorded, latency):
+        self.recorded = recorded
+        self.latency = latency
+        self.calls = 0
+
+    def respond(self, params):
+        self.calls += 1
+        engine = params.get("engine")
+        if engine == "google_hotels":
+            if params.get("next_page_token"):
+                return hotels_page(self.recorded["hotels"], params["next_page_token"])
+            return self.recorded["hotels"]
+        if engine == "tripadvisor":
+            return {"locations": tripadvisor_locations(params.get("q", ""), params.get("ssrc", "A"),
+                                                       int(params.get("limit", 50)), int(params.get("offset", 0)))}
+        if params.get("booking_token"):
+            return self.recorded["booking"]
+        if params.get("departure_token"):
+            return self.recorded["return"]
+        return self.recorded["outbound"]
+
+    def get(self, params, timeout=None):
+        delay, timed_out = _capped(self.latency.serpapi_delay(), timeout)
+        time.sleep(delay)
+        _check(timed_out, self.latency, "SerpAPI")
+        return self.respond(params)
+
+    async def get_async(self, params, timeout=None):
+        delay, timed_out = _capped(self.latency.serpapi_delay(), timeout)
+        await asyncio.sleep(delay)
+        _check(timed_out, self.latency, "SerpAPI")
+        return self.respond(params)
+
+
+def _capped(delay, timeout):
+    """Like a client timeout: (time actually waited, whether the call timed out)."""
+    if timeout is not None and delay > timeout:
+        return timeout, True
+    return delay, False
+
+
+def _check(timed_out, latency, upstream):
+    if timed_out:
+        raise httpx.ReadTimeout(f"Injected {upstream} delay over the timeout")
+    latency.fail(upstream)
+
+
+class _Block:
+    type = "text"
+
+    def __init__(self, text):
+        self.text = text
+
+
+class _ToolUse:
+    type = "tool_use"
+
+    def __init__(self, name, input):
+        self.name = name
+        self.input = input
+
+
+class _Event:
+    """Stream event: "text" carries .text, "input_json" carries .partial_json (the tool input)."""
+
+    def __init__(self, type, chunk):
+        self.type = type
+        self.text = self.partial_json = chunk
+
+
+class _Usage:
+    def __init__(self, input_tokens, output_tokens, cache_read=0, cache_creation=0):
+        self.input_tokens = input_tokens
+        self.output_tokens = output_tokens
+        self.cache_read_input_tokens = cache_read
+        self.cache_creation_input_tokens = cache_creation
+
+
+class _Message:
+    """text is the reply, or the JSON tool input when tool names the forced tool."""
+
+    def __init__(self, text, input_tokens, cache_read=0, cache_creation=0, tool=None):
+        self.text = text
+        self.content = [_ToolUse(tool, json.loads(text)) if tool else _Block(text)]
+        self.usage = _Usage(input_tokens, (len(text) + 3) // 4, cache_read, cache_creation)
+        self.stop_reason = "tool_use" if tool else "end_turn"
+
+
+class _Stream:
+    """Stand-in for the messages.stream() context manager: text (or tool input JSON) arrives in ~4-token chunks."""
+
+    CHUNK = 16
+
+    def __init__(self, message, first_delay, latency, timeout=None):
+        self.message = message
+        self.first_delay = first_delay
+        self.latency = latency
+        self.timeout = timeout
+        self.text = message.text
+        self.event = "input_json" if message.content[0].type == "tool_use" else "text"
+
+    def _chunks(self):
+        for i in range(0, len(self.text), self.CHUNK):
+            chunk = self.text[i:i + self.CHUNK]
+            yield _Event(self.event, chunk), self.latency.generation_delay((len(chunk) + 3) // 4)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def __iter__(self):
+        delay, timed_out = _capped(self.first_delay, self.timeout)
+        time.sleep(delay)
+        _check(timed_out, self.latency, "Anthropic")
+        for event, delay in self._chunks():
+            time.sleep(delay)
+            yield event
+
+    @property
+    def current_message_snapshot(self):
+        return self.message
+
+    def get_final_message(self):
+        return self.message
+
+
+class _AsyncStream(_Stream):
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        return False
+
+    async def __aiter__(self):
+        delay, timed_out = _capped(self.first_delay, self.timeout)
+        await asyncio.sleep(delay)
+        _check(timed_out, self.latency, "Anthropic")
+        for event, delay in self._chunks():
+            await asyncio.sleep(delay)
+            yield event
+
+    async def get_final_message(self):
+        return self.message
+
+
+class FakeAnthropic:
+    """
+    Stand-in for Anthropic().messages (create and stream): recognizes the stage
+    from the system prompt and answers with a well-formed reply built from the request.
+    System blocks marked with cache_control are cached like the API does: only
+    from CACHE_MIN_TOKENS up, and cache reads skip prefill time. With a
+    forced tool the answer comes back as that tool's input.
+    """
+
+    CACHE_MIN_TOKENS = 1024
+
+    def __init__(self, recorded, latency):
+        self.recorded = recorded
+        self.latency = latency
+        self.calls = 0
+        self.input_tokens = 0
+        self.cached_tokens = 0
+        self.output_tokens = 0
+        self._cached = set()
+        self._lock = threading.Lock()
+        self.stages = {}
+        for path, stage in PROMPT_STAGES.items():
+            with open(os.path.join(REPO_DIR, path), "r", encoding="utf-8") as f:
+                self.stages[f.read().strip()] = stage
+        self.messages = self
+
+    def _reply(self, system, messages, tool_choice=None):
+        cacheable = isinstance(system, list) and any(block.get("cache_control") for block in system)
+        if isinstance(system, list):
+            system = "".join(block.get("text", "") for block in system)
+        user = messages[-1]["content"]
+        if isinstance(user, list):
+            user = "".join(block.get("text", "") for block in user if isinstance(block, dict))
+
+        stage = self.stages.get((system or "").strip())
+        system_tokens = (len(system or "") + 3) // 4
+        input_tokens = system_tokens + (len(user) + 3) // 4
+        cache_read = cache_creation = 0
+        if cacheable and system_tokens >= self.CACHE_MIN_TOKENS:
+            with self._lock:
+                if system in self._cached:
+                    cache_read = system_tokens
+                else:
+                    self._cached.add(system)
+                    cache_creation = system_tokens
+            input_tokens -= system_tokens
+        self.calls += 1
+        self.input_tokens += input_tokens
+        self.cached_tokens += cache_read
+        tool = (tool_choice or {}).get("name")
+        message = _Message(self._render(stage, self._answer(stage, user), tool), input_tokens, cache_read,
+                           cache_creation, tool)
+        self.output_tokens += message.usage.output_tokens
+        # Cached prefix tokens are not prefilled again
+        return message, input_tokens + cache_creation
+
+    def _answer(self, stage, user):
+        if stage == "flight_params":
+            return self.recorded["flight_params"]
+        if stage == "hotel_params":
+            return self.recorded["hotel_params"]
+        if stage == "fix_city":
+            return {"city": user.strip().title()}
+        # Selections pick the first candidates by their index "i" (JSON objects or compact table rows)
+        indices = [int(i) for i in re.findall(r'"i":\s*(\d+)', user) or re.findall(r'(?m)^(\d+)\|', user)]
+        if stage == "top_flights":
+            return {"final_flights": [{"i": i, "reason": "benchmark"} for i in indices[:1]]}
+        if stage == "top_hotels":
+            return {"top_hotels": [{"i": i, "reason": "benchmark"} for i in indices[:5]]}
+        if stage == "top_items":
+            m = re.search(r'"?top_n"?:\s*(\d+)', user)
+            return [{"i": i, "reason": "benchmark"} for i in indices[:int(m.group(1)) if m else 3]]
+        return {}
+
+    @staticmethod
+    def _render(stage, answer, tool):
+        """The answer as the prompt asks for it, or as tool input JSON."""
+        if tool:
+            return json.dumps({"items": answer} if stage == "top_items" else answer)
+        if stage in ("flight_params", "hotel_params"):
+            return "params = " + json.dumps(answer)
+        return json.dumps(answer)
+
+    def create(self, system=None, messages=None, timeout=None, tool_choice=None, **kwargs):
+        message, input_tokens = self._reply(system, messages, tool_choice)
+        delay, timed_out = _capped(self.latency.llm_delay(input_tokens)
+                                   + self.latency.generation_delay(message.usage.output_tokens), timeout)
+        time.sleep(delay)
+        _check(timed_out, self.latency, "Anthropic")
+        return message
+
+    def stream(self, system=None, messages=None, timeout=None, tool_choice=None, **kwargs):
+        message, input_tokens = self._reply(system, messages, tool_choice)
+        return _Stream(message, self.latency.llm_delay(input_tokens), self.latency, timeout)
+
+
+class FakeAsyncAnthropic(FakeAnthropic):
+
+    async def create(self, system=None, messages=None, timeout=None, tool_choice=None, **kwargs):
+        message, input_tokens = self._reply(system, messages, tool_choice)
+        delay, timed_out = _capped(self.latency.llm_delay(input_tokens)
+                                   + self.latency.generation_delay(message.usage.output_tokens), timeout)
+        await asyncio.sleep(delay)
+        _check(timed_out, self.latency, "Anthropic")
+        return message
+
+    def stream(self, system=None, messages=None, timeout=None, tool_choice=None, **kwargs):
+        message, input_tokens = self._reply(system, messages, tool_choice)
+        return _AsyncStream(message, self.latency.llm_delay(input_tokens), self.latency, timeout)
+
+
+# --------------------------------------------------------------------
+# 4. INSTALL
+# --------------------------------------------------------------------
+def install(latency=None):
+    """
+    Routes every SerpAPI and Anthropic call of the pipelines to the stand-ins.
+    Returns (serpapi, anthropic, async_anthropic) so callers can read call counts.
+    """
+    import Shared.serp_cache as serp_cache
+    import Shared.llm as llm
+
+    latency = latency or Latency()
+    recorded = load_recorded()
+    serpapi = FakeSerpAPI(recorded, latency)
+    anthropic = FakeAnthropic(recorded, latency)
+    async_anthropic = FakeAsyncAnthropic(recorded, latency)
+
+    serp_cache.serpapi_get = serpapi.get
+    serp_cache.serpapi_get_async = serpapi.get_async
+    llm.get_anthropic = lambda: anthropic
+    llm.get_async_anthropic = lambda: async_anthropic
+    return serpapi, anthropic, async_anthropic
@@ -1,48 +1,43 @@
 # travel_flights_pipeline.py
 
-import os, json, ast, re, time
+import os, time, asyncio
+from concurrent.futures import ThreadPoolExecutor
 from dotenv import load_dotenv
-from serpapi import GoogleSearch
-from anthropic import Anthropic
+
+from Shared.serp_cache import cached_search, cached_search_async
+from Shared.llm_cache import memoize_llm, memoize_llm_async
+from Shared.llm import complete, complete_async, stream_items, stream_items_async, STREAM_SELECTION
+from Shared.ranking import selection_mode, rank_flights, HYBRID_TOP_K
+from Shared.prefilter import prefilter_flights
+from Shared.tracing import traced, submit
+from Shared.prompts import get_prompt
+from Shared.artifacts import write_artifact
+from Shared.parsing import safe_parse
+from Shared.selection import index_candidates, rehydrate, rehydrating
+from Shared.compact import compact_payload
 
 # --------------------------------------------------
 # 1. SETUP
 # --------------------------------------------------
 load_dotenv()
 
-CLAUDE_API_KEY = os.environ.get("CLAUDE_API_KEY")
 SERPAPI_KEY = os.environ.get("SERPAPI_KEY")
-client = Anthropic(api_key=CLAUDE_API_KEY)
+
+# Return-leg searches fired for the most promising departure_tokens while the
+# LLM is still choosing the outbound flight (0 disables speculation)
+SPECULATIVE_RETURNS = int(os.environ.get("TPM_FLIGHTS_SPECULATIVE", "3"))
+
+# Shared by every run's prefetches; searches not picked are cancelled while still queued
+_prefetch_pool = ThreadPoolExecutor(max_workers=8, thread_name_prefix="return-prefetch")
+
+# Long opaque fields the LLM never needs: picks come back by index and are rebuilt locally
+LLM_HIDDEN_FIELDS = ("departure_token", "booking_token", "airline_logo")
 
 
 # --------------------------------------------------
 # 2. HELPERS
 # --------------------------------------------------
-def safe_parse(text):
-    """Tries to safely parse stringified Python or JSON data."""
-    if not isinstance(text, str):
-        return text
-
-    s = text.strip()
-    if s.startswith("params"):
-        s = s.split("=", 1)[1].strip()
-
-    for parser in (ast.literal_eval, json.loads):
-        try:
-            return parser(s)
-        except Exception:
-            continue
-
-    m = re.search(r'(\{.*\}|\[.*\])', s, re.DOTALL)
-    if m:
-        content = m.group(1)
-        for parser in (ast.literal_eval, json.loads):
-            try:
-                return parser(content)
-            except Exception:
-                continue
-
-    return None
+# LLM output is parsed by Shared/parsing.py (safe_parse, per-stage schemas)
 
 
 # --------------------------------------------------
@@ -50,71 +45,108 @@ def safe_parse(text):
 # --------------------------------------------------
 def get_flight_request(user_input):
     try:
-        with open("flights/prompts/flights_request_gen_prompt.txt", "r", encoding="utf-8") as f:
-            system_prompt = f.read()
+        system_prompt = get_prompt("flights_request_gen")
     except FileNotFoundError:
         print("flights_request_gen_prompt.txt not found")
         return None
 
-    response = client.messages.create(
-        model="claude-sonnet-4-20250514",
-        max_tokens=1000,
-        system=system_prompt,
-        messages=[{"role": "user", "content": user_input}]
-    )
+    def generate():
+        raw = complete(system_prompt, user_input, 1000, "flight_params")
+        return safe_parse(raw, "flight_params")
 
-    raw = response.content[0].text.strip()
-    return safe_parse(raw)
+    return memoize_llm("flight_params", system_prompt, user_input, generate)
 
 # --------------------------------------------------
 # 4. API CALL: Generic Fetch
 # --------------------------------------------------
-def fetch_flights(params, filename):
+def fetch_flights(params, filename, bypass_cache=None, save=True):
     params["api_key"] = SERPAPI_KEY
     # print("Search Parameters: \n" + json.dumps(params, indent=2, ensure_ascii=False))
 
-    search = GoogleSearch(params)
-    data = search.get_dict()
-
-    os.makedirs("Flights/JSONs", exist_ok=True)
-    with open(f"Flights/JSONs/{filename}.json", "w", encoding="utf-8") as f:
-        json.dump(data, f, indent=2)
+    data = cached_search(params, bypass=bypass_cache)
 
-    print(f"✅ Saved {filename}.json with {len(data)} best flights.")
+    if save:
+        save_flights(data, filename)
     return data
 
 
+def save_flights(data, filename):
+    """Hands the response to the background artifact writer (see Shared/artifacts.py)."""
+    if write_artifact(f"flights_{filename}", data):
+        print(f"✅ Queued flights_{filename} artifact with {len(data)} best flights.")
+
+
+def prefetch_returns(base_params, cleaned_outbound, n):
+    """
+    Starts return-leg searches for the n best outbound itineraries by local
+    score, so the one the LLM picks is usually already in flight.
+    Returns {departure_token: Future}. Results are not saved to disk; the
+    ones not picked still land in the SerpAPI cache.
+    """
+    candidates = [f for f in rank_flights(cleaned_outbound, n) if f.get("departure_token")]
+    if not candidates:
+        return {}
+
+    futures = {}
+    for flight in candidates:
+        token = flight["departure_token"]
+        params = dict(base_params)
+        params["departure_token"] = token
+        futures[token] = submit(_prefetch_pool, fetch_flights, params, "return", save=False)
+
+    print(f"🔮 Prefetching return flights for {len(futures)} outbound candidates")
+    return futures
+
+
 # --------------------------------------------------
 # 5. LLM: Choose Best Flights
 # --------------------------------------------------
-def top_flights(flights_list, preferences, top_n=1, return_full_data=False):
+@traced("flights.select")
+def top_flights(flights_list, preferences, top_n=1, return_full_data=False, mode=None, stream=None, on_item=None):
     """
-    LLM selects top flights with optional full data return.
+    LLM selects top flights. It sees them indexed and without tokens, answers
+    with indices and reasons only, and the picks are rebuilt from flights_list:
+    every original field is returned whatever return_full_data says.
+    mode: "llm", "local" or "hybrid" (see Shared/ranking.py); defaults to TPM_FLIGHTS_SELECTION.
+    stream: read the reply as it streams and stop after top_n flights (default TPM_LLM_STREAM);
+    on_item(flight) is called as each selected flight completes.
     """
     if not flights_list:
         return []
 
-    with open("flights/prompts/flights_prompt.txt", "r", encoding="utf-8") as f:
-        system_prompt = f.read()
+    mode = selection_mode("flights", mode)
+    if mode == "local":
+        return rank_flights(flights_list, top_n, reason=True)
+    if mode == "hybrid":
+        flights_list = rank_flights(flights_list, max(HYBRID_TOP_K, top_n))
 
-    user_input = f"Here is the list of flights: {json.dumps(flights_list, ensure_ascii=False)}\n"
-    user_input += f"User preferences: {preferences}\n"
-    user_input += f"Please select the top {top_n} flights."
+    system_prompt = get_prompt("flights")
+
+    user_input = _top_flights_input(flights_list, preferences, top_n)
 
-    if return_full_data:
-        user_input += " Include all original fields in the output, do not remove anything. Only add a 'reason' field."
-    else:
-        user_input += " Return only essential fields needed for further processing (like departure_token or booking_token)."
+    if stream is None:
+        stream = STREAM_SELECTION
+    if stream:
+        picks, raw = stream_items(system_prompt, user_input, 500, ("final_flights",), top_n,
+                                  rehydrating(flights_list, on_item), "top_flights")
+        return rehydrate(picks or _parse_top_flights(raw), flights_list, top_n)
 
-    response = client.messages.create(
-        model="claude-sonnet-4-20250514",
-        max_tokens=1500,
-        system=system_prompt,
-        messages=[{"role": "user", "content": user_input}]
-    )
+    raw = complete(system_prompt, user_input, 500, "top_flights", top_n)
+    return rehydrate(_parse_top_flights(raw), flights_list, top_n)
+
+
+def _top_flights_input(flights_list, preferences, top_n):
+    candidates = index_candidates(flights_list, drop=LLM_HIDDEN_FIELDS)
+    payload = compact_payload("flights", candidates, row=flight_row,
+                              intern={"airlines": "A", "aircraft": "P", "class": "C"})
+    user_input = f"Here is the list of flights:\n{payload}\n"
+    user_input += f"User preferences: {preferences}\n"
+    user_input += f"Please select the top {top_n} flights. Return only their \"i\" and a short reason."
+    return user_input
 
-    raw = response.content[0].text.strip()
-    parsed = safe_parse(raw)
+
+def _parse_top_flights(raw):
+    parsed = safe_parse(raw, "top_flights")
 
     # Always return a list
     if isinstance(parsed, list):
@@ -168,13 +200,79 @@ def clean_flight_data_for_llm(serpapi_response, keep_fields=None):
 
     return cleaned
 
-def run_flights(user_text):
+def flight_row(flight):
+    """
+    One itinerary flattened for the compact LLM table (see Shared/compact.py):
+    per-leg airline / aircraft / class as lists, each leg as
+    "FLIGHT FROM time→TO time minutes", "!" marking legs often delayed.
+    """
+    legs = flight.get("flights", [])
+    layovers = flight.get("layovers", [])
+    emissions = flight.get("carbon_emissions") or {}
+    return {
+        "i": flight.get("i"),
+        "price": flight.get("price"),
+        "total_duration": flight.get("total_duration"),
+        "type": flight.get("type"),
+        "stops": len(layovers),
+        "layovers": [f"{stop.get('id') or stop.get('name')} {stop.get('duration')}m"
+                     + (" overnight" if stop.get("overnight") else "") for stop in layovers],
+        "co2_kg": (f"{emissions['this_flight'] // 1000} ({emissions.get('difference_percent', 0):+}%)"
+                   if emissions.get("this_flight") else None),
+        "airlines": [leg.get("airline") for leg in legs],
+        "aircraft": [leg.get("airplane") for leg in legs],
+        "class": [leg.get("travel_class") for leg in legs],
+        "legs": [
+            f"{leg.get('flight_number')} {(leg.get('departure_airport') or {}).get('id')} "
+            f"{(leg.get('departure_airport') or {}).get('time')}→{(leg.get('arrival_airport') or {}).get('id')} "
+            f"{(leg.get('arrival_airport') or {}).get('time')} {leg.get('duration')}m"
+            + ("!" if leg.get("often_delayed_by_over_30_min") else "")
+            for leg in legs
+        ],
+    }
+
+
+def pick_token(top_wrapped, token_field, label):
+    """Unwraps the LLM selection (possibly [{'final_flights': [...]}]) and returns the first flight's token."""
+    top = top_wrapped
+    if isinstance(top_wrapped, list) and len(top_wrapped) == 1:
+        item = top_wrapped[0]
+        if isinstance(item, dict) and "final_flights" in item:
+            top = item["final_flights"]
+
+    if not top:
+        raise ValueError(f"No {label} flights found after unwrapping 'final_flights'")
+
+    token = top[0].get(token_field)
+    if not token:
+        raise ValueError(f"No {token_field} found in {label} flight")
+    return token
+
+
+# --------------------------------------------------
+# 7. RUNNER
+# --------------------------------------------------
+@traced("pipeline.flights")
+def run_flights(user_text, base_params=None, constraints=None, speculative=None):
+    """
+    base_params: google_flights params already built from structured input
+    (see Shared/params_builder.py). When None, the LLM generates them from user_text.
+    constraints: hard limits for the pre-filter, e.g. {"max_layovers": 1, "max_duration": 900, "max_price": 3000}.
+    speculative: how many return searches to prefetch during outbound selection
+    (defaults to TPM_FLIGHTS_SPECULATIVE; skipped in "local" selection mode where picking is instant).
+    """
     start = time.time()
+    if speculative is None:
+        speculative = SPECULATIVE_RETURNS
+    if selection_mode("flights") == "local":
+        speculative = 0
+    prefetched = {}
     
     # ---- PHASE 1: Outbound Flights ----
     print("🔹 Phase 1: Fetch outbound flights")
     try:
-        base_params = get_flight_request(user_text)
+        if not base_params:
+            base_params = get_flight_request(user_text)
         if not base_params:
             raise ValueError("Failed to get flight request parameters")
     except Exception as e:
@@ -184,30 +282,25 @@ def run_flights(user_text):
     try:
         outbound_data = fetch_flights(base_params, "outbound")
         cleaned_outbound = clean_flight_data_for_llm(outbound_data, keep_fields=["departure_token"])
+        cleaned_outbound = prefilter_flights(cleaned_outbound, constraints)
+        if speculative > 0:
+            prefetched = prefetch_returns(base_params, cleaned_outbound, speculative)
         top_outbounds_wrapped = top_flights(cleaned_outbound, user_text, top_n=1, return_full_data=False)
         if not top_outbounds_wrapped:
             raise ValueError("No outbound flights selected by LLM")
     except Exception as e:
         print(f"❌ Error fetching or selecting outbound flights: {e}")
+        for future in prefetched.values():
+            future.cancel()
         return None
 
     # Unwrap 'final_flights' safely
     try:
-        top_outbounds = top_outbounds_wrapped
-        if isinstance(top_outbounds_wrapped, list) and len(top_outbounds_wrapped) == 1:
-            item = top_outbounds_wrapped[0]
-            if isinstance(item, dict) and "final_flights" in item:
-                top_outbounds = item["final_flights"]
-
-        if not top_outbounds:
-            raise ValueError("No outbound flights found after unwrapping 'final_flights'")
-
-        chosen_outbound = top_outbounds[0]
-        dep_token = chosen_outbound.get("departure_token")
-        if not dep_token:
-            raise ValueError("No departure_token found in outbound flight")
+        dep_token = pick_token(top_outbounds_wrapped, "departure_token", "outbound")
     except Exception as e:
         print(f"❌ Error processing outbound flight data: {e}")
+        for future in prefetched.values():
+            future.cancel()
         return None
 
     # ---- PHASE 2: Return Flights ----
@@ -216,8 +309,23 @@ def run_flights(user_text):
         return_params = dict(base_params)
         return_params["departure_token"] = dep_token
 
-        return_data = fetch_flights(return_params, "return")
+        # Keep the prefetched search matching the choice, drop the rest
+        return_data = None
+        future = prefetched.pop(dep_token, None)
+        for other in prefetched.values():
+            other.cancel()
+        if future is not None:
+            try:
+                return_data = future.result()
+                save_flights(return_data, "return")
+                print("⚡ Using prefetched return flights")
+            except Exception as e:
+                print(f"⚠️ Prefetched return search failed, retrying: {e}")
+
+        if return_data is None:
+            return_data = fetch_flights(return_params, "return")
         cleaned_return = clean_flight_data_for_llm(return_data, keep_fields=["booking_token"])
+        cleaned_return = prefilter_flights(cleaned_return, constraints)
         top_returns_wrapped = top_flights(cleaned_return, user_text, top_n=1, return_full_data=False)
         if not top_returns_wrapped:
             raise ValueError("No return flights selected by LLM")
@@ -227,19 +335,7 @@ def run_flights(user_text):
 
     # Unwrap return flights safely
     try:
-        top_returns = top_returns_wrapped
-        if isinstance(top_returns_wrapped, list) and len(top_returns_wrapped) == 1:
-            item = top_returns_wrapped[0]
-            if isinstance(item, dict) and "final_flights" in item:
-                top_returns = item["final_flights"]
-
-        if not top_returns:
-            raise ValueError("No return flights found after unwrapping 'final_flights'")
-
-        chosen_return = top_returns[0]
-        booking_token = chosen_return.get("booking_token")
-        if not booking_token:
-            raise ValueError("No booking_token found in return flight")
+        booking_token = pick_token(top_returns_wrapped, "booking_token", "return")
     except Exception as e:
         print(f"❌ Error processing return flight data: {e}")
         return None
@@ -257,3 +353,150 @@ def run_flights(user_text):
 
     print(f"\n✅ Finished full round-trip flow in {time.time() - start:.2f}s")
     return booking_data
+
+
+# --------------------------------------------------
+# 8. ASYNC VARIANTS
+# --------------------------------------------------
+async def get_flight_request_async(user_input):
+    try:
+        system_prompt = get_prompt("flights_request_gen")
+    except FileNotFoundError:
+        print("flights_request_gen_prompt.txt not found")
+        return None
+
+    async def generate():
+        return safe_parse(await complete_async(system_prompt, user_input, 1000, "flight_params"), "flight_params")
+
+    return await memoize_llm_async("flight_params", system_prompt, user_input, generate)
+
+
+async def fetch_flights_async(params, filename, bypass_cache=None, save=True):
+    params["api_key"] = SERPAPI_KEY
+    data = await cached_search_async(params, bypass=bypass_cache)
+
+    if save:
+        save_flights(data, filename)
+    return data
+
+
+def prefetch_returns_async(base_params, cleaned_outbound, n):
+    """Task-based prefetch_returns for the running event loop: {departure_token: Task}."""
+    tasks = {}
+    for flight in rank_flights(cleaned_outbound, n):
+        token = flight.get("departure_token")
+        if token:
+            params = dict(base_params)
+            params["departure_token"] = token
+            tasks[token] = asyncio.create_task(fetch_flights_async(params, "return", save=False))
+
+    if tasks:
+        print(f"🔮 Prefetching return flights for {len(tasks)} outbound candidates")
+    return tasks
+
+
+@traced("flights.select")
+async def top_flights_async(flights_list, preferences, top_n=1, return_full_data=False, mode=None, stream=None, on_item=None):
+    if not flights_list:
+        return []
+
+    mode = selection_mode("flights", mode)
+    if mode == "local":
+        return rank_flights(flights_list, top_n, reason=True)
+    if mode == "hybrid":
+        flights_list = rank_flights(flights_list, max(HYBRID_TOP_K, top_n))
+
+    system_prompt = get_prompt("flights")
+
+    user_input = _top_flights_input(flights_list, preferences, top_n)
+    if stream is None:
+        stream = STREAM_SELECTION
+    if stream:
+        picks, raw = await stream_items_async(system_prompt, user_input, 500, ("final_flights",), top_n,
+                                              rehydrating(flights_list, on_item), "top_flights")
+        return rehydrate(picks or _parse_top_flights(raw), flights_list, top_n)
+    raw = await complete_async(system_prompt, user_input, 500, "top_flights", top_n)
+    return rehydrate(_parse_top_flights(raw), flights_list, top_n)
+
+
+@traced("pipeline.flights")
+async def run_flights_async(user_text, base_params=None, constraints=None, speculative=None):
+    """Async run_flights: same phases and error handling, no threads."""
+    start = time.time()
+    if speculative is None:
+        speculative = SPECULATIVE_RETURNS
+    if selection_mode("flights") == "local":
+        speculative = 0
+    prefetched = {}
+
+    # ---- PHASE 1: Outbound Flights ----
+    print("🔹 Phase 1: Fetch outbound flights")
+    try:
+        if not base_params:
+            base_params = await get_flight_request_async(user_text)
+        if not base_params:
+            raise ValueError("Failed to get flight request parameters")
+    except Exception as e:
+        print(f"❌ Error in generating flight request: {e}")
+        return None
+
+    try:
+        outbound_data = await fetch_flights_async(base_params, "outbound")
+        cleaned_outbound = clean_flight_data_for_llm(outbound_data, keep_fields=["departure_token"])
+        cleaned_outbound = prefilter_flights(cleaned_outbound, constraints)
+        if speculative > 0:
+            prefetched = prefetch_returns_async(base_params, cleaned_outbound, speculative)
+        top_outbounds_wrapped = await top_flights_async(cleaned_outbound, user_text, top_n=1, return_full_data=False)
+        if not top_outbounds_wrapped:
+            raise ValueError("No outbound flights selected by LLM")
+        dep_token = pick_token(top_outbounds_wrapped, "departure_token", "outbound")
+    except Exception as e:
+        print(f"❌ Error fetching or selecting outbound flights: {e}")
+        for task in prefetched.values():
+            task.cancel()
+        return None
+
+    # ---- PHASE 2: Return Flights ----
+    print("\n🔹 Phase 2: Fetch return flights")
+    try:
+        return_params = dict(base_params)
+        return_params["departure_token"] = dep_token
+
+        # Keep the prefetched search matching the choice, cancel the rest
+        return_data = None
+        task = prefetched.pop(dep_token, None)
+        for other in prefetched.values():
+            other.cancel()
+        if task is not None:
+            try:
+                return_data = await task
+                save_flights(return_data, "return")
+                print("⚡ Using prefetched return flights")
+            except Exception as e:
+                print(f"⚠️ Prefetched return search failed, retrying: {e}")
+
+        if return_data is None:
+            return_data = await fetch_flights_async(return_params, "return")
+        cleaned_return = clean_flight_data_for_llm(return_data, keep_fields=["booking_token"])
+        cleaned_return = prefilter_flights(cleaned_return, constraints)
+        top_returns_wrapped = await top_flights_async(cleaned_return, user_text, top_n=1, return_full_data=False)
+        if not top_returns_wrapped:
+            raise ValueError("No return flights selected by LLM")
+        booking_token = pick_token(top_returns_wrapped, "booking_token", "return")
+    except Exception as e:
+        print(f"❌ Error fetching or selecting return flights: {e}")
+        return None
+
+    # ---- PHASE 3: Booking Flights ----
+    print("\n🔹 Phase 3: Fetch booking details")
+    try:
+        booking_params = dict(base_params)
+        booking_params["booking_token"] = booking_token
+
+        booking_data = await fetch_flights_async(booking_params, "booking")
+    except Exception as e:
+        print(f"❌ Error fetching booking data: {e}")
+        return None
+
+    print(f"\n✅ Finished full round-trip flow in {time.time() - start:.2f}s")
+    return booking_data
@@ -1,49 +1,44 @@
 # travel_hotels_pipeline.py
 
-import os, json, ast, re
+import os, json, ast
 from dotenv import load_dotenv
-from serpapi import GoogleSearch
-from anthropic import Anthropic
+
+from Shared.serp_cache import cached_search, cached_search_async
+from Shared.llm_cache import memoize_llm, memoize_llm_async
+from Shared.llm import complete, complete_async, stream_items, stream_items_async, STREAM_SELECTION
+from Shared.ranking import selection_mode, rank_hotels, HYBRID_TOP_K
+from Shared.prefilter import prefilter_hotels, qualifying_hotels, price_constraints_in
+from Shared.pagination import chain_pages, chain_pages_async
+from Shared.tracing import traced
+from Shared.prompts import get_prompt
+from Shared.artifacts import write_artifact
+from Shared.parsing import safe_parse
+from Shared.selection import index_candidates, rehydrate, rehydrating
+from Shared.compact import compact_payload
 
 # --------------------------------------------------------------------
 # 1. SETUP
 # --------------------------------------------------------------------
 load_dotenv()
 
-CLAUDE_API_KEY = os.environ.get("CLAUDE_API_KEY")
 SERPAPI_KEY = os.environ.get("SERPAPI_KEY")
 
-client = Anthropic(api_key=CLAUDE_API_KEY)
+# Result pages to read (next_page_token), stopping once TPM_HOTELS_TARGET
+# hotels within the constraints are in; 1 = first page only
+HOTEL_PAGES = int(os.environ.get("TPM_HOTELS_PAGES", "1"))
+HOTEL_TARGET = int(os.environ.get("TPM_HOTELS_TARGET", "40"))
+
+# Fields the LLM never needs: picks come back by index and are rebuilt locally
+LLM_HIDDEN_FIELDS = ("id", "link")
+
+# Columns of the compact hotel table (coordinates are not a ranking criterion)
+LLM_COLUMNS = ["i", "name", "price", "stars", "rating", "reviews", "location_rating", "sponsored", "amenities"]
 
 
 # --------------------------------------------------------------------
 # 2. HELPER — GENERIC SAFE PARSER
 # --------------------------------------------------------------------
-def safe_parse(text):
-    """Tries to safely parse stringified Python or JSON data."""
-    if not isinstance(text, str):
-        return text
-
-    s = text.strip()
-    if s.startswith("params"):
-        s = s.split("=", 1)[1].strip()
-
-    for parser in (ast.literal_eval, json.loads):
-        try:
-            return parser(s)
-        except Exception:
-            continue
-
-    m = re.search(r'(\{.*\}|\[.*\])', s, re.DOTALL)
-    if m:
-        content = m.group(1)
-        for parser in (ast.literal_eval, json.loads):
-            try:
-                return parser(content)
-            except Exception:
-                continue
-
-    return None
+# LLM output is parsed by Shared/parsing.py (safe_parse, per-stage schemas)
 
 
 # --------------------------------------------------------------------
@@ -51,92 +46,161 @@ def safe_parse(text):
 # --------------------------------------------------------------------
 def get_hotel_request(user_input):
     try:
-        with open("hotels/prompts/hotels_request_gen_prompt.txt", "r", encoding="utf-8") as f:
-            system_prompt = f.read()
+        system_prompt = get_prompt("hotels_request_gen")
     except FileNotFoundError:
         print("hotels_request_gen_prompt.txt not found")
         return None
 
-    response = client.messages.create(
-        model="claude-sonnet-4-20250514",
-        max_tokens=1000,
-        system=system_prompt,
-        messages=[{"role": "user", "content": user_input}]
-    )
+    def generate():
+        raw = complete(system_prompt, user_input, 1000, "hotel_params")
+        return safe_parse(raw, "hotel_params")
 
-    raw = response.content[0].text.strip()
-    return safe_parse(raw)
+    return memoize_llm("hotel_params", system_prompt, user_input, generate)
 
 
 # --------------------------------------------------------------------
 # 4. FETCH HOTELS FROM SERPAPI
 # --------------------------------------------------------------------
-def fetch_hotels(params):
+def fetch_hotels(params, bypass_cache=None, pages=None, constraints=None):
+    """
+    pages: result pages to read (default TPM_HOTELS_PAGES). Each page needs the
+    previous one's next_page_token, so pages are fetched one after another, not
+    concurrently. Each page's hotels are checked against the constraints as it
+    arrives, only to decide whether to read the next (see _enough_hotels); the
+    pre-filter proper (prefilter_hotels) runs once on the merged list.
+    """
     params["api_key"] = SERPAPI_KEY
-    search = GoogleSearch(params)
-    allHotelsData = search.get_dict()
-
-    with open("hotels/JSONs/hotels.json", "w", encoding="utf-8") as f:
-        json.dump(allHotelsData, f, indent=2)
-
-    clean_hotels = []
-    for hotel in allHotelsData.get("properties", []):
-        clean_hotels.append({
-            "id": hotel.get("property_token"),
-            "name": hotel.get("name"),
-            "price": hotel.get("rate_per_night", {}).get("extracted_lowest"),
-            "stars": hotel.get("extracted_hotel_class"),
-            "rating": hotel.get("overall_rating"),
-            "reviews": hotel.get("reviews"),
-            "location_rating": hotel.get("location_rating"),
-            "coordinates": hotel.get("gps_coordinates"),
-            "amenities": hotel.get("amenities", []),
-            "link": hotel.get("link"),
-            "sponsored": hotel.get("sponsored")
-        })
-
-    with open("hotels/JSONs/hotels_filtered.json", "w", encoding="utf-8") as f:
-        json.dump(clean_hotels, f, ensure_ascii=False, indent=2)
-
-    print(f"Wrote {len(clean_hotels)} hotels to hotels_filtered.json")
+    pages = HOTEL_PAGES if pages is None else pages
+    if pages <= 1:
+        allHotelsData = cached_search(params, bypass=bypass_cache)
+    else:
+        responses = chain_pages("hotels", params, lambda p: cached_search(p, bypass=bypass_cache),
+                                _next_hotel_page, pages, _enough_hotels(constraints))
+        allHotelsData = merge_hotel_pages(responses)
+    return process_hotels(allHotelsData)
+
+
+def _next_hotel_page(params, response):
+    token = (response.get("serpapi_pagination") or {}).get("next_page_token")
+    return {**params, "next_page_token": token} if token else None
+
+
+def _enough_hotels(constraints):
+    """
+    Stop paging once HOTEL_TARGET distinct hotels within the constraints are
+    in. Each page is cleaned and checked once, when it is appended.
+    """
+    checked, qualifying = [0], set()
+
+    def enough(responses):
+        for response in responses[checked[0]:]:
+            hotels = [clean_hotel(h) for h in response.get("properties", [])]
+            qualifying.update(h["id"] or h["name"] for h in qualifying_hotels(hotels, constraints))
+        checked[0] = len(responses)
+        return len(qualifying) >= HOTEL_TARGET
+    return enough
+
+
+def merge_hotel_pages(responses):
+    """The first page's response holding the properties of every page, without repeats."""
+    merged = dict(responses[0])
+    seen, properties = set(), []
+    for response in responses:
+        for hotel in response.get("properties", []):
+            token = hotel.get("property_token")
+            if token and token in seen:
+                continue
+            seen.add(token)
+            properties.append(hotel)
+    merged["properties"] = properties
+    print(f"📄 Read {len(responses)} hotel result pages, {len(properties)} properties")
+    return merged
+
+
+def clean_hotel(hotel):
+    """One property reduced to the fields the LLM needs."""
+    return {
+        "id": hotel.get("property_token"),
+        "name": hotel.get("name"),
+        "price": hotel.get("rate_per_night", {}).get("extracted_lowest"),
+        "stars": hotel.get("extracted_hotel_class"),
+        "rating": hotel.get("overall_rating"),
+        "reviews": hotel.get("reviews"),
+        "location_rating": hotel.get("location_rating"),
+        "coordinates": hotel.get("gps_coordinates"),
+        "amenities": hotel.get("amenities", []),
+        "link": hotel.get("link"),
+        "sponsored": hotel.get("sponsored")
+    }
+
+
+def process_hotels(allHotelsData):
+    """Saves the raw response, reduces each property to the fields the LLM needs, saves those too."""
+    write_artifact("hotels", allHotelsData)
+
+    clean_hotels = [clean_hotel(hotel) for hotel in allHotelsData.get("properties", [])]
+
+    write_artifact("hotels_filtered", clean_hotels)
+
+    print(f"Cleaned {len(clean_hotels)} hotels")
     return clean_hotels, allHotelsData
 
 
 # --------------------------------------------------------------------
 # 5. LLM FUNCTION — SELECT BEST HOTELS
 # --------------------------------------------------------------------
-def top_hotels(hotels, preferences, top_n=5):
+@traced("hotels.select")
+def top_hotels(hotels, preferences, top_n=5, mode=None, stream=None, on_item=None):
+    """
+    The LLM sees the hotels indexed and answers with indices and reasons only;
+    the picks are rebuilt from hotels (so they keep their "id" for match_full_details).
+    mode: "llm", "local" or "hybrid" (see Shared/ranking.py); defaults to TPM_HOTELS_SELECTION.
+    stream: parse the reply while it streams, stopping after top_n hotels (default TPM_LLM_STREAM).
+    """
+    mode = selection_mode("hotels", mode)
+    if mode == "local":
+        return rank_hotels(hotels, top_n, reason=True)
+    if mode == "hybrid":
+        hotels = rank_hotels(hotels, max(HYBRID_TOP_K, top_n))
+
     try:
-        with open("hotels/prompts/top_hotels_prompt.txt", "r", encoding="utf-8") as f:
-            system_prompt = f.read()
+        system_prompt = get_prompt("top_hotels")
     except FileNotFoundError:
         print("top_hotels_prompt.txt not found")
         return []
 
-    user_input = (
-        f"Here is the list of hotels: {json.dumps(hotels, ensure_ascii=False)}\n"
+    user_input = _top_hotels_input(hotels, preferences, top_n)
+
+    if stream is None:
+        stream = STREAM_SELECTION
+    if stream:
+        picks, raw = stream_items(system_prompt, user_input, 500, ("top_hotels",), top_n,
+                                  rehydrating(hotels, on_item), "top_hotels")
+        return rehydrate(picks or _parse_top_hotels(raw), hotels, top_n)
+
+    raw = complete(system_prompt, user_input, 500, "top_hotels", top_n)
+    return rehydrate(_parse_top_hotels(raw), hotels, top_n)
+
+
+def _top_hotels_input(hotels, preferences, top_n):
+    candidates = index_candidates(hotels, drop=LLM_HIDDEN_FIELDS)
+    payload = compact_payload("hotels", candidates, columns=LLM_COLUMNS, intern={"amenities": "a"})
+    return (
+        f"Here is the list of hotels:\n{payload}\n"
         f"User preferences: {preferences}\n"
         f"Please select the top {top_n} hotels that best match these preferences "
         f"and return only a Python dictionary in the specified format."
     )
 
-    response = client.messages.create(
-        model="claude-sonnet-4-20250514",
-        max_tokens=1000,
-        system=system_prompt,
-        messages=[{"role": "user", "content": user_input}]
-    )
 
-    raw = response.content[0].text.strip()
-    parsed = safe_parse(raw)
+def _parse_top_hotels(raw):
+    parsed = safe_parse(raw, "top_hotels")
 
     if isinstance(parsed, dict) and "top_hotels" in parsed:
         return parsed["top_hotels"]
     elif isinstance(parsed, list):
         return parsed
     else:
-        print("Failed to parse LLM output.")
-        print(raw)
         return []
 
 
@@ -145,11 +209,40 @@ def top_hotels(hotels, preferences, top_n=5):
 # 6. RUNNER FUNCTION
 # --------------------------------------------------------------------
 
-def run_hotels(user_text: str):
-    print("🔹 Generating search parameters...")
-    params = get_hotel_request(user_text)
+@traced("pipeline.hotels")
+def run_hotels(user_text: str, params=None, constraints=None):
+    """
+    params: google_hotels params already built from structured input
+    (see Shared/params_builder.py). When None, the LLM generates them from user_text.
+    constraints: hard limits for the pre-filter, e.g. {"min_price": 200, "max_price": 2000, "min_rating": 4};
+    an optional "currency" key gives the budget's currency, converted to the search's.
+    """
     if not params:
-        raise SystemExit("❌ Failed to generate search parameters.")
+        print("🔹 Generating search parameters...")
+        params = get_hotel_request(user_text)
+    params = prepare_params(params)
+    constraints = price_constraints_in(constraints, params.get("currency"))
+
+    # Fetch hotels from Google Hotels API
+    print("\n🔹 Fetching hotel results from Google Hotels...")
+    hotelsEssentialDetails, hotelsFullData = fetch_hotels(params, constraints=constraints)
+    
+    if not hotelsEssentialDetails:
+        raise RuntimeError("❌ No hotels found in API response.")
+
+    # Drop hotels outside the hard constraints and keep the top-K before the LLM sees them
+    candidates = prefilter_hotels(hotelsEssentialDetails, constraints)
+
+    # Ask LLM to pick top matches
+    print("\n🔹 Selecting best hotels using LLM...")
+    topHotels = top_hotels(candidates, user_text)
+    return match_full_details(topHotels, hotelsFullData)
+
+
+def prepare_params(params):
+    """Validates the generated params (dict or stringified dict) and saves them for debugging."""
+    if not params:
+        raise RuntimeError("❌ Failed to generate search parameters.")
 
     # If params is a string, try to convert it to a dict safely
     if isinstance(params, str):
@@ -158,28 +251,17 @@ def run_hotels(user_text: str):
         except Exception:
             params = ast.literal_eval(params)
 
-    os.makedirs("hotels/JSONs", exist_ok=True)
-    with open("hotels/JSONs/hotel_params.json", "w", encoding="utf-8") as f:
-        json.dump(params, f, ensure_ascii=False, indent=2)
-        
-    print("✅ Hotel parameters saved to hotels/JSONs/hotel_params.json")
+    write_artifact("hotel_params", params)
+    print("✅ Hotel parameters ready")
+    return params
 
-    # Fetch hotels from Google Hotels API
-    print("\n🔹 Fetching hotel results from Google Hotels...")
-    hotelsEssentialDetails, hotelsFullData = fetch_hotels(params)
-    
-    if not hotelsEssentialDetails:
-        raise SystemExit("❌ No hotels found in API response.")
 
-    # Ask LLM to pick top matches
-    print("\n🔹 Selecting best hotels using LLM...")
-    topHotels = top_hotels(hotelsEssentialDetails, user_text)
+@traced("hotels.rehydrate")
+def match_full_details(topHotels, hotelsFullData):
+    """Maps the selected hotel ids back to the full SerpAPI property records."""
     if not topHotels:
-        raise SystemExit("❌ Failed to get best hotels from LLM.")
+        raise RuntimeError("❌ Failed to get best hotels from LLM.")
 
-    # Match top hotels to their detailed info (use hotelsEssentialDetails which is the list of cleaned hotels)
-    top_ids = {th.get("id") for th in topHotels if th.get("id")}
-    
     # Extract the IDs of the top hotels
     top_ids = {th.get("id") for th in topHotels if th.get("id")}
 
@@ -194,4 +276,78 @@ def run_hotels(user_text: str):
     #     print(json.dumps(topHotelsFullDetails[0], indent=2, ensure_ascii=False))
 
     return topHotelsFullDetails
-    
\ No newline at end of file
+
+
+# --------------------------------------------------------------------
+# 7. ASYNC VARIANTS
+# --------------------------------------------------------------------
+async def get_hotel_request_async(user_input):
+    try:
+        system_prompt = get_prompt("hotels_request_gen")
+    except FileNotFoundError:
+        print("hotels_request_gen_prompt.txt not found")
+        return None
+
+    async def generate():
+        return safe_parse(await complete_async(system_prompt, user_input, 1000, "hotel_params"), "hotel_params")
+
+    return await memoize_llm_async("hotel_params", system_prompt, user_input, generate)
+
+
+async def fetch_hotels_async(params, bypass_cache=None, pages=None, constraints=None):
+    params["api_key"] = SERPAPI_KEY
+    pages = HOTEL_PAGES if pages is None else pages
+    if pages <= 1:
+        allHotelsData = await cached_search_async(params, bypass=bypass_cache)
+    else:
+        responses = await chain_pages_async("hotels", params, lambda p: cached_search_async(p, bypass=bypass_cache),
+                                            _next_hotel_page, pages, _enough_hotels(constraints))
+        allHotelsData = merge_hotel_pages(responses)
+    return process_hotels(allHotelsData)
+
+
+@traced("hotels.select")
+async def top_hotels_async(hotels, preferences, top_n=5, mode=None, stream=None, on_item=None):
+    mode = selection_mode("hotels", mode)
+    if mode == "local":
+        return rank_hotels(hotels, top_n, reason=True)
+    if mode == "hybrid":
+        hotels = rank_hotels(hotels, max(HYBRID_TOP_K, top_n))
+
+    try:
+        system_prompt = get_prompt("top_hotels")
+    except FileNotFoundError:
+        print("top_hotels_prompt.txt not found")
+        return []
+
+    user_input = _top_hotels_input(hotels, preferences, top_n)
+    if stream is None:
+        stream = STREAM_SELECTION
+    if stream:
+        picks, raw = await stream_items_async(system_prompt, user_input, 500, ("top_hotels",), top_n,
+                                              rehydrating(hotels, on_item), "top_hotels")
+        return rehydrate(picks or _parse_top_hotels(raw), hotels, top_n)
+    raw = await complete_async(system_prompt, user_input, 500, "top_hotels", top_n)
+    return rehydrate(_parse_top_hotels(raw), hotels, top_n)
+
+
+@traced("pipeline.hotels")
+async def run_hotels_async(user_text: str, params=None, constraints=None):
+    """Async run_hotels: same stages and errors, no threads."""
+    if not params:
+        print("🔹 Generating search parameters...")
+        params = await get_hotel_request_async(user_text)
+    params = prepare_params(params)
+    constraints = price_constraints_in(constraints, params.get("currency"))
+
+    print("\n🔹 Fetching hotel results from Google Hotels...")
+    hotelsEssentialDetails, hotelsFullData = await fetch_hotels_async(params, constraints=constraints)
+
+    if not hotelsEssentialDetails:
+        raise RuntimeError("❌ No hotels found in API response.")
+
+    candidates = prefilter_hotels(hotelsEssentialDetails, constraints)
+
+    print("\n🔹 Selecting best hotels using LLM...")
+    topHotels = await top_hotels_async(candidates, user_text)
+    return match_full_details(topHotels, hotelsFullData)
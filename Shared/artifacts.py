@@ -0,0 +1,125 @@
+# artifacts.py
+
+import os, json, gzip, uuid, queue, atexit, threading
+
+from Shared.tracing import current_trace
+
+# --------------------------------------------------------------------
+# 1. SETUP
+# --------------------------------------------------------------------
+# Debug copies of SerpAPI responses and generated params.
+#   off     → nothing is written (production)
+#   compact → minified JSON
+#   pretty  → indent=2 JSON (the old Flights/JSONs, hotels/JSONs format)
+#   gzip    → minified JSON, gzip-compressed
+ARTIFACT_FORMATS = ("off", "compact", "pretty", "gzip")
+ARTIFACTS = os.environ.get("TPM_ARTIFACTS", "compact").lower()
+if ARTIFACTS not in ARTIFACT_FORMATS:
+    ARTIFACTS = "compact"
+ARTIFACT_DIR = os.environ.get("TPM_ARTIFACT_DIR", ".tpm_artifacts")
+# Pending writes beyond this are dropped rather than slowing searches down
+ARTIFACT_QUEUE_SIZE = int(os.environ.get("TPM_ARTIFACT_QUEUE_SIZE", "256"))
+
+_queue = queue.Queue(maxsize=ARTIFACT_QUEUE_SIZE)
+_lock = threading.Lock()
+_worker = None
+ARTIFACT_STATS = {"queued": 0, "written": 0, "dropped": 0, "failed": 0, "bytes": 0}
+
+
+# --------------------------------------------------------------------
+# 2. API
+# --------------------------------------------------------------------
+def search_id():
+    """The current search's ID: its trace ID, so artifacts line up with exported traces."""
+    trace = current_trace()
+    return trace.trace_id if trace else "no-search"
+
+
+def write_artifact(name, data, fmt=None):
+    """
+    Queues data to be written as <ARTIFACT_DIR>/<search_id>/<name>.json[.gz]
+    on the background writer and returns immediately. Top-level dicts/lists
+    are copied, so callers may keep adding keys; nested values must not be mutated.
+    """
+    fmt = fmt or ARTIFACTS
+    if fmt == "off":
+        return None
+
+    if isinstance(data, dict):
+        data = dict(data)
+    elif isinstance(data, list):
+        data = list(data)
+
+    path = os.path.join(ARTIFACT_DIR, search_id(), f"{name}.json" + (".gz" if fmt == "gzip" else ""))
+    _ensure_worker()
+    try:
+        _queue.put_nowait((path, data, fmt))
+    except queue.Full:
+        _count("dropped")
+        return None
+    _count("queued")
+    return path
+
+
+def flush_artifacts(timeout=None):
+    """Blocks until every queued artifact is written (or timeout seconds pass)."""
+    if _worker is None:
+        return
+    done = threading.Event()
+    _queue.put((None, done, None))
+    done.wait(timeout)
+
+
+def artifact_stats():
+    with _lock:
+        return dict(ARTIFACT_STATS)
+
+
+# --------------------------------------------------------------------
+# 3. BACKGROUND WRITER
+# --------------------------------------------------------------------
+def _count(key, n=1):
+    with _lock:
+        ARTIFACT_STATS[key] += n
+
+
+def _ensure_worker():
+    global _worker
+    if _worker is None:
+        with _lock:
+            if _worker is None:
+                _worker = threading.Thread(target=_run, name="artifact-writer", daemon=True)
+                _worker.start()
+                atexit.register(flush_artifacts, 5)
+
+
+def _run():
+    while True:
+        path, data, fmt = _queue.get()
+        if path is None:
+            data.set()  # flush marker
+            continue
+        try:
+            _count("bytes", _write(path, data, fmt))
+            _count("written")
+        except Exception as e:
+            _count("failed")
+            print(f"⚠️ Could not write artifact {path}: {e}")
+
+
+def _write(path, data, fmt):
+    if fmt == "pretty":
+        payload = json.dumps(data, ensure_ascii=False, indent=2, default=list)
+    else:
+        payload = json.dumps(data, ensure_ascii=False, separators=(",", ":"), default=list)
+    payload = payload.encode("utf-8")
+    if fmt == "gzip":
+        payload = gzip.compress(payload, compresslevel=5)
+
+    # Write-then-rename: readers never see a half-written file
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp = f"{path}.{uuid.uuid4().hex[:8]}.tmp"
+    with open(tmp, "wb") as f:
+        f.write(payload)
+    os.replace(tmp, path)
+    return len(payload)
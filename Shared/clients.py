@@ -0,0 +1,160 @@
+# clients.py
+
+import os, asyncio, weakref, threading
+import httpx
+from dotenv import load_dotenv
+from anthropic import Anthropic, AsyncAnthropic
+
+from Shared.tracing import set_attributes
+from Shared.rate_limit import throttled
+from Shared.resilience import TransientError, TRANSIENT_STATUSES
+
+# --------------------------------------------------------------------
+# 1. SETUP
+# --------------------------------------------------------------------
+load_dotenv()
+
+CLAUDE_API_KEY = os.environ.get("CLAUDE_API_KEY")
+SERPAPI_ENDPOINT = "https://serpapi.com/search"
+
+# Pool sizing: one run_TPM makes up to ~7 upstream calls, several at once
+HTTP_MAX_CONNECTIONS = int(os.environ.get("TPM_HTTP_MAX_CONNECTIONS", "50"))
+HTTP_MAX_KEEPALIVE = int(os.environ.get("TPM_HTTP_MAX_KEEPALIVE", "20"))
+HTTP_KEEPALIVE_EXPIRY = float(os.environ.get("TPM_HTTP_KEEPALIVE_EXPIRY", "60"))
+HTTP_CONNECT_TIMEOUT = float(os.environ.get("TPM_HTTP_CONNECT_TIMEOUT", "5"))
+SERPAPI_TIMEOUT = float(os.environ.get("TPM_SERPAPI_TIMEOUT", "60"))
+LLM_TIMEOUT = float(os.environ.get("TPM_LLM_TIMEOUT", "60"))
+
+# HTTP/2 needs the optional h2 package (pip install "httpx[http2]")
+try:
+    import h2  # noqa: F401
+    HTTP2_AVAILABLE = True
+except ImportError:
+    HTTP2_AVAILABLE = False
+HTTP2_ENABLED = HTTP2_AVAILABLE and os.environ.get("TPM_HTTP2", "true").lower() not in ("0", "false", "no")
+
+_lock = threading.Lock()
+_sync_clients = {}
+
+# Async clients hold connections bound to the event loop that opened them,
+# so each running loop gets its own pair (Streamlit calls asyncio.run per search).
+_async_clients = weakref.WeakKeyDictionary()
+
+
+def _limits():
+    return httpx.Limits(
+        max_connections=HTTP_MAX_CONNECTIONS,
+        max_keepalive_connections=HTTP_MAX_KEEPALIVE,
+        keepalive_expiry=HTTP_KEEPALIVE_EXPIRY,
+    )
+
+
+def _timeout(read):
+    return httpx.Timeout(read, connect=HTTP_CONNECT_TIMEOUT)
+
+
+# --------------------------------------------------------------------
+# 2. SYNC CLIENTS (shared by every thread)
+# --------------------------------------------------------------------
+def _get_sync(name, factory):
+    client = _sync_clients.get(name)
+    if client is None:
+        with _lock:
+            client = _sync_clients.get(name)
+            if client is None:
+                client = factory()
+                _sync_clients[name] = client
+    return client
+
+
+def _new_anthropic(cls, http_client_cls):
+    http_client = http_client_cls(limits=_limits(), http2=HTTP2_ENABLED, timeout=_timeout(LLM_TIMEOUT))
+    # Retries are done by Shared/resilience.py, within the search budget
+    try:
+        return cls(api_key=CLAUDE_API_KEY, timeout=LLM_TIMEOUT, max_retries=0, http_client=http_client)
+    except TypeError:
+        # SDK builds on a different HTTP stack than this httpx: keep its own
+        # (still keep-alive) pool; the client instance is shared either way
+        return cls(api_key=CLAUDE_API_KEY, timeout=LLM_TIMEOUT, max_retries=0)
+
+
+def get_anthropic():
+    """Process-wide Anthropic client on a pooled keep-alive connection."""
+    return _get_sync("anthropic", lambda: _new_anthropic(Anthropic, httpx.Client))
+
+
+def get_http():
+    """Process-wide httpx.Client used for SerpAPI."""
+    return _get_sync("http", lambda: httpx.Client(
+        limits=_limits(), http2=HTTP2_ENABLED, timeout=_timeout(SERPAPI_TIMEOUT),
+    ))
+
+
+def serpapi_get(params, timeout=None):
+    """
+    Equivalent of GoogleSearch(params).get_dict() over the shared connection pool.
+    Raises TransientError on 429 / 5xx so the caller can retry.
+    """
+    query = dict(params)
+    query["output"] = "json"
+    response = get_http().get(SERPAPI_ENDPOINT, params=query, timeout=_timeout(timeout or SERPAPI_TIMEOUT))
+    return _serpapi_json(response)
+
+
+def _serpapi_json(response):
+    set_attributes(status=response.status_code, payload_bytes=len(response.content))
+    if response.status_code == 429:
+        throttled("serpapi", response.headers)
+    if response.status_code in TRANSIENT_STATUSES:
+        raise TransientError(f"SerpAPI answered {response.status_code}")
+    return response.json()
+
+
+# --------------------------------------------------------------------
+# 3. ASYNC CLIENTS (one set per event loop)
+# --------------------------------------------------------------------
+def _loop_clients():
+    loop = asyncio.get_running_loop()
+    clients = _async_clients.get(loop)
+    if clients is None:
+        clients = {
+            "anthropic": _new_anthropic(AsyncAnthropic, httpx.AsyncClient),
+            "http": httpx.AsyncClient(limits=_limits(), http2=HTTP2_ENABLED, timeout=_timeout(SERPAPI_TIMEOUT)),
+        }
+        _async_clients[loop] = clients
+    return clients
+
+
+def get_async_anthropic():
+    """AsyncAnthropic client for the running event loop."""
+    return _loop_clients()["anthropic"]
+
+
+def get_async_http():
+    """httpx.AsyncClient for the running event loop."""
+    return _loop_clients()["http"]
+
+
+async def serpapi_get_async(params, timeout=None):
+    """Async equivalent of GoogleSearch(params).get_dict()."""
+    query = dict(params)
+    query["output"] = "json"
+    response = await get_async_http().get(SERPAPI_ENDPOINT, params=query, timeout=_timeout(timeout or SERPAPI_TIMEOUT))
+    return _serpapi_json(response)
+
+
+async def close_async_clients():
+    """Closes the running loop's clients; call before the loop shuts down."""
+    clients = _async_clients.pop(asyncio.get_running_loop(), None)
+    if clients:
+        await clients["anthropic"].close()
+        await clients["http"].aclose()
+
+
+def close_clients():
+    """Closes the shared sync clients (they are recreated on next use)."""
+    with _lock:
+        clients = list(_sync_clients.values())
+        _sync_clients.clear()
+    for client in clients:
+        client.close()
@@ -0,0 +1,114 @@
+# compact.py
+
+import os, json, threading
+from collections import Counter
+
+from Shared.prefilter import estimate_tokens
+from Shared.tracing import set_attributes
+
+# --------------------------------------------------------------------
+# 1. SETUP
+# --------------------------------------------------------------------
+# Candidate lists go to the LLM as a table (header row + one row per
+# candidate) instead of JSON objects that repeat every key. Off → JSON.
+COMPACT_PAYLOADS = os.environ.get("TPM_LLM_COMPACT", "true").lower() not in ("0", "false", "no")
+
+SEPARATOR = "|"
+LIST_SEPARATOR = ", "
+
+_lock = threading.Lock()
+COMPACT_STATS = {"calls": 0, "tokens_json": 0, "tokens_compact": 0}
+
+
+# --------------------------------------------------------------------
+# 2. ENCODING
+# --------------------------------------------------------------------
+def _cell(value):
+    """One table cell: scalars as-is, lists joined, dicts as compact JSON; never breaks the row."""
+    if value is None:
+        return ""
+    if isinstance(value, bool):
+        return "true" if value else "false"
+    if isinstance(value, (list, tuple, set)):
+        return LIST_SEPARATOR.join(_cell(v) for v in value)
+    if isinstance(value, dict):
+        value = json.dumps(value, ensure_ascii=False, separators=(",", ":"))
+    return " ".join(str(value).split()).replace(SEPARATOR, "/")
+
+
+def _interned(records, column, prefix):
+    """{value: code} for the strings repeated across records in column (e.g. amenities, airlines)."""
+    counts = Counter()
+    for record in records:
+        value = record.get(column)
+        for v in value if isinstance(value, (list, tuple, set)) else [value]:
+            if isinstance(v, str):
+                counts[v] += 1
+    repeated = [v for v, n in counts.most_common() if n > 1 and len(v) > len(prefix) + 2]
+    return {v: f"{prefix}{n}" for n, v in enumerate(repeated, 1)}
+
+
+def _apply(value, codes):
+    if isinstance(value, (list, tuple, set)):
+        return [codes.get(v, v) if isinstance(v, str) else v for v in value]
+    return codes.get(value, value) if isinstance(value, str) else value
+
+
+def encode_table(records, columns=None, intern=None):
+    """
+    Renders records as
+
+        Legend: a1=Free Wi-Fi; a2=Free breakfast
+        i|name|price|amenities
+        0|Hotel Arbat|328|a1, a2, Bar
+
+    columns defaults to every key, in first-seen order. intern maps columns
+    to a code prefix: their values (or list elements) repeated across rows
+    are written once in the legend.
+    """
+    if columns is None:
+        columns = list(dict.fromkeys(key for record in records for key in record))
+
+    lines, codes = [], {}
+    for column, prefix in (intern or {}).items():
+        column_codes = _interned(records, column, prefix)
+        codes[column] = column_codes
+        if column_codes:
+            lines.append("Legend: " + "; ".join(f"{code}={_cell(v)}" for v, code in column_codes.items()))
+
+    lines.append(SEPARATOR.join(columns))
+    for record in records:
+        lines.append(SEPARATOR.join(_cell(_apply(record.get(c), codes.get(c, {}))) for c in columns))
+    return "\n".join(lines)
+
+
+# --------------------------------------------------------------------
+# 3. API
+# --------------------------------------------------------------------
+def compact_payload(label, records, row=None, columns=None, intern=None):
+    """
+    The candidate list for a prompt: encode_table(...) when TPM_LLM_COMPACT
+    is on, else JSON. row(record) may flatten a record and drop fields the
+    ranking never uses first. Estimated tokens of both layouts go to the
+    span, COMPACT_STATS and the log.
+    """
+    as_json = json.dumps(records, ensure_ascii=False)
+    if not COMPACT_PAYLOADS:
+        return as_json
+
+    table = encode_table([row(r) for r in records] if row else records, columns, intern)
+    tokens_json, tokens_compact = estimate_tokens(as_json), estimate_tokens(table)
+    with _lock:
+        COMPACT_STATS["calls"] += 1
+        COMPACT_STATS["tokens_json"] += tokens_json
+        COMPACT_STATS["tokens_compact"] += tokens_compact
+    set_attributes(tokens_json=tokens_json, tokens_compact=tokens_compact)
+    print(f"🗜️ Compact {label}: ~{tokens_json} → ~{tokens_compact} tokens")
+    return table
+
+
+def compact_stats():
+    with _lock:
+        stats = dict(COMPACT_STATS)
+    stats["tokens_saved"] = stats["tokens_json"] - stats["tokens_compact"]
+    return stats
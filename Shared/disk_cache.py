@@ -0,0 +1,135 @@
+# disk_cache.py
+
+import os, json, time, sqlite3, hashlib, threading
+
+# --------------------------------------------------------------------
+# 1. SETUP
+# --------------------------------------------------------------------
+CACHE_DIR = os.environ.get("TPM_CACHE_DIR", ".tpm_cache")
+
+
+# --------------------------------------------------------------------
+# 2. HELPERS
+# --------------------------------------------------------------------
+def make_key(*parts):
+    """Stable content hash for any JSON-serializable key parts."""
+    raw = json.dumps(parts, sort_keys=True, ensure_ascii=False, default=str)
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+def _json_default(obj):
+    # LLM-generated params sometimes contain Python sets (e.g. hotel amenities)
+    if isinstance(obj, (set, frozenset)):
+        return sorted(obj, key=str)
+    return str(obj)
+
+
+# --------------------------------------------------------------------
+# 3. SQLITE-BACKED CACHE
+# --------------------------------------------------------------------
+class DiskCache:
+    """
+    Small on-disk key/value store shared by every thread and process
+    that points at the same CACHE_DIR.
+
+    - values are stored as JSON text
+    - each entry has its own expiry (ttl in seconds, None = never)
+    - when max_entries or max_bytes is exceeded, the least recently
+      used entries are evicted
+    - hit/miss/write/eviction counters are kept per instance in .stats
+    """
+
+    def __init__(self, name, max_entries=5000, max_bytes=200 * 1024 * 1024):
+        self.name = name
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.stats = {"hits": 0, "misses": 0, "expired": 0, "writes": 0, "evictions": 0}
+
+        os.makedirs(CACHE_DIR, exist_ok=True)
+        self.path = os.path.join(CACHE_DIR, f"{name}.sqlite3")
+
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None, timeout=10)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            """CREATE TABLE IF NOT EXISTS entries (
+                key TEXT PRIMARY KEY,
+                value TEXT NOT NULL,
+                size INTEGER NOT NULL,
+                created REAL NOT NULL,
+                expires REAL,
+                accessed REAL NOT NULL
+            )"""
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS entries_accessed ON entries (accessed)")
+
+    def get(self, key):
+        """Returns the cached value or None on a miss / expired entry."""
+        return self.get_entry(key)[0]
+
+    def get_entry(self, key):
+        """Returns (value, age in seconds since it was stored), or (None, None) on a miss / expired entry."""
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT value, created, expires FROM entries WHERE key = ?", (key,)
+            ).fetchone()
+
+            if row is None:
+                self.stats["misses"] += 1
+                return None, None
+
+            value, created, expires = row
+            if expires is not None and expires <= now:
+                self._conn.execute("DELETE FROM entries WHERE key = ?", (key,))
+                self.stats["expired"] += 1
+                self.stats["misses"] += 1
+                return None, None
+
+            self._conn.execute("UPDATE entries SET accessed = ? WHERE key = ?", (now, key))
+            self.stats["hits"] += 1
+
+        return json.loads(value), now - created
+
+    def set(self, key, value, ttl=None):
+        now = time.time()
+        raw = json.dumps(value, ensure_ascii=False, separators=(",", ":"), default=_json_default)
+        expires = now + ttl if ttl is not None else None
+
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO entries (key, value, size, created, expires, accessed) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                (key, raw, len(raw), now, expires, now),
+            )
+            self.stats["writes"] += 1
+            self._evict(now)
+
+    def delete(self, key):
+        with self._lock:
+            self._conn.execute("DELETE FROM entries WHERE key = ?", (key,))
+
+    def clear(self):
+        with self._lock:
+            self._conn.execute("DELETE FROM entries")
+
+    def _evict(self, now):
+        """Drops expired entries, then least recently used ones until under both limits."""
+        self._conn.execute("DELETE FROM entries WHERE expires IS NOT NULL AND expires <= ?", (now,))
+
+        count, total = self._conn.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM entries").fetchone()
+        if count <= self.max_entries and total <= self.max_bytes:
+            return
+
+        rows = self._conn.execute("SELECT key, size FROM entries ORDER BY accessed ASC").fetchall()
+        victims = []
+        for key, size in rows:
+            if count <= self.max_entries and total <= self.max_bytes:
+                break
+            victims.append((key,))
+            count -= 1
+            total -= size
+
+        self._conn.executemany("DELETE FROM entries WHERE key = ?", victims)
+        self.stats["evictions"] += len(victims)
@@ -0,0 +1,112 @@
+# json_stream.py
+
+import re, ast, json
+
+# --------------------------------------------------------------------
+# 1. INCREMENTAL ARRAY PARSER
+# --------------------------------------------------------------------
+class ArrayItemParser:
+    """
+    Pulls the objects of one array out of an LLM reply while it streams in.
+
+    The target array is either the first top-level array of the reply or the
+    value of one of `keys` in the top-level object ({"top_hotels": [...]}).
+    Works on JSON and on Python-literal output (single quotes, True/None),
+    and ignores prose or code fences around the data.
+
+        parser = ArrayItemParser(keys=("top_hotels",))
+        for chunk in stream:
+            for item in parser.feed(chunk):
+                ...
+            if parser.done:
+                break
+    """
+
+    def __init__(self, keys=()):
+        self.key_pattern = (
+            re.compile(r"""["'](?:%s)["']\s*:\s*$""" % "|".join(re.escape(k) for k in keys)) if keys else None
+        )
+        self.buffer = ""
+        self.done = False        # target array closed
+        self.count = 0
+        self._pos = 0
+        self._stack = []         # open "{" / "[" outside the target array, then inside it
+        self._quote = None       # quote char while inside a string
+        self._escape = False
+        self._target_depth = None
+        self._item_start = None
+
+    def feed(self, chunk):
+        """Adds text; returns the items whose objects closed in it."""
+        self.buffer += chunk
+        items = []
+        while self._pos < len(self.buffer) and not self.done:
+            item = self._step(self.buffer[self._pos])
+            self._pos += 1
+            if item is not None:
+                items.append(item)
+        self.count += len(items)
+        return items
+
+    def _step(self, ch):
+        if self._quote:
+            if self._escape:
+                self._escape = False
+            elif ch == "\\":
+                self._escape = True
+            elif ch == self._quote:
+                self._quote = None
+            return None
+
+        # Strings only count inside a structure: prose like "Here's" must not open one
+        if ch in "\"'" and self._stack:
+            self._quote = ch
+        elif ch in "[{":
+            if ch == "[" and self._target_depth is None and self._is_target():
+                self._target_depth = len(self._stack) + 1
+            elif ch == "{" and self._target_depth is not None and len(self._stack) == self._target_depth:
+                self._item_start = self._pos
+            self._stack.append(ch)
+        elif ch in "]}" and self._stack:
+            self._stack.pop()
+            depth = len(self._stack)
+            if self._target_depth is not None:
+                if ch == "}" and depth == self._target_depth and self._item_start is not None:
+                    text, self._item_start = self.buffer[self._item_start:self._pos + 1], None
+                    try:
+                        value = parse_literal(text)
+                    except ValueError:
+                        return None
+                    return value if isinstance(value, dict) else None
+                if ch == "]" and depth == self._target_depth - 1:
+                    self.done = True
+        return None
+
+    def _is_target(self):
+        if not self._stack:
+            return self.key_pattern is None or not self._seen_object()
+        if len(self._stack) == 1 and self._stack[0] == "{" and self.key_pattern is not None:
+            return bool(self.key_pattern.search(self.buffer[:self._pos]))
+        return False
+
+    def _seen_object(self):
+        return "{" in self.buffer[:self._pos]
+
+
+# --------------------------------------------------------------------
+# 2. LITERALS
+# --------------------------------------------------------------------
+def parse_literal(text):
+    """
+    Parses one JSON or Python-literal value (single quotes, True/None),
+    tolerating trailing commas. Raises ValueError if it is neither.
+    """
+    for parser in (json.loads, ast.literal_eval):
+        try:
+            return parser(text)
+        except Exception:
+            continue
+    try:
+        return json.loads(re.sub(r",(\s*[\]}])", r"\1", text))
+    except Exception:
+        raise ValueError("not a JSON or Python literal") from None
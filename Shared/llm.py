@@ -0,0 +1,320 @@
+# llm.py
+
+import os, time, threading
+from contextlib import contextmanager, asynccontextmanager
+from anthropic import RateLimitError
+
+from Shared.clients import get_anthropic, get_async_anthropic, LLM_TIMEOUT
+from Shared.tracing import span, set_attributes
+from Shared.json_stream import ArrayItemParser, parse_literal
+from Shared.disk_cache import make_key
+from Shared.singleflight import single_flight
+from Shared.rate_limit import rate_limiter, throttled
+from Shared.resilience import resilient_call, resilient_call_async, call_timeout, deadline_passed
+from Shared.tools import stage_tool, tool_result
+
+# --------------------------------------------------------------------
+# 1. SETUP
+# --------------------------------------------------------------------
+MODEL = "claude-sonnet-4-20250514"
+
+# Selection stages stream the reply and stop as soon as the items they need are complete
+STREAM_SELECTION = os.environ.get("TPM_LLM_STREAM", "true").lower() not in ("0", "false", "no")
+
+# Marks the static system prompt as a cacheable prefix (Anthropic prompt caching).
+# The API only caches prefixes above a model-specific minimum (1024 tokens for
+# Sonnet); shorter prompts are sent as usual and simply report no cached tokens.
+PROMPT_CACHING = os.environ.get("TPM_PROMPT_CACHE", "true").lower() not in ("0", "false", "no")
+
+_lock = threading.Lock()
+LLM_USAGE = {
+    "calls": 0,
+    "input_tokens": 0,            # uncached input
+    "cache_read_input_tokens": 0,
+    "cache_creation_input_tokens": 0,
+    "output_tokens": 0,
+}
+
+
+# Identical concurrent calls (same prompt, input and limits) share one request
+_in_flight = single_flight("llm")
+
+
+def llm_usage_stats():
+    with _lock:
+        return dict(LLM_USAGE)
+
+
+def _request(system_prompt, user_input, max_tokens, tool=None):
+    """messages.create / messages.stream arguments shared by every call; a tool is forced when given."""
+    system = system_prompt
+    if PROMPT_CACHING:
+        system = [{"type": "text", "text": system_prompt, "cache_control": {"type": "ephemeral"}}]
+    request = {
+        "model": MODEL,
+        "max_tokens": max_tokens,
+        "system": system,
+        "messages": [{"role": "user", "content": user_input}],
+    }
+    if tool:
+        request["tools"] = [tool]
+        request["tool_choice"] = {"type": "tool", "name": tool["name"]}
+    return request
+
+
+def _structured(stage, limit, max_tokens):
+    """(tool, max_tokens, spec) for the call: the stage's tool when structured output is on (Shared/tools.py)."""
+    return stage_tool(stage, limit, max_tokens) or (None, max_tokens, None)
+
+
+@contextmanager
+def _limited():
+    """Waits for an Anthropic rate-limit slot; a 429 pauses every other caller too."""
+    with rate_limiter("anthropic").slot():
+        try:
+            yield
+        except RateLimitError as e:
+            throttled("anthropic", e.response.headers)
+            raise
+
+
+@asynccontextmanager
+async def _limited_async():
+    async with rate_limiter("anthropic").slot_async():
+        try:
+            yield
+        except RateLimitError as e:
+            throttled("anthropic", e.response.headers)
+            raise
+
+
+# --------------------------------------------------------------------
+# 2. COMPLETIONS
+# --------------------------------------------------------------------
+def complete(system_prompt, user_input, max_tokens, stage=None, limit=None):
+    """
+    One Claude round-trip on the shared client; returns the stripped reply text.
+    With a stage that has a tool (Shared/tools.py) the model answers through
+    that tool instead and the already structured tool input is returned,
+    max_tokens being cut to the tool's budget (limit: items to select).
+    """
+    key = make_key("complete", system_prompt, user_input, max_tokens, stage, limit)
+    return _in_flight.do(key, _complete, system_prompt, user_input, _structured(stage, limit, max_tokens))
+
+
+async def complete_async(system_prompt, user_input, max_tokens, stage=None, limit=None):
+    """Async version of complete."""
+    key = make_key("complete", system_prompt, user_input, max_tokens, stage, limit)
+    return await _in_flight.do_async(key, _complete_async, system_prompt, user_input,
+                                     _structured(stage, limit, max_tokens))
+
+
+def _complete(system_prompt, user_input, structured):
+    tool, max_tokens, spec = structured
+    with span("llm.call", model=MODEL, max_tokens=max_tokens, input_chars=len(system_prompt) + len(user_input),
+              tool=tool["name"] if tool else None):
+        response = resilient_call("anthropic", _create, system_prompt, user_input, max_tokens, tool)
+        _record_usage(response)
+        return _reply(response, spec)
+
+
+async def _complete_async(system_prompt, user_input, structured):
+    tool, max_tokens, spec = structured
+    with span("llm.call", model=MODEL, max_tokens=max_tokens, input_chars=len(system_prompt) + len(user_input),
+              tool=tool["name"] if tool else None):
+        response = await resilient_call_async("anthropic", _create_async, system_prompt, user_input, max_tokens, tool)
+        _record_usage(response)
+        return _reply(response, spec)
+
+
+def _create(system_prompt, user_input, max_tokens, tool=None):
+    with _limited():
+        return get_anthropic().messages.create(**_request(system_prompt, user_input, max_tokens, tool),
+                                               timeout=call_timeout(LLM_TIMEOUT))
+
+
+async def _create_async(system_prompt, user_input, max_tokens, tool=None):
+    async with _limited_async():
+        return await get_async_anthropic().messages.create(**_request(system_prompt, user_input, max_tokens, tool),
+                                                           timeout=call_timeout(LLM_TIMEOUT))
+
+
+def _reply(response, spec):
+    """The tool call's input for a structured call, else (or if the model answered in text) the stripped text."""
+    if response.stop_reason == "max_tokens":
+        set_attributes(truncated=True)
+    if spec is not None:
+        for block in response.content:
+            if block.type == "tool_use":
+                return tool_result(block.input, spec)
+    return "".join(block.text for block in response.content if block.type == "text").strip()
+
+
+def _record_usage(response):
+    """Adds the call's token usage (uncached, cache read / write, output) to the span and LLM_USAGE."""
+    usage = getattr(response, "usage", None)
+    if usage is None:
+        return
+    counts = {key: getattr(usage, key, 0) or 0 for key in LLM_USAGE if key != "calls"}
+    set_attributes(**counts)
+    with _lock:
+        LLM_USAGE["calls"] += 1
+        for key, value in counts.items():
+            LLM_USAGE[key] += value
+
+
+# --------------------------------------------------------------------
+# 3. STREAMED SELECTION
+# --------------------------------------------------------------------
+def stream_items(system_prompt, user_input, max_tokens, keys=(), limit=None, on_item=None, stage=None):
+    """
+    Streams the reply and parses the selected items (see ArrayItemParser)
+    as their objects close. Stops reading once `limit` items are complete or
+    the array closes; closing the stream early also stops generation.
+    Returns (items, raw); callers fall back to parsing raw when items is empty.
+    With a stage that has a tool (see complete) the items are read from the
+    tool input as it streams, and raw is the parsed tool input when complete.
+    A call that joins an identical one already streaming gets on_item for
+    every item once that call finishes.
+    """
+    key = make_key("stream", system_prompt, user_input, max_tokens, keys, limit, stage)
+    delivered, forward = _forwarder(on_item)
+    result = _in_flight.do(key, _stream_items, system_prompt, user_input, _structured(stage, limit, max_tokens),
+                           keys, limit, forward)
+    return _replay(result, delivered, on_item)
+
+
+async def stream_items_async(system_prompt, user_input, max_tokens, keys=(), limit=None, on_item=None, stage=None):
+    """Async version of stream_items."""
+    key = make_key("stream", system_prompt, user_input, max_tokens, keys, limit, stage)
+    delivered, forward = _forwarder(on_item)
+    result = await _in_flight.do_async(key, _stream_items_async, system_prompt, user_input,
+                                       _structured(stage, limit, max_tokens), keys, limit, forward)
+    return _replay(result, delivered, on_item)
+
+
+def _forwarder(on_item):
+    """on_item wrapper that remembers what it passed on (nothing, for a call that joined another)."""
+    delivered = []
+
+    def forward(item):
+        delivered.append(item)
+        if on_item:
+            on_item(item)
+
+    return delivered, forward
+
+
+def _replay(result, delivered, on_item):
+    """Passes on the items on_item has not seen yet, i.e. all of them for a call that joined another."""
+    items, raw = result
+    if on_item:
+        for item in items[len(delivered):]:
+            on_item(item)
+    return items, raw
+
+
+def _stream_items(system_prompt, user_input, structured, keys, limit, on_item):
+    tool, max_tokens, spec = structured
+    with span("llm.stream", model=MODEL, max_tokens=max_tokens, input_chars=len(system_prompt) + len(user_input),
+              tool=tool["name"] if tool else None):
+        start = time.perf_counter()
+        keys = (spec["result"],) if spec else keys
+        # Streams are retried but never hedged: on_item must not see items twice
+        parser, items = resilient_call("anthropic", _stream_attempt, system_prompt, user_input, max_tokens, tool,
+                                       keys, limit, on_item, start, hedge=False)
+        _record_stream(parser, items, limit)
+        return items, _stream_reply(parser, spec)
+
+
+async def _stream_items_async(system_prompt, user_input, structured, keys, limit, on_item):
+    tool, max_tokens, spec = structured
+    with span("llm.stream", model=MODEL, max_tokens=max_tokens, input_chars=len(system_prompt) + len(user_input),
+              tool=tool["name"] if tool else None):
+        start = time.perf_counter()
+        keys = (spec["result"],) if spec else keys
+        parser, items = await resilient_call_async("anthropic", _stream_attempt_async, system_prompt, user_input,
+                                                   max_tokens, tool, keys, limit, on_item, start, hedge=False)
+        _record_stream(parser, items, limit)
+        return items, _stream_reply(parser, spec)
+
+
+def _stream_reply(parser, spec):
+    """The raw reply; for a tool call, its input once the streamed JSON is complete."""
+    if spec is None:
+        return parser.buffer
+    try:
+        return tool_result(parse_literal(parser.buffer), spec)
+    except ValueError:
+        return parser.buffer
+
+
+def _stream_attempt(system_prompt, user_input, max_tokens, tool, keys, limit, on_item, start):
+    """
+    One streamed request. Stops at the search deadline with what it has; an
+    error after items were passed to on_item also keeps them instead of retrying.
+    """
+    parser, items = ArrayItemParser(keys), []
+    try:
+        # The slot is held until the stream closes
+        with _limited(), get_anthropic().messages.stream(**_request(system_prompt, user_input, max_tokens, tool),
+                                                         timeout=call_timeout(LLM_TIMEOUT)) as stream:
+            for event in stream:
+                text = _delta(event)
+                if text and (_collect(parser, text, items, limit, on_item, start) or deadline_passed()):
+                    break
+            # Input/cache usage arrives with the first event, so it is known even after stopping early
+            _record_usage(stream.current_message_snapshot)
+    except Exception as e:
+        if not items:
+            raise
+        set_attributes(interrupted=str(e))
+    return parser, items
+
+
+async def _stream_attempt_async(system_prompt, user_input, max_tokens, tool, keys, limit, on_item, start):
+    parser, items = ArrayItemParser(keys), []
+    try:
+        async with _limited_async(), \
+                get_async_anthropic().messages.stream(**_request(system_prompt, user_input, max_tokens, tool),
+                                                      timeout=call_timeout(LLM_TIMEOUT)) as stream:
+            async for event in stream:
+                text = _delta(event)
+                if text and (_collect(parser, text, items, limit, on_item, start) or deadline_passed()):
+                    break
+            _record_usage(stream.current_message_snapshot)
+    except Exception as e:
+        if not items:
+            raise
+        set_attributes(interrupted=str(e))
+    return parser, items
+
+
+def _delta(event):
+    """Reply text carried by a stream event: a text delta, or a JSON delta of the tool input."""
+    if event.type == "text":
+        return event.text
+    if event.type == "input_json":
+        return event.partial_json
+    return None
+
+
+def _collect(parser, text, items, limit, on_item, start):
+    """Feeds one text delta; returns True once no more output is needed."""
+    for item in parser.feed(text):
+        if not items:
+            set_attributes(first_item_s=round(time.perf_counter() - start, 3))
+        items.append(item)
+        if on_item:
+            on_item(item)
+        if limit and len(items) >= limit:
+            return True
+    return parser.done
+
+
+def _record_stream(parser, items, limit):
+    set_attributes(
+        items=len(items),
+        output_chars=len(parser.buffer),
+        stopped_early=bool(limit and len(items) >= limit and not parser.done),
+    )
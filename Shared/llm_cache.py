@@ -0,0 +1,99 @@
+# llm_cache.py
+
+import os, re
+
+from Shared.disk_cache import DiskCache, make_key
+from Shared.tracing import span, set_attributes
+from Shared.prompts import text_hash
+from Shared.singleflight import single_flight
+
+# --------------------------------------------------------------------
+# 1. SETUP
+# --------------------------------------------------------------------
+# Generated params embed dates that must stay "in the future", so
+# entries expire after a day even though the mapping is deterministic.
+LLM_CACHE_TTL = int(os.environ.get("TPM_LLM_CACHE_TTL", str(24 * 60 * 60)))
+LLM_CACHE_BYPASS = os.environ.get("TPM_LLM_CACHE_BYPASS", "").lower() in ("1", "true", "yes")
+
+_cache = DiskCache(
+    "llm",
+    max_entries=int(os.environ.get("TPM_LLM_CACHE_MAX_ENTRIES", "10000")),
+    max_bytes=50 * 1024 * 1024,
+)
+_in_flight = single_flight("llm.memo")
+
+
+# --------------------------------------------------------------------
+# 2. HELPERS
+# --------------------------------------------------------------------
+def normalize_text(text):
+    """Case-folds and collapses whitespace so equivalent requests share an entry."""
+    return re.sub(r"\s+", " ", str(text)).strip().casefold()
+
+
+def prompt_hash(system_prompt):
+    return text_hash(system_prompt)
+
+
+def llm_cache_stats():
+    return dict(_cache.stats)
+
+
+def clear_llm_cache():
+    _cache.clear()
+
+
+# --------------------------------------------------------------------
+# 3. MEMOIZED CALL
+# --------------------------------------------------------------------
+def memoize_llm(stage, system_prompt, user_input, generate, ttl=None):
+    """
+    Returns the cached result for (stage, prompt content, normalized input),
+    or calls generate() and stores its result. Empty results (None, {}, [])
+    are never stored so a failed parse is retried next time. Concurrent
+    misses for the same key wait for one generate() call.
+    """
+    with span("llm.memo", stage=stage):
+        key, cached = _lookup(stage, system_prompt, user_input)
+        if cached is not None:
+            return cached
+
+        def run():
+            result = generate()
+            _store(key, result, ttl)
+            return result
+
+        return _in_flight.do(key, run)
+
+
+async def memoize_llm_async(stage, system_prompt, user_input, generate, ttl=None):
+    """Same as memoize_llm, with generate being a coroutine function."""
+    with span("llm.memo", stage=stage):
+        key, cached = _lookup(stage, system_prompt, user_input)
+        if cached is not None:
+            return cached
+
+        async def run():
+            result = await generate()
+            _store(key, result, ttl)
+            return result
+
+        return await _in_flight.do_async(key, run)
+
+
+def _lookup(stage, system_prompt, user_input):
+    key = make_key("llm", stage, prompt_hash(system_prompt), normalize_text(user_input))
+    if LLM_CACHE_BYPASS:
+        set_attributes(cache="bypass")
+        return key, None
+
+    cached = _cache.get(key)
+    set_attributes(cache="hit" if cached is not None else "miss")
+    if cached is not None:
+        print(f"⚡ LLM cache hit ({stage})")
+    return key, cached
+
+
+def _store(key, result, ttl):
+    if result:
+        _cache.set(key, result, LLM_CACHE_TTL if ttl is None else ttl)
@@ -0,0 +1,113 @@
+# pagination.py
+
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+
+from Shared.tracing import span, set_attributes, submit
+
+# --------------------------------------------------------------------
+# 1. SETUP
+# --------------------------------------------------------------------
+# Extra result pages run here; each page is one cached_search / swr_search call
+_page_pool = ThreadPoolExecutor(max_workers=8, thread_name_prefix="serp-page")
+
+
+def _failed(label, n, error):
+    print(f"⚠️ {label} page {n + 1} failed, keeping {n} page(s): {error}")
+
+
+# --------------------------------------------------------------------
+# 2. CONCURRENT PAGES (offset pagination)
+# --------------------------------------------------------------------
+def fetch_pages(label, params_list, fetch, enough):
+    """
+    Fetches every params in params_list (one per page) concurrently with
+    fetch(params) and returns the responses in page order. Pages are taken
+    as they complete in order: once enough(responses) holds, the remaining
+    pages are dropped (cancelled if not started; running ones still land in
+    the cache). A failed later page ends the list; the first page's error is raised.
+    """
+    with span("serpapi.pages", label=label, requested=len(params_list)):
+        futures = [submit(_page_pool, fetch, params) for params in params_list]
+        responses = []
+        try:
+            for future in futures:
+                try:
+                    responses.append(future.result())
+                except Exception as e:
+                    if not responses:
+                        raise
+                    _failed(label, len(responses), e)
+                    break
+                if enough(responses):
+                    break
+        finally:
+            for future in futures:
+                future.cancel()
+        set_attributes(pages=len(responses))
+        return responses
+
+
+async def fetch_pages_async(label, params_list, fetch, enough):
+    """fetch_pages for a coroutine fetch; pages still running at the early stop are cancelled."""
+    with span("serpapi.pages", label=label, requested=len(params_list)):
+        tasks = [asyncio.ensure_future(fetch(params)) for params in params_list]
+        responses = []
+        try:
+            for task in tasks:
+                try:
+                    responses.append(await task)
+                except Exception as e:
+                    if not responses:
+                        raise
+                    _failed(label, len(responses), e)
+                    break
+                if enough(responses):
+                    break
+        finally:
+            for task in tasks:
+                if not task.done():
+                    task.cancel()
+        set_attributes(pages=len(responses))
+        return responses
+
+
+# --------------------------------------------------------------------
+# 3. CHAINED PAGES (next_page_token pagination)
+# --------------------------------------------------------------------
+def chain_pages(label, params, fetch, next_params, pages, enough):
+    """
+    Follows up to `pages` pages where each page's params come from the
+    previous response (next_params(params, response), None at the end), so
+    they can only be fetched one after another. Stops once enough(responses) holds.
+    """
+    with span("serpapi.pages", label=label, requested=pages):
+        responses = [fetch(params)]
+        while len(responses) < pages and not enough(responses):
+            params = next_params(params, responses[-1])
+            if not params:
+                break
+            try:
+                responses.append(fetch(params))
+            except Exception as e:
+                _failed(label, len(responses), e)
+                break
+        set_attributes(pages=len(responses))
+        return responses
+
+
+async def chain_pages_async(label, params, fetch, next_params, pages, enough):
+    """chain_pages for a coroutine fetch."""
+    with span("serpapi.pages", label=label, requested=pages):
+        responses = [await fetch(params)]
+        while len(responses) < pages and not enough(responses):
+            params = next_params(params, responses[-1])
+            if not params:
+                break
+            try:
+                responses.append(await fetch(params))
+            except Exception as e:
+                _failed(label, len(responses), e)
+                break
+        set_attributes(pages=len(responses))
+        return responses
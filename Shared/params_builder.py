@@ -0,0 +1,288 @@
+# params_builder.py
+
+import re, datetime
+
+# --------------------------------------------------------------------
+# 1. LOOKUP TABLES
+# --------------------------------------------------------------------
+# city (lower-case) -> (IATA airport code(s), ISO country code)
+# Several codes are comma-separated, which SerpAPI accepts for multi-airport cities.
+CITY_AIRPORTS = {
+    # GCC
+    "riyadh": ("RUH", "sa"),
+    "jeddah": ("JED", "sa"),
+    "dammam": ("DMM", "sa"),
+    "khobar": ("DMM", "sa"),
+    "al khobar": ("DMM", "sa"),
+    "dhahran": ("DMM", "sa"),
+    "medina": ("MED", "sa"),
+    "madinah": ("MED", "sa"),
+    "mecca": ("JED", "sa"),
+    "makkah": ("JED", "sa"),
+    "abha": ("AHB", "sa"),
+    "tabuk": ("TUU", "sa"),
+    "taif": ("TIF", "sa"),
+    "qassim": ("ELQ", "sa"),
+    "buraidah": ("ELQ", "sa"),
+    "hail": ("HAS", "sa"),
+    "jazan": ("GIZ", "sa"),
+    "alula": ("ULH", "sa"),
+    "al ula": ("ULH", "sa"),
+    "dubai": ("DXB", "ae"),
+    "abu dhabi": ("AUH", "ae"),
+    "sharjah": ("SHJ", "ae"),
+    "doha": ("DOH", "qa"),
+    "kuwait": ("KWI", "kw"),
+    "kuwait city": ("KWI", "kw"),
+    "manama": ("BAH", "bh"),
+    "bahrain": ("BAH", "bh"),
+    "muscat": ("MCT", "om"),
+    "salalah": ("SLL", "om"),
+    # Middle East & Africa
+    "cairo": ("CAI", "eg"),
+    "sharm el sheikh": ("SSH", "eg"),
+    "amman": ("AMM", "jo"),
+    "beirut": ("BEY", "lb"),
+    "istanbul": ("IST,SAW", "tr"),
+    "antalya": ("AYT", "tr"),
+    "trabzon": ("TZX", "tr"),
+    "bodrum": ("BJV", "tr"),
+    "baku": ("GYD", "az"),
+    "tbilisi": ("TBS", "ge"),
+    "yerevan": ("EVN", "am"),
+    "casablanca": ("CMN", "ma"),
+    "marrakech": ("RAK", "ma"),
+    "tunis": ("TUN", "tn"),
+    "nairobi": ("NBO", "ke"),
+    "zanzibar": ("ZNZ", "tz"),
+    "cape town": ("CPT", "za"),
+    "johannesburg": ("JNB", "za"),
+    # Central Asia & Russia
+    "almaty": ("ALA", "kz"),
+    "astana": ("NQZ", "kz"),
+    "tashkent": ("TAS", "uz"),
+    "samarkand": ("SKD", "uz"),
+    "bishkek": ("FRU", "kg"),
+    "moscow": ("SVO,DME,VKO", "ru"),
+    "saint petersburg": ("LED", "ru"),
+    "st petersburg": ("LED", "ru"),
+    "kazan": ("KZN", "ru"),
+    # Europe
+    "london": ("LHR,LGW,STN", "gb"),
+    "manchester": ("MAN", "gb"),
+    "edinburgh": ("EDI", "gb"),
+    "paris": ("CDG,ORY", "fr"),
+    "nice": ("NCE", "fr"),
+    "geneva": ("GVA", "ch"),
+    "zurich": ("ZRH", "ch"),
+    "interlaken": ("ZRH", "ch"),
+    "vienna": ("VIE", "at"),
+    "munich": ("MUC", "de"),
+    "frankfurt": ("FRA", "de"),
+    "berlin": ("BER", "de"),
+    "amsterdam": ("AMS", "nl"),
+    "brussels": ("BRU", "be"),
+    "rome": ("FCO", "it"),
+    "milan": ("MXP,LIN", "it"),
+    "venice": ("VCE", "it"),
+    "madrid": ("MAD", "es"),
+    "barcelona": ("BCN", "es"),
+    "malaga": ("AGP", "es"),
+    "lisbon": ("LIS", "pt"),
+    "athens": ("ATH", "gr"),
+    "prague": ("PRG", "cz"),
+    "budapest": ("BUD", "hu"),
+    "warsaw": ("WAW", "pl"),
+    "sarajevo": ("SJJ", "ba"),
+    "copenhagen": ("CPH", "dk"),
+    "stockholm": ("ARN", "se"),
+    "oslo": ("OSL", "no"),
+    "helsinki": ("HEL", "fi"),
+    # Asia & Pacific
+    "kuala lumpur": ("KUL", "my"),
+    "langkawi": ("LGK", "my"),
+    "penang": ("PEN", "my"),
+    "jakarta": ("CGK", "id"),
+    "bali": ("DPS", "id"),
+    "denpasar": ("DPS", "id"),
+    "singapore": ("SIN", "sg"),
+    "bangkok": ("BKK,DMK", "th"),
+    "phuket": ("HKT", "th"),
+    "tokyo": ("HND,NRT", "jp"),
+    "osaka": ("KIX", "jp"),
+    "seoul": ("ICN,GMP", "kr"),
+    "beijing": ("PEK,PKX", "cn"),
+    "shanghai": ("PVG,SHA", "cn"),
+    "hong kong": ("HKG", "hk"),
+    "maldives": ("MLE", "mv"),
+    "male": ("MLE", "mv"),
+    "colombo": ("CMB", "lk"),
+    "delhi": ("DEL", "in"),
+    "new delhi": ("DEL", "in"),
+    "mumbai": ("BOM", "in"),
+    "karachi": ("KHI", "pk"),
+    "lahore": ("LHE", "pk"),
+    "islamabad": ("ISB", "pk"),
+    "sydney": ("SYD", "au"),
+    "melbourne": ("MEL", "au"),
+    # Americas
+    "new york": ("JFK,EWR,LGA", "us"),
+    "washington": ("IAD,DCA", "us"),
+    "los angeles": ("LAX", "us"),
+    "chicago": ("ORD", "us"),
+    "miami": ("MIA", "us"),
+    "toronto": ("YYZ", "ca"),
+    "vancouver": ("YVR", "ca"),
+}
+
+GCC_COUNTRIES = {"sa", "ae", "kw", "qa", "om", "bh"}
+
+_ISO_DATE = re.compile(r"\d{4}-\d{2}-\d{2}")
+_IATA_CODE = re.compile(r"^[A-Za-z]{3}$")
+
+
+# --------------------------------------------------------------------
+# 2. HELPERS
+# --------------------------------------------------------------------
+def _normalize_city(city):
+    return re.sub(r"\s+", " ", str(city or "")).strip().lower()
+
+
+def known_city(location):
+    """The CITY_AIRPORTS key a typed city refers to, or None for anything not in the table."""
+    key = _normalize_city(location)
+    if key in CITY_AIRPORTS:
+        return key
+
+    # "Riyadh, Saudi Arabia" / "Almaty (ALA)"
+    head = re.split(r"[,(]", key)[0].strip()
+    return head if head in CITY_AIRPORTS else None
+
+
+def resolve_airport(location):
+    """
+    Returns (airport code(s), country code or None) for a city name or
+    a 3-letter IATA code, or (None, None) when it can't be resolved. A bare
+    3-letter word counts as a code only when typed in capitals or listed in
+    CITY_AIRPORTS ("Goa" is a city, not GOA/Genoa).
+    """
+    city = known_city(location)
+    if city:
+        return CITY_AIRPORTS[city]
+
+    raw = str(location or "").strip()
+    if _IATA_CODE.match(raw):
+        code = raw.upper()
+        for codes, country in CITY_AIRPORTS.values():
+            if code in codes.split(","):
+                return code, country
+        if raw.isupper():
+            return code, None
+
+    return None, None
+
+
+def parse_dates(dates):
+    """
+    Accepts "YYYY-MM-DD to YYYY-MM-DD" (what main.py sends), a single date
+    or a (start, end) tuple of dates. Returns (start, end) ISO strings or
+    (None, None) if they are missing, malformed or not in the future.
+    """
+    if isinstance(dates, (tuple, list)):
+        found = [str(d) for d in dates if d]
+    else:
+        found = _ISO_DATE.findall(str(dates or ""))
+
+    if not found:
+        return None, None
+
+    try:
+        start = datetime.date.fromisoformat(found[0])
+        end = datetime.date.fromisoformat(found[-1])
+    except ValueError:
+        return None, None
+
+    if start < datetime.date.today() or end < start:
+        return None, None
+
+    return start.isoformat(), end.isoformat()
+
+
+def _travelers(travelers):
+    try:
+        n = int(travelers)
+    except (TypeError, ValueError):
+        return None
+    return str(n) if n >= 1 else None
+
+
+def _locale(from_city):
+    """Same currency/gl defaults the request-gen prompts apply: SAR/sa for GCC origins."""
+    _, country = resolve_airport(from_city)
+    if country in GCC_COUNTRIES:
+        return "SAR", "sa"
+    return "USD", ""
+
+
+# --------------------------------------------------------------------
+# 3. BUILDERS
+# --------------------------------------------------------------------
+def build_flight_params(from_city, to_city, travelers, dates):
+    """google_flights params from the typed form fields, or None if anything can't be resolved."""
+    departure_id, _ = resolve_airport(from_city)
+    arrival_id, _ = resolve_airport(to_city)
+    outbound_date, return_date = parse_dates(dates)
+    adults = _travelers(travelers)
+
+    if not (departure_id and arrival_id and outbound_date and adults):
+        return None
+
+    currency, gl = _locale(from_city)
+    return {
+        "engine": "google_flights",
+        "departure_id": departure_id,
+        "arrival_id": arrival_id,
+        "outbound_date": outbound_date,
+        "return_date": return_date,
+        "adults": adults,
+        "children": "0",
+        "currency": currency,
+        "gl": gl,
+        "hl": "en",
+        "type": "1",
+        "travel_class": "1",
+        "sort_by": "1",
+        "api_key": "",
+    }
+
+
+def build_hotel_params(from_city, to_city, travelers, dates):
+    """
+    google_hotels params from the typed form fields, or None if anything can't
+    be resolved. Only cities in CITY_AIRPORTS are taken as typed; anything else
+    (e.g. a misspelling like "Vinna") is left to the LLM, which normalises it.
+    """
+    city = re.sub(r"\s+", " ", str(to_city or "")).strip()
+    check_in_date, check_out_date = parse_dates(dates)
+    adults = _travelers(travelers)
+
+    if not (known_city(city) and check_in_date and adults):
+        return None
+
+    # Google Hotels needs at least one night
+    if check_out_date == check_in_date:
+        check_out_date = (datetime.date.fromisoformat(check_in_date) + datetime.timedelta(days=1)).isoformat()
+
+    currency, gl = _locale(from_city)
+    return {
+        "engine": "google_hotels",
+        "q": f"Hotels in {city}",
+        "check_in_date": check_in_date,
+        "check_out_date": check_out_date,
+        "adults": adults,
+        "children": "0",
+        "currency": currency,
+        "gl": gl,
+        "hl": "en",
+        "api_key": "",
+    }
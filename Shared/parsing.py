@@ -0,0 +1,157 @@
+# parsing.py
+
+import re, time, threading
+
+from Shared.json_stream import ArrayItemParser, parse_literal
+from Shared.tracing import set_attributes
+
+# --------------------------------------------------------------------
+# 1. SCHEMAS
+# --------------------------------------------------------------------
+# What each stage's LLM output must look like (a small JSON-schema subset:
+# type object/array/string, required, items, anyOf). "salvage" lists the keys
+# whose array may be cut off (max_tokens): its complete items are kept.
+# Selections answer with the candidates' indices (see Shared/selection.py)
+_ITEMS = {"type": "array", "items": {"type": "object", "required": ["i"]}}
+
+SCHEMAS = {
+    "flight_params": {"type": "object", "required": ["engine", "departure_id", "arrival_id", "outbound_date"]},
+    "hotel_params": {"type": "object", "required": ["engine", "q", "check_in_date"]},
+    "fix_city": {"type": "object", "required": ["city"], "properties": {"city": {"type": "string"}}},
+    "top_flights": {"anyOf": [_ITEMS, {"type": "object"}], "salvage": ("final_flights",)},
+    "top_hotels": {"anyOf": [{"type": "object", "required": ["top_hotels"]}, _ITEMS], "salvage": ("top_hotels",)},
+    "top_items": {**_ITEMS, "salvage": ()},
+}
+
+_TYPES = {"object": dict, "array": list, "string": str}
+
+_FENCE = re.compile(r"```[a-zA-Z]*")
+_ASSIGNMENT = re.compile(r"^\s*[A-Za-z_]\w*\s*=\s*")          # "params = {...}"
+_TOKENS = re.compile(r"""\\.|["'\[\]{}]""", re.DOTALL)        # the only characters the scanner needs
+
+_lock = threading.Lock()
+PARSE_STATS = {}   # stage -> {"calls", "ok", "tool", "salvaged", "no_json", "syntax", "schema", "seconds"}
+
+
+def validate(value, schema):
+    """True if value matches schema (see SCHEMAS)."""
+    if "anyOf" in schema:
+        return any(validate(value, option) for option in schema["anyOf"])
+    expected = _TYPES.get(schema.get("type"))
+    if expected is not None and not isinstance(value, expected):
+        return False
+    if isinstance(value, dict):
+        if any(key not in value for key in schema.get("required", ())):
+            return False
+        for key, sub in schema.get("properties", {}).items():
+            if key in value and not validate(value[key], sub):
+                return False
+    if isinstance(value, list) and "items" in schema:
+        return all(validate(item, schema["items"]) for item in value)
+    return True
+
+
+# --------------------------------------------------------------------
+# 2. SCANNER
+# --------------------------------------------------------------------
+def scan_values(text):
+    """
+    Yields every top-level balanced {...} / [...] span of text as (start, end)
+    in one left-to-right pass. Brackets inside strings don't count; strings
+    only open inside a structure, so apostrophes in prose are ignored.
+    """
+    stack, quote, start = [], None, 0
+    for match in _TOKENS.finditer(text):
+        token = match.group()
+        if quote:
+            if token == quote:
+                quote = None
+            continue
+        if token in ("'", '"'):
+            if stack:
+                quote = token
+        elif token in ("[", "{"):
+            if not stack:
+                start = match.start()
+            stack.append(token)
+        elif token in ("]", "}") and stack:
+            opener = stack.pop()
+            if (opener == "[") != (token == "]"):
+                stack.clear()  # mismatched: not a value, start over
+            elif not stack:
+                yield start, match.end()
+
+
+def strip_fences(text):
+    return _FENCE.sub("", text).strip()
+
+
+# --------------------------------------------------------------------
+# 3. PARSER
+# --------------------------------------------------------------------
+def safe_parse(text, stage=None):
+    """
+    Extracts the structured value from an LLM reply: strips code fences and a
+    leading "name =" assignment, then tries the whole text and every balanced
+    value found by scan_values (largest first), keeping the first that parses
+    (JSON or Python literal, trailing commas allowed) and matches the stage's
+    schema. A truncated array keeps its complete items. Returns None on failure;
+    parse time and failure modes are counted per stage (parse_stats()).
+    A value that is already structured (a tool call's input, see Shared/tools.py)
+    only goes through the schema check.
+    """
+    if text is None:
+        return None
+
+    start = time.perf_counter()
+    schema = SCHEMAS.get(stage, {})
+    if isinstance(text, str):
+        value, outcome = _parse(text, schema)
+    elif validate(text, schema):
+        value, outcome = text, "tool"
+    else:
+        value, outcome = None, "schema"
+    _record(stage or "other", outcome, time.perf_counter() - start)
+    if outcome not in ("ok", "tool", "salvaged"):
+        print(f"⚠️ Could not parse {stage or 'LLM'} output ({outcome}): {str(text)[:200]!r}")
+    return value
+
+
+def _parse(text, schema):
+    s = _ASSIGNMENT.sub("", strip_fences(text), count=1)
+
+    candidates = [s]
+    spans = sorted(scan_values(s), key=lambda span: span[0] - span[1])
+    candidates += [s[a:b] for a, b in spans if b - a < len(s)]
+
+    outcome = "no_json" if not spans else "syntax"
+    for candidate in candidates:
+        try:
+            value = parse_literal(candidate)
+        except ValueError:
+            continue
+        if validate(value, schema):
+            return value, "ok"
+        outcome = "schema"
+
+    salvage = schema.get("salvage")
+    if salvage is not None:
+        items = ArrayItemParser(salvage).feed(s)
+        if items:
+            return items, "salvaged"
+    return None, outcome
+
+
+def _record(stage, outcome, seconds):
+    with _lock:
+        stats = PARSE_STATS.setdefault(stage, {"calls": 0, "ok": 0, "tool": 0, "salvaged": 0, "no_json": 0,
+                                               "syntax": 0, "schema": 0, "seconds": 0.0})
+        stats["calls"] += 1
+        stats[outcome] += 1
+        stats["seconds"] += seconds
+    set_attributes(parse=outcome, parse_s=round(seconds, 5))
+
+
+def parse_stats():
+    with _lock:
+        return {stage: dict(stats) for stage, stats in PARSE_STATS.items()}
@@ -0,0 +1,176 @@
+# prefilter.py
+
+import os, json, threading
+
+from Shared.ranking import rank_hotels, rank_flights
+from Shared.tracing import traced, set_attributes
+
+# --------------------------------------------------------------------
+# 1. SETUP
+# --------------------------------------------------------------------
+PREFILTER_ENABLED = os.environ.get("TPM_PREFILTER", "true").lower() not in ("0", "false", "no")
+PREFILTER_TOP_K = int(os.environ.get("TPM_PREFILTER_TOP_K", "15"))
+
+
+def _env_num(name):
+    value = os.environ.get(name)
+    return float(value) if value not in (None, "") else None
+
+
+# Defaults for hard constraints; per-call constraints override these.
+# None means "no limit".
+DEFAULT_HOTEL_CONSTRAINTS = {
+    "min_price": None,   # per night, search currency (see price_constraints_in)
+    "max_price": None,
+    "min_rating": _env_num("TPM_HOTELS_MIN_RATING"),
+}
+DEFAULT_FLIGHT_CONSTRAINTS = {
+    "max_layovers": _env_num("TPM_FLIGHTS_MAX_LAYOVERS"),
+    "max_duration": _env_num("TPM_FLIGHTS_MAX_DURATION"),  # minutes
+    "max_price": _env_num("TPM_FLIGHTS_MAX_PRICE"),
+}
+
+# Currency units per US dollar. These are pegged, so a budget given in one
+# can be converted exactly into a search run in another; any other pair is
+# left unconverted and the price bounds are dropped rather than guessed.
+USD_PEGS = {"USD": 1.0, "SAR": 3.75, "AED": 3.6725, "QAR": 3.64, "BHD": 0.376, "OMR": 0.3845}
+
+_lock = threading.Lock()
+PREFILTER_STATS = {
+    "calls": 0,
+    "candidates_in": 0,
+    "candidates_out": 0,
+    "tokens_in": 0,
+    "tokens_out": 0,
+}
+
+
+# --------------------------------------------------------------------
+# 2. HELPERS
+# --------------------------------------------------------------------
+def estimate_tokens(payload):
+    """Rough token count of a JSON payload (~4 characters per token)."""
+    if not isinstance(payload, str):
+        payload = json.dumps(payload, ensure_ascii=False)
+    return (len(payload) + 3) // 4
+
+
+def prefilter_stats():
+    with _lock:
+        stats = dict(PREFILTER_STATS)
+    stats["tokens_saved"] = stats["tokens_in"] - stats["tokens_out"]
+    return stats
+
+
+def _record(label, before, after):
+    tokens_in, tokens_out = estimate_tokens(before), estimate_tokens(after)
+    with _lock:
+        PREFILTER_STATS["calls"] += 1
+        PREFILTER_STATS["candidates_in"] += len(before)
+        PREFILTER_STATS["candidates_out"] += len(after)
+        PREFILTER_STATS["tokens_in"] += tokens_in
+        PREFILTER_STATS["tokens_out"] += tokens_out
+    set_attributes(candidates_in=len(before), candidates_out=len(after), tokens_in=tokens_in, tokens_out=tokens_out)
+    print(f"✂️ Pre-filter {label}: {len(before)} → {len(after)} candidates, "
+          f"~{tokens_in} → ~{tokens_out} tokens (saved ~{tokens_in - tokens_out})")
+
+
+def _merge(defaults, constraints):
+    merged = dict(defaults)
+    for k, v in (constraints or {}).items():
+        if k in defaults and v not in (None, ""):
+            merged[k] = float(v)
+    return merged
+
+
+def _outside(value, lo=None, hi=None):
+    """Missing values are never rejected: the constraint can't be checked."""
+    if value is None:
+        return False
+    try:
+        value = float(value)
+    except (TypeError, ValueError):
+        return False
+    return (lo is not None and value < lo) or (hi is not None and value > hi)
+
+
+def price_constraints_in(constraints, currency):
+    """
+    Hotel constraints with min_price / max_price moved from constraints["currency"]
+    (e.g. the UI's SAR budget) into the search currency. Without a "currency"
+    key the bounds are taken as already in the search currency; when the pair
+    can't be converted the bounds are dropped, never applied in the wrong unit.
+    """
+    if not constraints or not constraints.get("currency"):
+        return constraints
+
+    converted = dict(constraints)
+    source = str(converted.pop("currency")).upper()
+    target = str(currency or "").upper()
+    if source == target:
+        return converted
+
+    if source in USD_PEGS and target in USD_PEGS:
+        rate = USD_PEGS[target] / USD_PEGS[source]
+        for key in ("min_price", "max_price"):
+            if converted.get(key) not in (None, ""):
+                converted[key] = round(float(converted[key]) * rate, 2)
+    else:
+        print(f"⚠️ Hotel budget in {source} can't be converted to {target or 'the search currency'}, ignoring it")
+        converted["min_price"] = converted["max_price"] = None
+    return converted
+
+
+# --------------------------------------------------------------------
+# 3. PRE-FILTERS
+# --------------------------------------------------------------------
+def qualifying_hotels(hotels, constraints=None):
+    """The cleaned hotels within the budget / rating constraints (also used to stop paging early)."""
+    c = _merge(DEFAULT_HOTEL_CONSTRAINTS, constraints)
+    return [
+        h for h in hotels
+        if not _outside(h.get("price"), c.get("min_price"), c.get("max_price"))
+        and not _outside(h.get("rating"), c.get("min_rating"), None)
+    ]
+
+
+@traced("prefilter.hotels")
+def prefilter_hotels(hotels, constraints=None, top_k=None):
+    """
+    Applies budget / rating constraints to the cleaned hotels list, then keeps
+    the top_k by the local ranking score. If the constraints reject everything,
+    ranks the unfiltered list instead so the LLM still has something to choose from.
+    """
+    if not PREFILTER_ENABLED or not hotels:
+        return hotels
+
+    kept = qualifying_hotels(hotels, constraints)
+    if not kept:
+        print("⚠️ No hotels match the hard constraints, relaxing them")
+        kept = hotels
+
+    result = rank_hotels(kept, top_k or PREFILTER_TOP_K)
+    _record("hotels", hotels, result)
+    return result
+
+
+@traced("prefilter.flights")
+def prefilter_flights(flights, constraints=None, top_k=None):
+    """Same as prefilter_hotels for cleaned flight itineraries (layovers, duration, price)."""
+    if not PREFILTER_ENABLED or not flights:
+        return flights
+
+    c = _merge(DEFAULT_FLIGHT_CONSTRAINTS, constraints)
+    kept = [
+        f for f in flights
+        if not _outside(len(f.get("layovers") or []), None, c.get("max_layovers"))
+        and not _outside(f.get("total_duration"), None, c.get("max_duration"))
+        and not _outside(f.get("price"), None, c.get("max_price"))
+    ]
+    if not kept:
+        print("⚠️ No flights match the hard constraints, relaxing them")
+        kept = flights
+
+    result = rank_flights(kept, top_k or PREFILTER_TOP_K) or kept[:top_k or PREFILTER_TOP_K]
+    _record("flights", flights, result)
+    return result
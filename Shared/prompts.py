@@ -0,0 +1,127 @@
+# prompts.py
+
+import os, time, hashlib, threading
+
+# --------------------------------------------------------------------
+# 1. SETUP
+# --------------------------------------------------------------------
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Template name -> path relative to the repo root (exact case: Linux is case-sensitive)
+PROMPT_FILES = {
+    "flights_request_gen": "Flights/prompts/flights_request_gen_prompt.txt",
+    "flights": "Flights/prompts/flights_prompt.txt",
+    "hotels_request_gen": "hotels/prompts/hotels_request_gen_prompt.txt",
+    "top_hotels": "hotels/prompts/top_hotels_prompt.txt",
+    "fix_city": "Activities/prompts/fix_city_prompt.txt",
+    "top_items": "Activities/prompts/top_items_prompt.txt",
+}
+
+# Seconds between checks for edited prompt files (0 disables hot reload)
+PROMPT_RELOAD_INTERVAL = float(os.environ.get("TPM_PROMPT_RELOAD_INTERVAL", "2"))
+
+_lock = threading.Lock()
+_prompts = {}      # name -> {"text", "hash", "path", "mtime"}
+_hashes = {}       # text -> hash, for callers that only hold the text
+_last_check = 0.0
+
+
+# --------------------------------------------------------------------
+# 2. LOADING
+# --------------------------------------------------------------------
+def _path(name):
+    return os.path.join(REPO_DIR, PROMPT_FILES[name])
+
+
+def _load(name):
+    path = _path(name)
+    try:
+        mtime = os.stat(path).st_mtime_ns
+        with open(path, "r", encoding="utf-8") as f:
+            text = f.read()
+    except FileNotFoundError:
+        return None
+    return {"text": text, "hash": hashlib.sha256(text.encode("utf-8")).hexdigest(), "path": path, "mtime": mtime}
+
+
+def load_prompts():
+    """(Re)reads every template. Returns the names that could not be found."""
+    missing = []
+    loaded = {}
+    for name in PROMPT_FILES:
+        prompt = _load(name)
+        if prompt is None:
+            missing.append(name)
+        else:
+            loaded[name] = prompt
+    with _lock:
+        _prompts.clear()
+        _prompts.update(loaded)
+        _hashes.clear()
+        _hashes.update({p["text"]: p["hash"] for p in loaded.values()})
+    for name in missing:
+        print(f"⚠️ Prompt template {PROMPT_FILES[name]} not found")
+    return missing
+
+
+def validate_prompts():
+    """Raises FileNotFoundError listing every missing template."""
+    missing = [name for name in PROMPT_FILES if not os.path.isfile(_path(name))]
+    if missing:
+        raise FileNotFoundError("Missing prompt templates: " + ", ".join(PROMPT_FILES[n] for n in missing))
+
+
+def _reload_changed():
+    """Re-reads templates whose file changed, at most once per PROMPT_RELOAD_INTERVAL."""
+    global _last_check
+    now = time.monotonic()
+    if not PROMPT_RELOAD_INTERVAL or now - _last_check < PROMPT_RELOAD_INTERVAL:
+        return
+    _last_check = now
+
+    for name in PROMPT_FILES:
+        current = _prompts.get(name)
+        try:
+            mtime = os.stat(_path(name)).st_mtime_ns
+        except FileNotFoundError:
+            mtime = None
+        if current is not None and current["mtime"] == mtime:
+            continue
+        prompt = _load(name)
+        with _lock:
+            if prompt is None:
+                _prompts.pop(name, None)
+            else:
+                _prompts[name] = prompt
+                _hashes[prompt["text"]] = prompt["hash"]
+        if prompt is not None and current is not None:
+            print(f"🔄 Reloaded prompt template {PROMPT_FILES[name]}")
+
+
+# --------------------------------------------------------------------
+# 3. API
+# --------------------------------------------------------------------
+def get_prompt(name):
+    """Template text from memory; FileNotFoundError if its file is missing."""
+    _reload_changed()
+    prompt = _prompts.get(name)
+    if prompt is None:
+        raise FileNotFoundError(f"{PROMPT_FILES.get(name, name)} not found")
+    return prompt["text"]
+
+
+def get_prompt_hash(name):
+    """sha256 of the template's current content (changes when the file is edited)."""
+    get_prompt(name)
+    return _prompts[name]["hash"]
+
+
+def text_hash(text):
+    """sha256 of a prompt text, reusing the registry's precomputed hash when it is a template."""
+    digest = _hashes.get(text)
+    if digest is None:
+        digest = hashlib.sha256(text.encode("utf-8")).hexdigest()
+    return digest
+
+
+load_prompts()
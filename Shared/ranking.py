@@ -0,0 +1,273 @@
+# ranking.py
+
+import os, re, math
+
+# --------------------------------------------------------------------
+# 1. SETUP
+# --------------------------------------------------------------------
+# "llm"    → the LLM picks from the full candidate list (original behaviour)
+# "local"  → deterministic scorer below, no LLM call
+# "hybrid" → scorer keeps the best HYBRID_TOP_K, the LLM picks from those
+SELECTION_MODES = ("llm", "local", "hybrid")
+
+DEFAULT_SELECTION_MODE = os.environ.get("TPM_SELECTION_MODE", "llm").lower()
+HYBRID_TOP_K = int(os.environ.get("TPM_HYBRID_TOP_K", "10"))
+
+# A hotel rating counts fully only with this many reviews behind it; below
+# that it is pulled towards the lowest rating in the list, and a hotel with
+# no rating at all scores as that lowest rating
+RATING_PRIOR_REVIEWS = 20
+
+# Keyword banks used to score activities against the UI sliders
+PREFERENCE_KEYWORDS = {
+    "Nature": [
+        "nature", "park", "garden", "botanical", "lake", "canyon", "gorge", "mountain",
+        "valley", "river", "waterfall", "forest", "hiking", "hike", "trail", "beach",
+        "island", "national park", "glacier", "ski", "zoo", "wildlife", "desert", "cave",
+    ],
+    "Human-built": [
+        "museum", "tower", "building", "bridge", "architecture", "monument", "square",
+        "stadium", "theater", "theatre", "mall", "market", "street", "palace",
+        "cathedral", "mosque", "church", "gallery", "city tour", "landmark",
+    ],
+    "Historical": [
+        "historic", "history", "ancient", "old town", "old city", "cathedral", "mosque",
+        "church", "fortress", "fort", "castle", "palace", "heritage", "memorial",
+        "monument", "century", "ruins", "archaeolog", "museum", "mausoleum",
+    ],
+    "Modern": [
+        "modern", "contemporary", "mall", "skyscraper", "observation deck", "tower",
+        "shopping", "entertainment", "amusement", "theme park", "aquarium", "cable car",
+        "art gallery", "design", "district", "arena",
+    ],
+}
+
+# Same exclusions the top_items prompt applies
+EXCLUDED_PATTERN = re.compile(
+    r"\b(night\s?clubs?|bars?|pubs?|wine|wineries|winery|alcohol|beer|brewery|breweries|"
+    r"vodka|cocktails?|whisk(?:e)?y|pork|non-halal|casinos?)\b",
+    re.IGNORECASE,
+)
+
+
+# --------------------------------------------------------------------
+# 2. COLUMN HELPERS
+# --------------------------------------------------------------------
+def _num(value):
+    try:
+        if value is None or value == "":
+            return None
+        return float(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def _fill(column, default=None):
+    """Replaces missing values with the column median (or default if the column is empty)."""
+    present = sorted(v for v in column if v is not None)
+    if not present:
+        return [default if default is not None else 0.0 for _ in column]
+    mid = len(present) // 2
+    median = present[mid] if len(present) % 2 else (present[mid - 1] + present[mid]) / 2
+    return [median if v is None else v for v in column]
+
+
+def _shrunk(ratings, reviews, default):
+    """
+    Review-weighted ratings: (n * rating + m * prior) / (n + m) with n the
+    review count, m = RATING_PRIOR_REVIEWS and prior the lowest rating present.
+    Missing ratings get the prior, so a hotel without data can't outscore a
+    well-reviewed one; a rating without a review count is trusted halfway.
+    """
+    present = [r for r in ratings if r is not None]
+    prior = min(present) if present else default
+    m = RATING_PRIOR_REVIEWS
+    shrunk = []
+    for r, n in zip(ratings, reviews):
+        if r is None:
+            shrunk.append(prior)
+            continue
+        n = m if n is None else max(n, 0.0)
+        shrunk.append((n * r + m * prior) / (n + m))
+    return shrunk
+
+
+def _minmax(column):
+    """Scales a column to [0, 1]; a constant column becomes all 0.5."""
+    lo, hi = min(column, default=0.0), max(column, default=0.0)
+    if hi == lo:
+        return [0.5 for _ in column]
+    span = hi - lo
+    return [(v - lo) / span for v in column]
+
+
+def _top(candidates, scores, top_n):
+    """Stable sort by score (ties keep input order), optionally cut to top_n."""
+    order = sorted(range(len(candidates)), key=lambda i: -scores[i])
+    if top_n is not None:
+        order = order[:max(top_n, 0)]
+    return [candidates[i] for i in order], [scores[i] for i in order]
+
+
+def selection_mode(pipeline, mode=None):
+    """Resolves the mode for one pipeline: explicit arg → TPM_<PIPELINE>_SELECTION → TPM_SELECTION_MODE."""
+    mode = (mode or os.environ.get(f"TPM_{pipeline.upper()}_SELECTION") or DEFAULT_SELECTION_MODE).lower()
+    if mode not in SELECTION_MODES:
+        print(f"⚠️ Unknown selection mode '{mode}' for {pipeline}, using 'llm'")
+        return "llm"
+    return mode
+
+
+# --------------------------------------------------------------------
+# 3. HOTELS
+# --------------------------------------------------------------------
+def score_hotels(hotels):
+    """
+    Mirrors top_hotels_prompt.txt:
+    - rating × location_rating (both on a 10-point scale), the rating weighted
+      by its review count (see _shrunk)
+    - value for money: rating and stars per unit of price
+    - review count as confidence
+    - small penalty for sponsored listings
+    """
+    review_counts = [_num(h.get("reviews")) for h in hotels]
+    rating = _shrunk([_num(h.get("rating")) for h in hotels], review_counts, 3.5)
+    location = _fill([_num(h.get("location_rating")) for h in hotels], 3.5)
+    stars = _fill([_num(h.get("stars")) for h in hotels], 3.0)
+    price = [_num(h.get("price")) for h in hotels]
+    reviews = [math.log1p(n or 0.0) for n in review_counts]
+    sponsored = [1.0 if h.get("sponsored") else 0.0 for h in hotels]
+
+    quality = [(r * 2) * (l * 2) / 100 for r, l in zip(rating, location)]
+    value_raw = [
+        None if p is None or p <= 0 else (r * 2 + s) / math.log1p(p)
+        for r, s, p in zip(rating, stars, price)
+    ]
+    value = _minmax(_fill(value_raw, 1.0))
+    confidence = _minmax(reviews)
+
+    return [
+        0.5 * q + 0.3 * v + 0.15 * c - 0.05 * sp
+        for q, v, c, sp in zip(quality, value, confidence, sponsored)
+    ]
+
+
+def rank_hotels(hotels, top_n=None, reason=False):
+    """Best-first hotels; reason=True adds a 'reason' field like the LLM output has."""
+    ranked, scores = _top(hotels, score_hotels(hotels), top_n)
+    if not reason:
+        return ranked
+    return [
+        dict(h, reason=f"Local ranking score {s:.2f} (rating × location, value for money, reviews).")
+        for h, s in zip(ranked, scores)
+    ]
+
+
+# --------------------------------------------------------------------
+# 4. FLIGHTS
+# --------------------------------------------------------------------
+def _has_essentials(flight):
+    legs = flight.get("flights") or []
+    if not legs:
+        return False
+    for leg in legs:
+        if not leg.get("airline"):
+            return False
+        if not (leg.get("departure_airport") or {}).get("time"):
+            return False
+        if not (leg.get("arrival_airport") or {}).get("time"):
+            return False
+    return True
+
+
+def score_flights(flights):
+    """
+    Mirrors flights_prompt.txt: reliability (often_delayed_by_over_30_min),
+    total duration, number of layovers and price. Itineraries missing
+    airline or times score -1 so they sink to the bottom.
+    """
+    duration = _minmax(_fill([_num(f.get("total_duration")) for f in flights], 0.0))
+    layovers = _minmax([float(len(f.get("layovers") or [])) for f in flights])
+    price = _minmax(_fill([_num(f.get("price")) for f in flights], 0.0))
+    delayed = [
+        sum(1 for leg in (f.get("flights") or []) if leg.get("often_delayed_by_over_30_min"))
+        / max(len(f.get("flights") or []), 1)
+        for f in flights
+    ]
+    essentials = [_has_essentials(f) for f in flights]
+
+    return [
+        (0.3 * (1 - d) + 0.25 * (1 - l) + 0.25 * (1 - p) + 0.2 * (1 - dl)) if ok else -1.0
+        for d, l, p, dl, ok in zip(duration, layovers, price, delayed, essentials)
+    ]
+
+
+def rank_flights(flights, top_n=None, reason=False):
+    """Best-first itineraries, dropping those missing essential info."""
+    ranked, scores = _top(flights, score_flights(flights), top_n)
+    return [
+        dict(f, reason=f"Local ranking score {s:.2f} (duration, layovers, price, delay history).") if reason else f
+        for f, s in zip(ranked, scores)
+        if s >= 0
+    ]
+
+
+# --------------------------------------------------------------------
+# 5. ACTIVITIES / RESTAURANTS
+# --------------------------------------------------------------------
+def _item_text(item):
+    return " ".join(
+        str(item.get(k) or "") for k in ("title", "description", "place_type", "category")
+    ).lower()
+
+
+def is_excluded(item):
+    return bool(EXCLUDED_PATTERN.search(_item_text(item)))
+
+
+def _dedupe(items):
+    """Drops standalone items whose title is covered by another (broader) item, keeping the package."""
+    texts = [_item_text(it) for it in items]
+    titles = [str(it.get("title") or "").strip().lower() for it in items]
+    keep = []
+    for i, title in enumerate(titles):
+        covered = len(title) > 3 and any(
+            j != i and title in texts[j] and len(texts[j]) > len(texts[i])
+            for j in range(len(items))
+        )
+        if not covered:
+            keep.append(items[i])
+    return keep
+
+
+def score_items(items, preferences):
+    """
+    Relevance to the UI sliders (percent weights per PREFERENCE_KEYWORDS bucket),
+    with rating and review count as tie-breakers.
+    """
+    weights = {k: (_num(v) or 0.0) / 100 for k, v in (preferences or {}).items()}
+    texts = [_item_text(it) for it in items]
+
+    relevance = []
+    for text in texts:
+        total = 0.0
+        for bucket, keywords in PREFERENCE_KEYWORDS.items():
+            hits = sum(1 for kw in keywords if kw in text)
+            total += weights.get(bucket, 0.0) * min(hits / 2, 1.0)
+        relevance.append(total)
+
+    rating = _minmax(_fill([_num(it.get("rating")) for it in items], 0.0))
+    reviews = _minmax([math.log1p(_num(it.get("reviews")) or 0.0) for it in items])
+
+    return [0.7 * r + 0.2 * rt + 0.1 * rv for r, rt, rv in zip(relevance, rating, reviews)]
+
+
+def rank_items(items, preferences, top_n=None, kind="activities"):
+    """Restaurants are only filtered and keep their original order, as the prompt specifies."""
+    valid = [it for it in items if not is_excluded(it)]
+    if kind == "restaurants":
+        return valid[:top_n] if top_n is not None else valid
+
+    valid = _dedupe(valid)
+    ranked, _ = _top(valid, score_items(valid, preferences), top_n)
+    return ranked
@@ -0,0 +1,194 @@
+# rate_limit.py
+
+import os, time, asyncio, threading
+from contextlib import contextmanager, asynccontextmanager
+
+from Shared.tracing import set_attributes
+
+# --------------------------------------------------------------------
+# 1. SETUP
+# --------------------------------------------------------------------
+# Process-wide outbound limits per provider:
+#   rate        → requests per second refilled into the bucket (0 = unlimited)
+#   burst       → bucket size: requests allowed back to back after idling
+#   concurrency → requests in flight at once (0 = unlimited)
+def _limits(prefix, rate, burst, concurrency):
+    return {
+        "rate": float(os.environ.get(f"TPM_{prefix}_RATE", rate)),
+        "burst": int(os.environ.get(f"TPM_{prefix}_BURST", burst)),
+        "concurrency": int(os.environ.get(f"TPM_{prefix}_CONCURRENCY", concurrency)),
+    }
+
+
+RATE_LIMITS = {
+    "serpapi": _limits("SERPAPI", "5", "10", "10"),
+    "anthropic": _limits("LLM", "4", "8", "8"),
+}
+
+# Async waiters poll at this interval while all concurrency slots are taken
+_ASYNC_POLL = 0.01
+
+_limiters = {}
+_registry_lock = threading.Lock()
+
+
+# --------------------------------------------------------------------
+# 2. LIMITER
+# --------------------------------------------------------------------
+class RateLimiter:
+    """
+    Token bucket plus concurrency cap for one provider, shared by every
+    thread and event loop. Callers queue instead of failing:
+
+        with rate_limiter("serpapi").slot():
+            response = ...
+
+    Time spent queueing is added to the current span (queue_wait_s) and to stats.
+    """
+
+    def __init__(self, name, rate=0, burst=1, concurrency=0):
+        self.name = name
+        self.rate = rate
+        self.burst = max(burst, 1)
+        self.concurrency = concurrency
+        self.stats = {"requests": 0, "queued": 0, "waiting": 0, "in_flight": 0,
+                      "wait_total_s": 0.0, "wait_max_s": 0.0, "throttled": 0}
+        self._lock = threading.Lock()
+        self._slot_freed = threading.Condition(self._lock)
+        self._tokens = float(self.burst)
+        self._updated = time.monotonic()
+        self._paused_until = 0.0
+
+    # ---- token bucket ----
+    def _take_token(self):
+        """Takes a token if one is available; else returns seconds until one is. Caller holds the lock."""
+        now = time.monotonic()
+        if now < self._paused_until:
+            return self._paused_until - now
+        if not self.rate:
+            return 0.0
+        self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+        if self._tokens >= 1:
+            self._tokens -= 1
+            return 0.0
+        return (1 - self._tokens) / self.rate
+
+    def _has_slot(self):
+        return not self.concurrency or self.stats["in_flight"] < self.concurrency
+
+    def pause(self, seconds):
+        """Holds every caller back for seconds, e.g. after the provider answered 429."""
+        with self._lock:
+            self.stats["throttled"] += 1
+            self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+            self._tokens = 0.0
+
+    # ---- acquire / release ----
+    def _try_acquire(self):
+        """Returns 0 once a slot and a token are taken, else how long to wait. Caller holds the lock."""
+        if not self._has_slot():
+            return None
+        wait = self._take_token()
+        if not wait:
+            self.stats["in_flight"] += 1
+        return wait
+
+    def acquire(self):
+        start = time.monotonic()
+        with self._lock:
+            self._enqueue()
+            try:
+                while True:
+                    wait = self._try_acquire()
+                    if wait == 0:
+                        break
+                    # No free slot: sleep until one is released; no token: until the next refill
+                    self._slot_freed.wait(wait)
+            finally:
+                self.stats["waiting"] -= 1
+        self._record_wait(time.monotonic() - start)
+
+    async def acquire_async(self):
+        start = time.monotonic()
+        with self._lock:
+            self._enqueue()
+        try:
+            while True:
+                with self._lock:
+                    wait = self._try_acquire()
+                if wait == 0:
+                    break
+                await asyncio.sleep(_ASYNC_POLL if wait is None else wait)
+        finally:
+            with self._lock:
+                self.stats["waiting"] -= 1
+        self._record_wait(time.monotonic() - start)
+
+    def release(self):
+        with self._lock:
+            self.stats["in_flight"] -= 1
+            self._slot_freed.notify()
+
+    def _enqueue(self):
+        self.stats["requests"] += 1
+        self.stats["waiting"] += 1
+
+    def _record_wait(self, waited):
+        with self._lock:
+            if waited > 0.001:
+                self.stats["queued"] += 1
+            self.stats["wait_total_s"] += waited
+            self.stats["wait_max_s"] = max(self.stats["wait_max_s"], waited)
+        set_attributes(queue_wait_s=round(waited, 4))
+
+    @contextmanager
+    def slot(self):
+        self.acquire()
+        try:
+            yield
+        finally:
+            self.release()
+
+    @asynccontextmanager
+    async def slot_async(self):
+        await self.acquire_async()
+        try:
+            yield
+        finally:
+            self.release()
+
+
+# --------------------------------------------------------------------
+# 3. API
+# --------------------------------------------------------------------
+def rate_limiter(provider):
+    """The process-wide limiter for provider ("serpapi" or "anthropic")."""
+    limiter = _limiters.get(provider)
+    if limiter is None:
+        with _registry_lock:
+            limiter = _limiters.get(provider)
+            if limiter is None:
+                limiter = _limiters[provider] = RateLimiter(provider, **RATE_LIMITS.get(provider, {}))
+    return limiter
+
+
+def throttled(provider, headers=None, default=1.0):
+    """Records a 429 from provider and pauses its limiter for Retry-After seconds (or default)."""
+    try:
+        seconds = float((headers or {}).get("retry-after", default))
+    except (TypeError, ValueError):
+        seconds = default
+    print(f"⏳ {provider} rate limit hit, pausing {seconds:.1f}s")
+    rate_limiter(provider).pause(seconds)
+
+
+def rate_limit_stats():
+    """{provider: stats} with the mean queue wait per request."""
+    report = {}
+    for name, limiter in list(_limiters.items()):
+        with limiter._lock:
+            stats = dict(limiter.stats)
+        stats["wait_mean_s"] = stats["wait_total_s"] / stats["requests"] if stats["requests"] else 0.0
+        report[name] = stats
+    return report
@@ -0,0 +1,233 @@
+# resilience.py
+
+import os, time, random, asyncio, threading, contextvars
+from collections import deque
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+import httpx
+import anthropic
+
+from Shared.tracing import set_attributes, submit
+
+# --------------------------------------------------------------------
+# 1. SETUP
+# --------------------------------------------------------------------
+# Whole-search budget in seconds; main.py treats searches over 40s as failed
+SEARCH_BUDGET = float(os.environ.get("TPM_SEARCH_BUDGET", "35"))
+
+# Retries of transient errors (timeouts, connection errors, 429, 5xx)
+RETRIES = int(os.environ.get("TPM_RETRIES", "2"))
+RETRY_BASE_DELAY = float(os.environ.get("TPM_RETRY_BASE_DELAY", "0.25"))
+RETRY_MAX_DELAY = float(os.environ.get("TPM_RETRY_MAX_DELAY", "4"))
+
+# Providers ("serpapi", "anthropic") that get a hedged duplicate request once
+# a call runs past that provider's recent p95 latency. Off by default: a hedge
+# costs a second SerpAPI search / LLM call.
+HEDGE_PROVIDERS = {p.strip() for p in os.environ.get("TPM_HEDGE", "").split(",") if p.strip()}
+HEDGE_MIN_SAMPLES = 20
+HEDGE_MIN_DELAY = float(os.environ.get("TPM_HEDGE_MIN_DELAY", "0.5"))
+
+TRANSIENT_STATUSES = {408, 409, 425, 429, 500, 502, 503, 504, 529}
+
+_deadline = contextvars.ContextVar("tpm_deadline", default=None)
+_latencies = {}   # provider -> recent successful call durations
+_lock = threading.Lock()
+_hedge_pool = ThreadPoolExecutor(max_workers=16, thread_name_prefix="hedge")
+RESILIENCE_STATS = {"retries": 0, "hedged": 0, "hedge_wins": 0, "deadline_exceeded": 0}
+
+
+class TransientError(Exception):
+    """An upstream failure worth retrying (e.g. SerpAPI answered 503)."""
+
+
+class DeadlineExceeded(TimeoutError):
+    """The search budget ran out before the call could finish."""
+
+
+# --------------------------------------------------------------------
+# 2. DEADLINES
+# --------------------------------------------------------------------
+@contextmanager
+def search_budget(seconds=None):
+    """
+    Gives every upstream call made inside (including threads started with
+    tracing.submit and asyncio tasks) a shared deadline. Nested budgets
+    never extend an outer one.
+    """
+    seconds = SEARCH_BUDGET if seconds is None else seconds
+    deadline = time.monotonic() + seconds if seconds else None
+    outer = _deadline.get()
+    if outer is not None and (deadline is None or outer < deadline):
+        deadline = outer
+    token = _deadline.set(deadline)
+    try:
+        yield deadline
+    finally:
+        _deadline.reset(token)
+
+
+def remaining():
+    """Seconds left in the current search budget, or None without one."""
+    deadline = _deadline.get()
+    return None if deadline is None else deadline - time.monotonic()
+
+
+def deadline_passed():
+    left = remaining()
+    return left is not None and left <= 0
+
+
+def call_timeout(default):
+    """Timeout for one upstream call: its own default, cut to what is left of the budget."""
+    left = remaining()
+    if left is None:
+        return default
+    if left <= 0:
+        _count("deadline_exceeded")
+        raise DeadlineExceeded("Search time budget exhausted")
+    return min(default, left)
+
+
+# --------------------------------------------------------------------
+# 3. RETRIES / HEDGING
+# --------------------------------------------------------------------
+def is_transient(error):
+    if isinstance(error, (TransientError, httpx.TimeoutException, httpx.TransportError,
+                          anthropic.APIConnectionError)):
+        return True
+    if isinstance(error, anthropic.APIStatusError):
+        return error.status_code in TRANSIENT_STATUSES
+    return False
+
+
+def _backoff(attempt):
+    """Full-jitter exponential backoff, never sleeping past the deadline."""
+    delay = random.uniform(0, min(RETRY_MAX_DELAY, RETRY_BASE_DELAY * 2 ** attempt))
+    left = remaining()
+    if left is not None and delay >= left:
+        _count("deadline_exceeded")
+        raise DeadlineExceeded("Search time budget exhausted")
+    return delay
+
+
+def _hedge_delay(provider):
+    if provider not in HEDGE_PROVIDERS:
+        return None
+    with _lock:
+        samples = sorted(_latencies.get(provider, ()))
+    if len(samples) < HEDGE_MIN_SAMPLES:
+        return None
+    return max(samples[int(len(samples) * 0.95) - 1], HEDGE_MIN_DELAY)
+
+
+def _record_latency(provider, seconds):
+    with _lock:
+        _latencies.setdefault(provider, deque(maxlen=200)).append(seconds)
+
+
+def _count(key):
+    with _lock:
+        RESILIENCE_STATS[key] += 1
+
+
+def resilient_call(provider, attempt, *args, hedge=True):
+    """
+    Runs attempt(*args), retrying transient errors with jittered backoff
+    within the search budget, and hedging it past the provider's p95 when
+    enabled. attempt must be safe to run twice (a hedge may still be running).
+    """
+    for n in range(RETRIES + 1):
+        start = time.monotonic()
+        try:
+            delay = _hedge_delay(provider) if hedge else None
+            result = attempt(*args) if delay is None else _hedged(delay, attempt, *args)
+        except Exception as e:
+            if n == RETRIES or not is_transient(e):
+                set_attributes(attempts=n + 1)
+                raise
+            _count("retries")
+            print(f"🔁 {provider} call failed ({type(e).__name__}: {e}), retrying")
+            time.sleep(_backoff(n))
+            continue
+        _record_latency(provider, time.monotonic() - start)
+        set_attributes(attempts=n + 1)
+        return result
+
+
+def _hedged(delay, attempt, *args):
+    first = submit(_hedge_pool, attempt, *args)
+    done, _ = wait([first], timeout=delay)
+    if done:
+        return first.result()
+
+    _count("hedged")
+    set_attributes(hedged=True)
+    second = submit(_hedge_pool, attempt, *args)
+    pending = {first, second}
+    while pending:
+        done, pending = wait(pending, return_when=FIRST_COMPLETED)
+        winner = _winner(done, second)
+        if winner is not None:
+            return winner.result()
+    return first.result()  # both failed: raise the original call's error
+
+
+def _winner(done, second):
+    """First successful call among done (the hedge, second, counts as a win)."""
+    for future in done:
+        if future.exception() is None:
+            if future is second:
+                _count("hedge_wins")
+            return future
+    return None
+
+
+async def resilient_call_async(provider, attempt, *args, hedge=True):
+    """Async resilient_call, attempt being a coroutine function; the losing hedge is cancelled."""
+    for n in range(RETRIES + 1):
+        start = time.monotonic()
+        try:
+            delay = _hedge_delay(provider) if hedge else None
+            result = await (attempt(*args) if delay is None else _hedged_async(delay, attempt, *args))
+        except Exception as e:
+            if n == RETRIES or not is_transient(e):
+                set_attributes(attempts=n + 1)
+                raise
+            _count("retries")
+            print(f"🔁 {provider} call failed ({type(e).__name__}: {e}), retrying")
+            await asyncio.sleep(_backoff(n))
+            continue
+        _record_latency(provider, time.monotonic() - start)
+        set_attributes(attempts=n + 1)
+        return result
+
+
+async def _hedged_async(delay, attempt, *args):
+    first = asyncio.ensure_future(attempt(*args))
+    tasks = [first]
+    try:
+        done, _ = await asyncio.wait([first], timeout=delay)
+        if done:
+            return first.result()
+
+        _count("hedged")
+        set_attributes(hedged=True)
+        second = asyncio.ensure_future(attempt(*args))
+        tasks.append(second)
+        pending = set(tasks)
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            winner = _winner(done, second)
+            if winner is not None:
+                return winner.result()
+        return first.result()
+    finally:
+        for task in tasks:
+            if not task.done():
+                task.cancel()
+
+
+def resilience_stats():
+    with _lock:
+        return dict(RESILIENCE_STATS)
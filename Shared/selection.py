@@ -0,0 +1,80 @@
+# selection.py
+
+from Shared.tracing import set_attributes
+
+# --------------------------------------------------------------------
+# 1. SETUP
+# --------------------------------------------------------------------
+# Selection stages send candidates tagged with a short index and the LLM
+# answers [{"i": 3, "reason": "..."}]; the picked records are rebuilt here
+# from the originals, so the model never echoes tokens, links or whole items.
+INDEX_FIELD = "i"
+
+
+# --------------------------------------------------------------------
+# 2. API
+# --------------------------------------------------------------------
+def index_candidates(records, drop=()):
+    """Copies of records for the prompt: each gets its position as "i", minus the fields in drop."""
+    return [
+        {INDEX_FIELD: i, **{k: v for k, v in record.items() if k not in drop}}
+        for i, record in enumerate(records)
+    ]
+
+
+def _lookup(pick, records):
+    """Index of the record a pick points to, or None."""
+    if not isinstance(pick, dict):
+        return None
+    try:
+        i = int(pick.get(INDEX_FIELD))
+    except (TypeError, ValueError):
+        return None
+    return i if 0 <= i < len(records) else None
+
+
+def rehydrate_one(pick, records):
+    """Copy of the picked record with the pick's reason, or None for an unknown index."""
+    i = _lookup(pick, records)
+    if i is None:
+        return None
+    record = dict(records[i])
+    if pick.get("reason"):
+        record["reason"] = pick["reason"]
+    return record
+
+
+def rehydrate(picks, records, limit=None):
+    """
+    The picked records in the LLM's order, each a copy of the original with
+    the pick's reason. Unknown and repeated indices are dropped.
+    """
+    selected, seen, invalid = [], set(), 0
+    for pick in picks or []:
+        i = _lookup(pick, records)
+        if i is None:
+            invalid += 1
+            continue
+        if i in seen:
+            continue
+        seen.add(i)
+        selected.append(rehydrate_one(pick, records))
+        if limit and len(selected) >= limit:
+            break
+    set_attributes(selected=len(selected), invalid_picks=invalid)
+    return selected
+
+
+def rehydrating(records, on_item):
+    """on_item wrapper for streamed picks: passes on the rebuilt record, skips unknown and repeated indices."""
+    if on_item is None:
+        return None
+    seen = set()
+
+    def forward(pick):
+        i = _lookup(pick, records)
+        if i is not None and i not in seen:
+            seen.add(i)
+            on_item(rehydrate_one(pick, records))
+
+    return forward
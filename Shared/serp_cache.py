@@ -0,0 +1,193 @@
+# serp_cache.py
+
+import os, threading
+from concurrent.futures import ThreadPoolExecutor
+
+from Shared.disk_cache import DiskCache, make_key
+from Shared.clients import serpapi_get, serpapi_get_async, SERPAPI_TIMEOUT
+from Shared.tracing import span, set_attributes
+from Shared.singleflight import single_flight
+from Shared.rate_limit import rate_limiter
+from Shared.resilience import resilient_call, resilient_call_async, call_timeout
+
+# --------------------------------------------------------------------
+# 1. SETUP
+# --------------------------------------------------------------------
+# Seconds each engine's responses stay fresh. Prices move faster than
+# hotel listings, and TripAdvisor lists barely change day to day.
+SERP_CACHE_TTLS = {
+    "google_flights": 15 * 60,
+    "google_hotels": 60 * 60,
+    "tripadvisor": 24 * 60 * 60,
+}
+DEFAULT_TTL = 15 * 60
+
+# Params that never change the response and must not split the cache
+IGNORED_PARAMS = {"api_key", "serp_api_key", "source", "output", "no_cache", "async"}
+
+SERP_CACHE_BYPASS = os.environ.get("TPM_SERP_CACHE_BYPASS", "").lower() in ("1", "true", "yes")
+
+_cache = DiskCache(
+    "serpapi",
+    max_entries=int(os.environ.get("TPM_SERP_CACHE_MAX_ENTRIES", "2000")),
+    max_bytes=int(os.environ.get("TPM_SERP_CACHE_MAX_MB", "500")) * 1024 * 1024,
+)
+_in_flight = single_flight("serpapi")
+
+# Background refreshes of stale entries (swr_search); not part of any search or its budget
+_refresh_pool = ThreadPoolExecutor(max_workers=2, thread_name_prefix="serp-refresh")
+_refreshing = set()
+_refresh_lock = threading.Lock()
+
+
+# --------------------------------------------------------------------
+# 2. HELPERS
+# --------------------------------------------------------------------
+def serp_cache_key(params):
+    """Normalizes params (no api_key, no empty values, everything as str) into a cache key."""
+    normalized = {}
+    for k, v in params.items():
+        if k in IGNORED_PARAMS or v is None or v == "":
+            continue
+        if isinstance(v, (list, tuple, set)):
+            v = ",".join(sorted(str(x).strip() for x in v))
+        normalized[k] = str(v).strip()
+    return make_key("serpapi", normalized)
+
+
+def serp_cache_stats():
+    stats = dict(_cache.stats)
+    stats["refreshing"] = len(_refreshing)
+    return stats
+
+
+def clear_serp_cache():
+    _cache.clear()
+
+
+# --------------------------------------------------------------------
+# 3. CACHED SEARCH
+# --------------------------------------------------------------------
+def cached_search(params, bypass=None):
+    """
+    Drop-in replacement for GoogleSearch(params).get_dict().
+
+    bypass=True skips the lookup but still stores the fresh response,
+    so it doubles as a forced refresh. Error responses are never cached.
+    Concurrent misses for the same key share one request.
+    """
+    with span("serpapi.fetch", engine=params.get("engine", "")):
+        key, cached, _ = _lookup(params, bypass)
+        if cached is not None:
+            return cached
+        return _in_flight.do(key, _fetch, key, params)
+
+
+async def cached_search_async(params, bypass=None):
+    """Async version of cached_search, sharing the same cache."""
+    with span("serpapi.fetch", engine=params.get("engine", "")):
+        key, cached, _ = _lookup(params, bypass)
+        if cached is not None:
+            return cached
+        return await _in_flight.do_async(key, _fetch_async, key, params)
+
+
+def swr_search(params, soft_ttl, hard_ttl, bypass=None):
+    """
+    Stale-while-revalidate cached_search for slow-changing results.
+
+    An entry younger than soft_ttl is served as is; one between soft_ttl
+    and hard_ttl is served immediately and refreshed in the background;
+    a missing (or older than hard_ttl) entry is fetched before returning.
+    Entries are kept for hard_ttl.
+    """
+    with span("serpapi.fetch", engine=params.get("engine", "")):
+        key, cached, age = _lookup(params, bypass, soft_ttl)
+        if cached is not None:
+            if age >= soft_ttl:
+                _revalidate(key, params, hard_ttl)
+            return cached
+        return _in_flight.do(key, _fetch, key, params, hard_ttl)
+
+
+async def swr_search_async(params, soft_ttl, hard_ttl, bypass=None):
+    """Async swr_search; the background refresh still runs on the refresh threads."""
+    with span("serpapi.fetch", engine=params.get("engine", "")):
+        key, cached, age = _lookup(params, bypass, soft_ttl)
+        if cached is not None:
+            if age >= soft_ttl:
+                _revalidate(key, params, hard_ttl)
+            return cached
+        return await _in_flight.do_async(key, _fetch_async, key, params, hard_ttl)
+
+
+def _revalidate(key, params, ttl):
+    """Refetches key on a refresh thread, at most once at a time per key."""
+    with _refresh_lock:
+        if key in _refreshing:
+            return
+        _refreshing.add(key)
+
+    def refresh():
+        try:
+            _in_flight.do(key, _fetch, key, params, ttl)
+            print(f"🔄 Refreshed stale {params.get('engine', '')} entry")
+        except Exception as e:
+            print(f"⚠️ Background refresh failed ({params.get('engine', '')}): {e}")
+        finally:
+            with _refresh_lock:
+                _refreshing.discard(key)
+
+    # Plain submit: the refresh must not inherit the search's trace or deadline
+    _refresh_pool.submit(refresh)
+
+
+def _fetch(key, params, ttl=None):
+    data = resilient_call("serpapi", _attempt, params)
+    _store(key, params, data, ttl)
+    return data
+
+
+async def _fetch_async(key, params, ttl=None):
+    data = await resilient_call_async("serpapi", _attempt_async, params)
+    _store(key, params, data, ttl)
+    return data
+
+
+def _attempt(params):
+    with rate_limiter("serpapi").slot():
+        return serpapi_get(params, call_timeout(SERPAPI_TIMEOUT))
+
+
+async def _attempt_async(params):
+    async with rate_limiter("serpapi").slot_async():
+        return await serpapi_get_async(params, call_timeout(SERPAPI_TIMEOUT))
+
+
+def _lookup(params, bypass, soft_ttl=None):
+    """(key, cached value or None, its age); entries past soft_ttl are reported as stale."""
+    if bypass is None:
+        bypass = SERP_CACHE_BYPASS
+
+    key = serp_cache_key(params)
+    if bypass:
+        set_attributes(cache="bypass")
+        return key, None, None
+
+    cached, age = _cache.get_entry(key)
+    if cached is None:
+        set_attributes(cache="miss")
+    elif soft_ttl is not None and age >= soft_ttl:
+        set_attributes(cache="stale", age_s=round(age))
+        print(f"⚡ SerpAPI stale cache hit ({params.get('engine', '')}), refreshing in the background")
+    else:
+        set_attributes(cache="hit")
+        print(f"⚡ SerpAPI cache hit ({params.get('engine', '')})")
+    return key, cached, age
+
+
+def _store(key, params, data, ttl=None):
+    if ttl is None:
+        ttl = SERP_CACHE_TTLS.get(params.get("engine", ""), DEFAULT_TTL)
+    if isinstance(data, dict) and data and "error" not in data:
+        _cache.set(key, data, ttl)
@@ -0,0 +1,139 @@
+# singleflight.py
+
+import os, copy, asyncio, threading
+from concurrent.futures import Future
+
+from Shared.tracing import set_attributes
+from Shared.resilience import DeadlineExceeded
+
+# --------------------------------------------------------------------
+# 1. SETUP
+# --------------------------------------------------------------------
+# Concurrent identical SerpAPI / LLM calls share one in-flight request
+SINGLE_FLIGHT = os.environ.get("TPM_SINGLE_FLIGHT", "true").lower() not in ("0", "false", "no")
+
+_groups = {}
+
+
+class _Abandoned(Exception):
+    """Set for followers when the leader stopped for its own reasons: they run the call themselves."""
+
+
+def _abandoned(error):
+    """
+    True for a leader error that says nothing about the call itself: the
+    leader was cancelled, or its own search budget ran out (a follower may
+    have time left, and re-runs the call under its own deadline).
+    """
+    return isinstance(error, (asyncio.CancelledError, DeadlineExceeded))
+
+
+# --------------------------------------------------------------------
+# 2. GROUP
+# --------------------------------------------------------------------
+class SingleFlight:
+    """
+    Collapses concurrent calls with the same key into one: the first caller
+    (the leader) runs fn, the others wait for its result or exception.
+    Nothing is kept once the call finishes, so this is not a cache.
+
+    Followers get a deep copy of the result, since pipelines may edit what
+    they receive. Threads and asyncio tasks are tracked separately; tasks
+    share a call only with tasks on the same event loop. If the leader is
+    cancelled or runs out of search budget, its followers don't inherit
+    that: the next one re-runs fn as the new leader.
+    """
+
+    def __init__(self, name):
+        self.name = name
+        self.stats = {"calls": 0, "shared": 0}
+        self._lock = threading.Lock()
+        self._calls = {}          # key -> concurrent.futures.Future
+        self._async_calls = {}    # (loop, key) -> asyncio.Future
+
+    def do(self, key, fn, *args):
+        if not SINGLE_FLIGHT:
+            return fn(*args)
+
+        with self._lock:
+            future = self._calls.get(key)
+            leader = future is None
+            if leader:
+                future = self._calls[key] = Future()
+            self._count(leader)
+
+        if not leader:
+            set_attributes(singleflight="shared")
+            try:
+                return copy.deepcopy(future.result())
+            except _Abandoned:
+                return self.do(key, fn, *args)
+
+        # The key is dropped before the future resolves, so a follower that
+        # re-runs the call after _Abandoned can't find the finished future again
+        try:
+            result = fn(*args)
+        except BaseException as e:
+            self._forget(self._calls, key)
+            future.set_exception(_Abandoned() if _abandoned(e) else e)
+            raise
+        self._forget(self._calls, key)
+        future.set_result(result)
+        return result
+
+    async def do_async(self, key, fn, *args):
+        """Same as do, with fn a coroutine function."""
+        if not SINGLE_FLIGHT:
+            return await fn(*args)
+
+        loop = asyncio.get_running_loop()
+        with self._lock:
+            future = self._async_calls.get((loop, key))
+            leader = future is None
+            if leader:
+                future = self._async_calls[(loop, key)] = loop.create_future()
+            self._count(leader)
+
+        if not leader:
+            set_attributes(singleflight="shared")
+            # A follower being cancelled must not cancel the leader's call
+            try:
+                return copy.deepcopy(await asyncio.shield(future))
+            except _Abandoned:
+                return await self.do_async(key, fn, *args)
+
+        try:
+            result = await fn(*args)
+        except BaseException as e:
+            self._forget(self._async_calls, (loop, key))
+            future.set_exception(_Abandoned() if _abandoned(e) else e)
+            future.exception()  # retrieved: no "never retrieved" warning without followers
+            raise
+        self._forget(self._async_calls, (loop, key))
+        future.set_result(result)
+        return result
+
+    def _forget(self, calls, key):
+        with self._lock:
+            del calls[key]
+
+    def _count(self, leader):
+        self.stats["calls"] += 1
+        if not leader:
+            self.stats["shared"] += 1
+
+
+# --------------------------------------------------------------------
+# 3. API
+# --------------------------------------------------------------------
+def single_flight(name):
+    """The process-wide SingleFlight group for name (e.g. "serpapi", "llm")."""
+    group = _groups.get(name)
+    if group is None:
+        group = _groups.setdefault(name, SingleFlight(name))
+    return group
+
+
+def single_flight_stats():
+    """{group: {"calls", "shared"}}: shared calls are the upstream requests saved."""
+    return {name: dict(group.stats) for name, group in _groups.items()}
@@ -0,0 +1,145 @@
+# tools.py
+
+import os, copy
+
+# --------------------------------------------------------------------
+# 1. SETUP
+# --------------------------------------------------------------------
+# LLM stages answer through a forced tool call: the reply is the tool's
+# input, already structured, instead of text to be parsed (Shared/parsing.py
+# still checks it against the stage schema). Off → the free-text prompts.
+STRUCTURED_OUTPUT = os.environ.get("TPM_LLM_TOOLS", "true").lower() not in ("0", "false", "no")
+
+_STRING = {"type": "string"}
+
+
+def _strings(names):
+    return {name: dict(_STRING) for name in names}
+
+
+# Selections name candidates by their index "i" (see Shared/selection.py)
+_PICK = {
+    "type": "object",
+    "properties": {"i": {"type": "integer"}, "reason": {"type": "string", "description": "One short sentence"}},
+    "required": ["i", "reason"],
+}
+
+
+def _selection(key, description):
+    return {
+        "type": "object",
+        "properties": {key: {"type": "array", "items": _PICK, "description": description}},
+        "required": [key],
+    }
+
+
+# --------------------------------------------------------------------
+# 2. TOOLS
+# --------------------------------------------------------------------
+# stage -> tool definition plus:
+#   max_tokens  → output budget of the call (the tool input only, no prose)
+#   item_tokens → per selected item, for selection stages: the budget is
+#                 max_tokens + item_tokens * number of items asked for
+#   result      → key holding the selected items (streamed as they complete)
+#   unwrap      → return the value under this key (the free-text stage returns a bare list)
+_FLIGHT_PARAMS = ["engine", "departure_id", "arrival_id", "outbound_date", "return_date", "adults", "children",
+                  "currency", "gl", "hl", "api_key"]
+_FLIGHT_OPTIONAL = ["type", "travel_class", "max_price", "deep_search", "sort_by", "stops", "exclude_airlines",
+                    "include_airlines", "emissions", "layover_duration", "max_duration", "bags", "exclude_conns"]
+_HOTEL_PARAMS = ["engine", "q", "check_in_date", "check_out_date", "adults", "children", "currency", "gl", "hl",
+                 "api_key"]
+_HOTEL_OPTIONAL = ["children_ages", "sort_by", "min_price", "max_price", "property_types", "rating", "brands",
+                   "hotel_class", "free_cancellation", "special_offers", "eco_certified", "vacation_rentals",
+                   "bedrooms", "bathrooms"]
+
+TOOLS = {
+    "flight_params": {
+        "name": "google_flights_params",
+        "description": "SerpAPI google_flights request parameters. Every value is a string; \"\" when not given.",
+        "input_schema": {
+            "type": "object",
+            "properties": _strings(_FLIGHT_PARAMS + _FLIGHT_OPTIONAL),
+            "required": _FLIGHT_PARAMS,
+        },
+        "max_tokens": 400,
+    },
+    "hotel_params": {
+        "name": "google_hotels_params",
+        "description": "SerpAPI google_hotels request parameters. Every value is a string; \"\" when not given.",
+        "input_schema": {
+            "type": "object",
+            "properties": {
+                **_strings(_HOTEL_PARAMS + _HOTEL_OPTIONAL),
+                "amenities": {"type": "string", "description": "Comma-separated amenity ids, e.g. \"1,3,9\""},
+            },
+            "required": _HOTEL_PARAMS,
+        },
+        "max_tokens": 400,
+    },
+    "fix_city": {
+        "name": "city",
+        "description": "The corrected city name.",
+        "input_schema": {"type": "object", "properties": {"city": _STRING}, "required": ["city"]},
+        "max_tokens": 100,
+    },
+    "top_flights": {
+        "name": "select_flights",
+        "description": "The selected flights, best first.",
+        "input_schema": _selection("final_flights", "Selected itineraries by \"i\""),
+        "max_tokens": 100,
+        "item_tokens": 60,
+        "result": "final_flights",
+    },
+    "top_hotels": {
+        "name": "select_hotels",
+        "description": "The selected hotels, best first.",
+        "input_schema": _selection("top_hotels", "Selected hotels by \"i\""),
+        "max_tokens": 100,
+        "item_tokens": 60,
+        "result": "top_hotels",
+    },
+    "top_items": {
+        "name": "select_items",
+        "description": "The selected items, best first.",
+        "input_schema": _selection("items", "Selected items by \"i\""),
+        "max_tokens": 100,
+        "item_tokens": 60,
+        "result": "items",
+        "unwrap": "items",
+    },
+}
+
+_API_FIELDS = ("name", "description", "input_schema")
+
+
+# --------------------------------------------------------------------
+# 3. API
+# --------------------------------------------------------------------
+def stage_tool(stage, limit=None, max_tokens=None):
+    """
+    The tool a stage answers through, or None (structured output off, or a
+    stage without a tool). Selection tools are limited to `limit` items.
+    Returns (tool definition for the API, output budget, spec).
+    """
+    spec = TOOLS.get(stage) if STRUCTURED_OUTPUT else None
+    if spec is None:
+        return None
+
+    tool = {field: spec[field] for field in _API_FIELDS}
+    budget = spec["max_tokens"]
+    if "result" in spec:
+        if limit:
+            tool["input_schema"] = copy.deepcopy(tool["input_schema"])
+            tool["input_schema"]["properties"][spec["result"]]["maxItems"] = limit
+        budget += spec["item_tokens"] * (limit or 5)
+    if max_tokens:
+        budget = min(budget, max_tokens)
+    return tool, budget, spec
+
+
+def tool_result(value, spec):
+    """The stage's value from the tool input (see "unwrap")."""
+    key = spec.get("unwrap")
+    if key and isinstance(value, dict):
+        return value.get(key)
+    return value
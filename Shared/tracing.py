@@ -0,0 +1,226 @@
+# tracing.py
+
+import os, json, time, uuid, inspect, threading, functools, contextvars
+from contextlib import contextmanager
+
+# --------------------------------------------------------------------
+# 1. SETUP
+# --------------------------------------------------------------------
+# Spans are always recorded in memory (cheap); files are only written
+# when TPM_TRACE_EXPORT is on.
+TRACE_EXPORT = os.environ.get("TPM_TRACE_EXPORT", "").lower() in ("1", "true", "yes")
+TRACE_DIR = os.environ.get("TPM_TRACE_DIR", ".tpm_traces")
+SERVICE_NAME = "travel-plan-mate"
+
+_current_trace = contextvars.ContextVar("tpm_trace", default=None)
+_current_span = contextvars.ContextVar("tpm_span", default=None)
+
+
+# --------------------------------------------------------------------
+# 2. DATA
+# --------------------------------------------------------------------
+class Span:
+    __slots__ = ("trace_id", "span_id", "parent_id", "name", "pipeline", "start", "end", "start_ns", "attributes", "error")
+
+    def __init__(self, trace_id, name, parent_id=None, attributes=None, pipeline=None):
+        self.trace_id = trace_id
+        self.span_id = uuid.uuid4().hex[:16]
+        self.parent_id = parent_id
+        self.name = name
+        self.pipeline = pipeline
+        self.start_ns = time.time_ns()
+        self.start = time.perf_counter()
+        self.end = None
+        self.attributes = dict(attributes or {})
+        self.error = None
+
+    @property
+    def duration(self):
+        return (self.end if self.end is not None else time.perf_counter()) - self.start
+
+    def to_dict(self, origin):
+        """Plain dict with offsets (seconds) relative to origin, for UIs and logs."""
+        return {
+            "name": self.name,
+            "span_id": self.span_id,
+            "parent_id": self.parent_id,
+            "pipeline": self.pipeline,
+            "offset": self.start - origin,
+            "duration": self.duration,
+            "attributes": self.attributes,
+            "error": self.error,
+        }
+
+
+class Trace:
+    """All spans recorded for one search. Thread-safe: pipelines add spans from worker threads."""
+
+    def __init__(self, name, attributes=None):
+        self.trace_id = uuid.uuid4().hex
+        self.name = name
+        self.attributes = dict(attributes or {})
+        self.spans = []
+        self.start = time.perf_counter()
+        self._lock = threading.Lock()
+        self._listeners = []
+
+    def add(self, span):
+        with self._lock:
+            self.spans.append(span)
+            listeners = list(self._listeners)
+        for listener in listeners:
+            listener(span)
+
+    def subscribe(self, listener):
+        """Calls listener(span) as each span ends (from the thread that ran it). Returns an unsubscribe function."""
+        with self._lock:
+            self._listeners.append(listener)
+
+        def unsubscribe():
+            with self._lock:
+                if listener in self._listeners:
+                    self._listeners.remove(listener)
+        return unsubscribe
+
+    def summary(self):
+        """Spans in start order as plain dicts (see Span.to_dict)."""
+        with self._lock:
+            spans = sorted(self.spans, key=lambda s: s.start)
+        return [s.to_dict(self.start) for s in spans]
+
+    def to_otlp(self):
+        """OTLP/JSON (ExportTraceServiceRequest) document, loadable by OpenTelemetry tooling."""
+        with self._lock:
+            spans = list(self.spans)
+
+        otlp_spans = []
+        for s in spans:
+            end_ns = s.start_ns + int(s.duration * 1e9)
+            otlp_spans.append({
+                "traceId": s.trace_id,
+                "spanId": s.span_id,
+                "parentSpanId": s.parent_id or "",
+                "name": s.name,
+                "kind": 1,
+                "startTimeUnixNano": str(s.start_ns),
+                "endTimeUnixNano": str(end_ns),
+                "attributes": _otlp_attributes(s.attributes),
+                "status": {"code": 2, "message": s.error} if s.error else {"code": 1},
+            })
+
+        return {
+            "resourceSpans": [{
+                "resource": {"attributes": _otlp_attributes(dict(self.attributes, **{"service.name": SERVICE_NAME}))},
+                "scopeSpans": [{"scope": {"name": "tpm"}, "spans": otlp_spans}],
+            }]
+        }
+
+    def export(self, directory=None):
+        """Writes the trace as OTLP JSON to <directory>/<trace_id>.json and returns the path."""
+        directory = directory or TRACE_DIR
+        os.makedirs(directory, exist_ok=True)
+        path = os.path.join(directory, f"{self.trace_id}.json")
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(self.to_otlp(), f, ensure_ascii=False)
+        return path
+
+
+def _otlp_attributes(attributes):
+    out = []
+    for key, value in attributes.items():
+        if isinstance(value, bool):
+            v = {"boolValue": value}
+        elif isinstance(value, int):
+            v = {"intValue": str(value)}
+        elif isinstance(value, float):
+            v = {"doubleValue": value}
+        else:
+            v = {"stringValue": str(value)}
+        out.append({"key": key, "value": v})
+    return out
+
+
+# --------------------------------------------------------------------
+# 3. API
+# --------------------------------------------------------------------
+def current_trace():
+    return _current_trace.get()
+
+
+@contextmanager
+def start_trace(name, **attributes):
+    """
+    Opens a trace for the enclosed work (one search). If a trace is already
+    active, spans join it instead, so callers such as main.py can wrap
+    run_TPM and still see its spans. Exported on exit when TPM_TRACE_EXPORT is on.
+    """
+    existing = _current_trace.get()
+    if existing is not None:
+        with span(name, **attributes):
+            yield existing
+        return
+
+    trace = Trace(name, attributes)
+    token = _current_trace.set(trace)
+    try:
+        with span(name, **attributes):
+            yield trace
+    finally:
+        _current_trace.reset(token)
+        if TRACE_EXPORT:
+            try:
+                print(f"🧭 Trace written to {trace.export()}")
+            except OSError as e:
+                print(f"⚠️ Could not export trace: {e}")
+
+
+@contextmanager
+def span(name, **attributes):
+    """Records one timed stage. No-op (but still yields a Span) outside a trace."""
+    trace = _current_trace.get()
+    parent = _current_span.get()
+    # Spans inherit the pipeline ("hotels", "flights", ...) of the pipeline.<name> span they run under
+    pipeline = name.split(".", 1)[1] if name.startswith("pipeline.") else (parent.pipeline if parent else None)
+    s = Span(trace.trace_id if trace else "", name, parent.span_id if parent else None, attributes, pipeline)
+    token = _current_span.set(s)
+    try:
+        yield s
+    except BaseException as e:
+        s.error = f"{type(e).__name__}: {e}"
+        raise
+    finally:
+        s.end = time.perf_counter()
+        _current_span.reset(token)
+        if trace is not None:
+            trace.add(s)
+
+
+def set_attributes(**attributes):
+    """Adds attributes (tokens, bytes, cache hit/miss, ...) to the current span."""
+    s = _current_span.get()
+    if s is not None:
+        s.attributes.update(attributes)
+
+
+def traced(name):
+    """Decorator form of span() for sync and async functions."""
+    def decorator(fn):
+        if inspect.iscoroutinefunction(fn):
+            @functools.wraps(fn)
+            async def async_wrapper(*args, **kwargs):
+                with span(name):
+                    return await fn(*args, **kwargs)
+            return async_wrapper
+
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            with span(name):
+                return fn(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def submit(executor, fn, *args, **kwargs):
+    """executor.submit that carries the current trace/span into the worker thread."""
+    ctx = contextvars.copy_context()
+    return executor.submit(ctx.run, fn, *args, **kwargs)
@@ -1,65 +1,367 @@
+import os
+import json
 import time
-from concurrent.futures import ThreadPoolExecutor, as_completed
+import queue
+import asyncio
+from concurrent.futures import ThreadPoolExecutor, Future, wait
 
-from Hotels.travel_hotels_pipeline import run_hotels
-from Flights.travel_flights_pipeline import run_flights
-from Activities.travel_things_pipeline import run_tripadvisor
+from Hotels.travel_hotels_pipeline import run_hotels, run_hotels_async
+from Flights.travel_flights_pipeline import run_flights, run_flights_async
+from Activities.travel_things_pipeline import run_tripadvisor, run_tripadvisor_async
+from Shared.params_builder import build_flight_params, build_hotel_params
+from Shared.tracing import start_trace, span, submit
+from Shared.resilience import search_budget
 
-def run_TPM(from_city, to_city, travelers, dates, activities_percentages,
-            run_hotels_flag=True, run_flights_flag=True, run_tripadvisor_flag=True,
-            ):
-    
-    start = time.perf_counter()
+# Extra seconds a pipeline gets past the budget to wrap up what its upstream calls returned
+BUDGET_GRACE = 0.5
 
+def prepare_inputs(from_city, to_city, travelers, dates, fast_params=True):
+    """Returns (user_text, hotel_params, flight_params) shared by the sync and async runners."""
     # Construct user_text for hotels/flights
     user_text = f"Book a trip from {from_city} to {to_city} for {travelers} traveler(s) from {dates}"
-    
-    futures = {}
-    results = {}
 
-    # Counters
-    pipeline_counters = {
-        "hotels": {"success": 0, "failed": 0},
-        "flights": {"success": 0, "failed": 0},
-        "tripadvisor": {"success": 0, "failed": 0},
+    # Build SerpAPI params straight from the form fields; anything the builder
+    # can't resolve (unknown city, bad dates) stays None and falls back to the LLM
+    hotel_params = flight_params = None
+    if fast_params:
+        with span("params.build") as s:
+            hotel_params = build_hotel_params(from_city, to_city, travelers, dates)
+            flight_params = build_flight_params(from_city, to_city, travelers, dates)
+            s.attributes.update(hotels=hotel_params is not None, flights=flight_params is not None)
+
+    return user_text, hotel_params, flight_params
+
+
+def _stage_event(span):
+    return {
+        "type": "stage",
+        "pipeline": span.pipeline,
+        "stage": span.name,
+        "duration": span.duration,
+        "attributes": dict(span.attributes),
+        "error": span.error,
     }
 
-    start = time.perf_counter()
 
-    with ThreadPoolExecutor(max_workers=3) as executor:
-        if run_hotels_flag:
-            futures[executor.submit(run_hotels, user_text)] = "hotels"
+def _listen_stages(trace, on_event):
+    """Forwards every finished stage span that belongs to a pipeline to on_event."""
+    def listener(span):
+        if span.pipeline and not span.name.startswith("pipeline."):
+            on_event(_stage_event(span))
+    return trace.subscribe(listener)
 
-        if run_flights_flag:
-            futures[executor.submit(run_flights, user_text)] = "flights"
 
+def _timed_out(pending, elapsed):
+    for key in pending:
+        print(f"⏱ {key} pipeline did not finish within the time budget")
+        yield {"type": "error", "pipeline": key, "error": "Timed out", "elapsed": elapsed}
+
+
+def iter_TPM(from_city, to_city, travelers, dates, activities_percentages,
+             run_hotels_flag=True, run_flights_flag=True, run_tripadvisor_flag=True,
+             fast_params=True, hotel_constraints=None, flight_constraints=None,
+             budget=None,
+             ):
+    """
+    Generator form of run_TPM: yields events as the search progresses, so a
+    UI can show each pipeline's result as soon as it is ready.
+
+      {"type": "stage",  "pipeline", "stage", "duration", "attributes", "error"}  a pipeline step finished
+      {"type": "result", "pipeline", "result", "elapsed"}                         a pipeline finished
+      {"type": "error",  "pipeline", "error", "elapsed"}                          a pipeline failed
+      {"type": "done",   "results", "elapsed"}                                    always last
+
+    budget: seconds for the whole search (default TPM_SEARCH_BUDGET, 0 = none).
+    Every upstream call gets a deadline within it; pipelines still running
+    when it is spent are reported as errors and left out of the results.
+
+    Closing the generator early stops waiting; pipelines already running finish in the background.
+    """
+    with start_trace("run_TPM", from_city=from_city, to_city=to_city, travelers=travelers, dates=dates) as trace, \
+            search_budget(budget) as deadline:
+        start = time.perf_counter()
+
+        # Stage spans and finished futures land in one queue, in completion order
+        events = queue.Queue()
+        unsubscribe = _listen_stages(trace, events.put)
+
+        user_text, hotel_params, flight_params = prepare_inputs(from_city, to_city, travelers, dates, fast_params)
+
+        jobs = {}
+        if run_hotels_flag:
+            jobs["hotels"] = (run_hotels, user_text, hotel_params, hotel_constraints)
+        if run_flights_flag:
+            jobs["flights"] = (run_flights, user_text, flight_params, flight_constraints)
         if run_tripadvisor_flag:
-            futures[executor.submit(run_tripadvisor, to_city, activities_percentages)] = "tripadvisor"
+            jobs["tripadvisor"] = (run_tripadvisor, to_city, activities_percentages)
 
-        for future in as_completed(futures):
-            key = futures[future]
+        results = {}
 
-            try:
-                results[key] = future.result()
-                pipeline_counters[key]["success"] += 1
+        # Counters
+        pipeline_counters = {
+            "hotels": {"success": 0, "failed": 0},
+            "flights": {"success": 0, "failed": 0},
+            "tripadvisor": {"success": 0, "failed": 0},
+        }
+
+        executor = ThreadPoolExecutor(max_workers=3)
+        try:
+            futures = {}
+            for key, (fn, *args) in jobs.items():
+                future = submit(executor, fn, *args)
+                futures[future] = key
+                future.add_done_callback(events.put)
+
+            while len(results) < len(futures):
+                try:
+                    event = events.get(timeout=None if deadline is None
+                                       else max(deadline + BUDGET_GRACE - time.monotonic(), 0))
+                except queue.Empty:
+                    pending = [key for key in jobs if key not in results]
+                    results.update(dict.fromkeys(pending))
+                    yield from _timed_out(pending, time.perf_counter() - start)
+                    break
+
+                if not isinstance(event, Future):
+                    yield event
+                    continue
+
+                key = futures[event]
+                elapsed = time.perf_counter() - start
+                try:
+                    results[key] = event.result()
+                    pipeline_counters[key]["success"] += 1
+                    yield {"type": "result", "pipeline": key, "result": results[key], "elapsed": elapsed}
+
+                except Exception as e:
+                    print(f"❌ Error in {key} pipeline: {e}")
+                    results[key] = None
+                    pipeline_counters[key]["failed"] += 1
+                    yield {"type": "error", "pipeline": key, "error": str(e), "elapsed": elapsed}
+        finally:
+            unsubscribe()
+            executor.shutdown(wait=False, cancel_futures=True)
+
+        time_taken = time.perf_counter() - start
+        print(f"\nTotal time taken to run TPM pipelines: {time_taken:.2f} seconds")
+
+        # Print counters summary
+        # print("\nPipeline Summary:")
+        # for k, v in pipeline_counters.items():
+        #     print(f"{k.upper()} → ✅ Success: {v['success']} | ❌ Failed: {v['failed']}")
+
+        yield {"type": "done", "results": results, "elapsed": time_taken}
+
+
+def run_TPM(from_city, to_city, travelers, dates, activities_percentages,
+            run_hotels_flag=True, run_flights_flag=True, run_tripadvisor_flag=True,
+            fast_params=True, hotel_constraints=None, flight_constraints=None,
+            on_event=None, budget=None,
+            ):
+    """
+    Runs the selected pipelines in parallel and returns {pipeline: result or None}
+    within budget seconds (see iter_TPM).
+    on_event, if given, is called with every iter_TPM event as it happens.
+    """
+    results = {}
+    for event in iter_TPM(from_city, to_city, travelers, dates, activities_percentages,
+                          run_hotels_flag, run_flights_flag, run_tripadvisor_flag,
+                          fast_params, hotel_constraints, flight_constraints, budget):
+        if on_event:
+            on_event(event)
+        if event["type"] == "done":
+            results = event["results"]
+    return results
 
+
+async def run_TPM_async(from_city, to_city, travelers, dates, activities_percentages,
+                        run_hotels_flag=True, run_flights_flag=True, run_tripadvisor_flag=True,
+                        fast_params=True, hotel_constraints=None, flight_constraints=None,
+                        on_event=None, budget=None,
+                        ):
+    """
+    asyncio-native run_TPM: every pipeline runs as a task on the caller's event
+    loop using the async Anthropic and HTTP clients, so many searches can share
+    one loop. Same arguments, events (see iter_TPM) and return value as run_TPM.
+    Call Shared.clients.close_async_clients() before the loop shuts down.
+    """
+    with start_trace("run_TPM_async", from_city=from_city, to_city=to_city, travelers=travelers, dates=dates) as trace, \
+            search_budget(budget) as deadline:
+        start = time.perf_counter()
+        emit = on_event or (lambda event: None)
+        unsubscribe = _listen_stages(trace, emit)
+
+        user_text, hotel_params, flight_params = prepare_inputs(from_city, to_city, travelers, dates, fast_params)
+
+        coros = {}
+        if run_hotels_flag:
+            coros["hotels"] = run_hotels_async(user_text, hotel_params, hotel_constraints)
+        if run_flights_flag:
+            coros["flights"] = run_flights_async(user_text, flight_params, flight_constraints)
+        if run_tripadvisor_flag:
+            coros["tripadvisor"] = run_tripadvisor_async(to_city, activities_percentages)
+
+        async def tagged(key, coro):
+            try:
+                return key, await coro, None
             except Exception as e:
-                print(f"❌ Error in {key} pipeline: {e}")
-                results[key] = None
-                pipeline_counters[key]["failed"] += 1
-
-
-    time_taken = time.perf_counter() - start
-    print(f"\nTotal time taken to run TPM pipelines: {time_taken:.2f} seconds")
-
-    # Print counters summary
-    # print("\nPipeline Summary:")
-    # for k, v in pipeline_counters.items():
-    #     print(f"{k.upper()} → ✅ Success: {v['success']} | ❌ Failed: {v['failed']}")
-        
-        
-        
-    
+                return key, None, e
+
+        results = {}
+        pending = {asyncio.ensure_future(tagged(k, c)) for k, c in coros.items()}
+        try:
+            while pending:
+                timeout = None if deadline is None else max(deadline + BUDGET_GRACE - time.monotonic(), 0)
+                done, pending = await asyncio.wait(pending, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+                elapsed = time.perf_counter() - start
+                if not done:
+                    late = [key for key in coros if key not in results]
+                    results.update(dict.fromkeys(late))
+                    for event in _timed_out(late, elapsed):
+                        emit(event)
+                    break
+                for task in done:
+                    key, result, error = task.result()
+                    if error is not None:
+                        print(f"❌ Error in {key} pipeline: {error}")
+                        results[key] = None
+                        emit({"type": "error", "pipeline": key, "error": str(error), "elapsed": elapsed})
+                    else:
+                        results[key] = result
+                        emit({"type": "result", "pipeline": key, "result": result, "elapsed": elapsed})
+        finally:
+            for task in pending:
+                task.cancel()
+            unsubscribe()
+
+        time_taken = time.perf_counter() - start
+        print(f"\nTotal time taken to run TPM pipelines (async): {time_taken:.2f} seconds")
+        emit({"type": "done", "results": results, "elapsed": time_taken})
+
     return results
 
 
+# Max pipeline runs in flight at once across a whole run_TPM_batch call
+BATCH_CONCURRENCY = int(os.environ.get("TPM_BATCH_CONCURRENCY", "8"))
+
+BATCH_PIPELINES = {"hotels": run_hotels, "flights": run_flights, "tripadvisor": run_tripadvisor}
+BATCH_PIPELINES_ASYNC = {"hotels": run_hotels_async, "flights": run_flights_async, "tripadvisor": run_tripadvisor_async}
+
+
+def _job_key(pipeline, *parts):
+    return pipeline + ":" + json.dumps(parts, sort_keys=True, default=str)
+
+
+def _hotel_job_text(query):
+    """Preference text for a shared hotel job, built only from the params it is keyed on."""
+    return (f"Book a stay: {query['q']} for {query['adults']} traveler(s) "
+            f"from {query['check_in_date']} to {query['check_out_date']}")
+
+
+def plan_batch(specs, fast_params=True):
+    """
+    Splits trip specs into unique pipeline runs.
+
+    specs: list of dicts with run_TPM's arguments (from_city, to_city, travelers,
+    dates, activities_percentages, optional flags/constraints) and an optional "id".
+    Returns (jobs, assignments): jobs maps a job key to (pipeline, args) and
+    assignments maps each spec id (its "id", else its index) to {pipeline: job key}.
+    Specs that need the same hotel query, flight search or destination
+    activities share one job.
+    """
+    jobs, assignments = {}, {}
+    for index, spec in enumerate(specs):
+        spec_id = spec.get("id", index)
+        if spec_id in assignments:
+            raise ValueError(f"Duplicate spec id: {spec_id!r}")
+
+        user_text, hotel_params, flight_params = prepare_inputs(
+            spec["from_city"], spec["to_city"], spec.get("travelers", 1), spec["dates"],
+            spec.get("fast_params", fast_params))
+
+        wanted = {}
+        if spec.get("run_hotels_flag", True):
+            constraints = spec.get("hotel_constraints")
+            # Built params are keyed as they are (the origin only shows through
+            # their currency/gl), so the job's ranking text must not mention the
+            # origin either: specs sharing the job would be ranked against the
+            # first one's trip. LLM-generated params are keyed on the text itself.
+            if hotel_params:
+                query = dict(hotel_params, q=hotel_params["q"].lower())
+                text = _hotel_job_text(query)
+            else:
+                query = text = user_text
+            key = _job_key("hotels", query, constraints)
+            wanted["hotels"] = (key, (text, hotel_params, constraints))
+        if spec.get("run_flights_flag", True):
+            constraints = spec.get("flight_constraints")
+            key = _job_key("flights", flight_params or user_text, constraints)
+            wanted["flights"] = (key, (user_text, flight_params, constraints))
+        if spec.get("run_tripadvisor_flag", True):
+            city, percentages = spec["to_city"], spec.get("activities_percentages") or {}
+            key = _job_key("tripadvisor", str(city).strip().lower(), percentages)
+            wanted["tripadvisor"] = (key, (city, percentages))
+
+        assignments[spec_id] = {}
+        for pipeline, (key, args) in wanted.items():
+            jobs.setdefault(key, (pipeline, args))
+            assignments[spec_id][pipeline] = key
+    return jobs, assignments
+
+
+def _batch_results(jobs, assignments, outcomes):
+    """{spec id: {pipeline: result or None}} from {job key: result}; failed jobs are missing from outcomes."""
+    shared = sum(len(keys) for keys in assignments.values()) - len(jobs)
+    failed = len(jobs) - len(outcomes)
+    print(f"🧮 Batch: {len(assignments)} searches → {len(jobs)} pipeline runs "
+          f"({shared} shared, {failed} failed)")
+    return {spec_id: {pipeline: outcomes.get(key) for pipeline, key in keys.items()}
+            for spec_id, keys in assignments.items()}
+
+
+def run_TPM_batch(specs, max_concurrency=None, fast_params=True):
+    """
+    Runs many trip searches in one call (e.g. nightly precomputation of popular routes).
+
+    Identical sub-requests across specs run once (see plan_batch), and at most
+    max_concurrency (TPM_BATCH_CONCURRENCY) pipeline runs are in flight at a time
+    on one shared executor. Returns {spec id: {pipeline: result or None}} like
+    run_TPM per spec; specs that shared a job get the same result object.
+    """
+    jobs, assignments = plan_batch(specs, fast_params)
+    outcomes = {}
+
+    with start_trace("run_TPM_batch", searches=len(specs), jobs=len(jobs)):
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=max_concurrency or BATCH_CONCURRENCY) as executor:
+            futures = {submit(executor, BATCH_PIPELINES[pipeline], *args): key
+                       for key, (pipeline, args) in jobs.items()}
+            for future in wait(futures).done:
+                key = futures[future]
+                try:
+                    outcomes[key] = future.result()
+                except Exception as e:
+                    print(f"❌ Error in {key}: {e}")
+
+        print(f"\nTotal time taken to run TPM batch: {time.perf_counter() - start:.2f} seconds")
+    return _batch_results(jobs, assignments, outcomes)
+
+
+async def run_TPM_batch_async(specs, max_concurrency=None, fast_params=True):
+    """asyncio run_TPM_batch: jobs run as tasks on the caller's loop, bounded by a semaphore."""
+    jobs, assignments = plan_batch(specs, fast_params)
+    outcomes = {}
+    limit = asyncio.Semaphore(max_concurrency or BATCH_CONCURRENCY)
+
+    async def run(key, pipeline, args):
+        async with limit:
+            try:
+                outcomes[key] = await BATCH_PIPELINES_ASYNC[pipeline](*args)
+            except Exception as e:
+                print(f"❌ Error in {key}: {e}")
+
+    with start_trace("run_TPM_batch_async", searches=len(specs), jobs=len(jobs)):
+        start = time.perf_counter()
+        await asyncio.gather(*(run(key, pipeline, args) for key, (pipeline, args) in jobs.items()))
+        print(f"\nTotal time taken to run TPM batch (async): {time.perf_counter() - start:.2f} seconds")
+    return _batch_results(jobs, assignments, outcomes)
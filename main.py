@@ -1,8 +1,11 @@
 import datetime
+import html
 import time
 import streamlit as st
 from streamlit_option_menu import option_menu
 from TPM_runner import run_TPM
+from Shared.tracing import start_trace
+from Shared.prompts import validate_prompts
 
 
 # -------------------------------
@@ -14,10 +17,298 @@ if "last_search_results" not in st.session_state:
     st.session_state.last_search_results = {}
 if "selected_category" not in st.session_state:
     st.session_state.selected_category = None
+if "last_trace" not in st.session_state:
+    st.session_state.last_trace = []
+
+# Waterfall bar colour per span family (prefix before the first dot)
+SPAN_COLORS = {
+    "run_TPM": "#6c757d",
+    "pipeline": "#343a40",
+    "params": "#20c997",
+    "llm": "#7048e8",
+    "serpapi": "#1c7ed6",
+    "prefilter": "#f59f00",
+}
+
+
+def render_waterfall(spans):
+    """Renders trace spans as horizontal bars offset/sized by their share of the total run."""
+    if not spans:
+        return
+    total = max(s["offset"] + s["duration"] for s in spans) or 1
+    rows = []
+    for s in spans:
+        left = 100 * s["offset"] / total
+        width = max(100 * s["duration"] / total, 0.5)
+        color = "#e03131" if s["error"] else SPAN_COLORS.get(s["name"].split(".")[0], "#495057")
+        # Attributes carry user-typed cities: escape before they reach the HTML
+        attrs = html.escape(", ".join(f"{k}={v}" for k, v in s["attributes"].items()), quote=True)
+        name = html.escape(s["name"], quote=True)
+        rows.append(
+            f"<div style='display:flex;align-items:center;font-size:12px;margin:1px 0' title='{attrs}'>"
+            f"<div style='width:32%;overflow:hidden;white-space:nowrap'>{name}</div>"
+            f"<div style='width:58%;position:relative;height:14px;background:#f1f3f5'>"
+            f"<div style='position:absolute;left:{left:.2f}%;width:{width:.2f}%;height:100%;background:{color}'></div>"
+            f"</div>"
+            f"<div style='width:10%;text-align:right'>{s['duration']:.2f}s</div>"
+            f"</div>"
+        )
+    st.markdown("".join(rows), unsafe_allow_html=True)
+
+# Pipeline steps shown in the live progress log while a search runs
+LIVE_STAGES = {
+    "serpapi.fetch": "fetched results",
+    "prefilter.hotels": "filtered candidates",
+    "prefilter.flights": "filtered candidates",
+    "hotels.select": "picked hotels",
+    "flights.select": "picked flights",
+    "activities.select": "picked places",
+}
+PIPELINE_ICONS = {"hotels": "🏨", "flights": "✈️", "tripadvisor": "🎯"}
+
+
+def result_categories(pipeline, result):
+    """Splits one pipeline's result into (category_key, results) pairs for render_results."""
+    if not result:
+        return []
+    if pipeline == "tripadvisor":
+        return [(key, val) for key, val in result.items() if val]
+    return [(pipeline, result)]
+
+
+def render_results(category_key, results):
+    """Card view for one category: "activities", "restaurants", "hotels" or "flights"."""
+    # 1️⃣ Activities → show as boxed cards
+    if category_key == "activities":
+        for act in results:
+            with st.container():
+                st.markdown(
+                    f"""
+                    <div style="
+                        display: flex;
+                        border: 1px solid #ddd;
+                        border-radius: 12px;
+                        padding: 10px;
+                        margin-bottom: 15px;
+                        background-color: #f9f9f9;
+                        color: #111;
+                        box-shadow: 2px 2px 5px rgba(0,0,0,0.05);
+                    ">
+                        <div style="flex: 1; min-width: 120px;">
+                            <img src="{act.get('thumbnail', '')}" style="width: 100%; border-radius: 10px;">
+                        </div>
+                        <div style="flex: 2; padding-left: 15px;">
+                            <h4 style="color: #111;">{act.get('title', 'No title')}</h4>
+                            <p><b>Location:</b> {act.get('location', 'N/A')}</p>
+                            <p><b>Rating:</b> {act.get('rating', 'N/A')} ⭐ | <b>Reviews:</b> {act.get('reviews', 'N/A')}</p>
+                            <p>{act.get('description', '')[:200]}{'...' if len(act.get('description', ''))>200 else ''}</p>
+                            <p><a href="{act.get('link', '#')}" target="_blank">View More</a></p>
+                        </div>
+                    </div>
+                    """,
+                    unsafe_allow_html=True
+                )
+
+    # 2️⃣ Restaurants → show as boxed cards
+    elif category_key == "restaurants":
+        for res in results:
+            with st.container():
+                st.markdown(
+                    f"""
+                    <div style="
+                        display: flex;
+                        border: 1px solid #ddd;
+                        border-radius: 12px;
+                        padding: 10px;
+                        margin-bottom: 15px;
+                        background-color: #fefefe;
+                        color: #111;
+                        box-shadow: 2px 2px 5px rgba(0,0,0,0.05);
+                    ">
+                        <div style="flex: 1; min-width: 120px;">
+                            <img src="{res.get('thumbnail', '')}" style="width: 100%; border-radius: 10px;">
+                        </div>
+                        <div style="flex: 2; padding-left: 15px;">
+                            <h4 style="color: #111;">{res.get('title', 'No title')}</h4>
+                            <p><b>Location:</b> {res.get('location', 'N/A')}</p>
+                            <p><b>Rating:</b> {res.get('rating', 'N/A')} ⭐ | <b>Reviews:</b> {res.get('reviews', 'N/A')}</p>
+                            <p>{res.get('description', '')[:200]}{'...' if len(res.get('description', ''))>200 else ''}</p>
+                            <p><a href="{res.get('link', '#')}" target="_blank">View More</a></p>
+                        </div>
+                    </div>
+                    """,
+                    unsafe_allow_html=True
+                )
+
+
+
+    # 3️⃣ Hotels → show as boxed cards with gallery & expander
+    elif category_key == "hotels":
+        for hotel in results:
+            with st.container():
+                # Extract first 3 images for gallery preview
+                images = hotel.get("images", [])[:3]
+                gallery_html = "".join(
+                    f'<img src="{img.get("thumbnail", "")}" style="width:32%; margin-right:2%; border-radius:8px;">'
+                    for img in images
+                )
+
+                # Get pricing info
+                rate = hotel.get("rate_per_night", {})
+                total_rate = hotel.get("total_rate", {})
+                per_night = rate.get("lowest", "N/A")
+                total = total_rate.get("lowest", "N/A")
+
+                # Main hotel card
+                st.markdown(
+                    f"""
+                    <div style="
+                        display: flex;
+                        flex-direction: column;
+                        border: 1px solid #ddd;
+                        border-radius: 12px;
+                        padding: 12px;
+                        margin-bottom: 20px;
+                        background-color: #1e1e1e;
+                        color: #f1f1f1;
+                        box-shadow: 2px 2px 5px rgba(0,0,0,0.3);
+                    ">
+                        <h3 style="color:#f1f1f1;">{hotel.get('name', 'No name')}</h3>
+                        <p><b>Hotel Class:</b> {hotel.get('hotel_class', 'N/A')} | <b>Rating:</b> {hotel.get('overall_rating', 'N/A')} ⭐ ({hotel.get('reviews', '0')} reviews)</p>
+                        <p><b>Price per night:</b> {per_night} | <b>Total for stay:</b> {total}</p>
+                        <div style="display:flex; margin-bottom:10px;">{gallery_html}</div>
+                        <p>{hotel.get('description', '')[:200]}{'...' if len(hotel.get('description', ''))>200 else ''}</p>
+                        <p><a href="{hotel.get('link', '#')}" target="_blank">Visit Hotel Site</a></p>
+                    </div>
+                    """,
+                    unsafe_allow_html=True
+                )
+
+                # Expander for more details
+                with st.expander("More Details"):
+                    # Amenities
+                    amenities = hotel.get("amenities", [])
+                    amenities_str = ", ".join(amenities) if amenities else "N/A"
+
+                    # Check-in/out
+                    check_in = hotel.get("check_in_time", "N/A")
+                    check_out = hotel.get("check_out_time", "N/A")
+
+                    # Nearby places
+                    nearby_places = hotel.get("nearby_places", [])
+                    nearby_html = ""
+                    for place in nearby_places:
+                        name = place.get("name", "")
+                        transports = place.get("transportations", [])
+                        transport_str = ", ".join(f'{t.get("type")}: {t.get("duration")}' for t in transports)
+                        nearby_html += f"<li>{name} ({transport_str})</li>"
+
+                    # Ratings breakdown
+                    ratings_breakdown = hotel.get("reviews_breakdown", [])
+                    ratings_html = ""
+                    for r in ratings_breakdown:
+                        ratings_html += f"<li>{r.get('name')}: {r.get('positive', 0)}👍 / {r.get('negative', 0)}👎 / {r.get('neutral', 0)}😐</li>"
+
+                    st.markdown(
+                        f"""
+                        <p><b>Amenities:</b> {amenities_str}</p>
+                        <p><b>Check-in:</b> {check_in} | <b>Check-out:</b> {check_out}</p>
+                        <p><b>Nearby Places:</b></p>
+                        <ul>{nearby_html}</ul>
+                        <p><b>Review Breakdown:</b></p>
+                        <ul>{ratings_html}</ul>
+                        """,
+                        unsafe_allow_html=True
+                    )
+
+
+    elif category_key == "flights":
+        selected_flights = results.get("selected_flights", [])
+
+        for i, selected in enumerate(selected_flights):
+            with st.container():
+                st.write("---")  # separator between flight options
+
+                # Determine trip type
+                trip_label = "Outbound" if i == 0 else "Return"
+
+                # Main container for this flight option
+                flight_type = selected.get("type", "N/A")
+                total_duration = selected.get("total_duration", "N/A")
+                airline_logo = selected.get("airline_logo", "")
+
+                # Flight option card with top logo + trip label
+                st.markdown(
+                    f"""
+                    <div style="
+                        border: 2px solid #444;
+                        border-radius: 16px;
+                        padding: 12px;
+                        margin-bottom: 20px;
+                        background-color: #1e1e1e;
+                        box-shadow: 3px 3px 8px rgba(0,0,0,0.5);
+                    ">
+                        <div style="display:flex; align-items:center; justify-content:space-between; margin-bottom:10px;">
+                            <div style="display:flex; align-items:center;">
+                                <img src="{airline_logo}" width="70" style="border-radius:8px; margin-right:12px;">
+                                <h4 style="margin:0; color:#f1f1f1;">{trip_label} | Total Duration: {total_duration/60:.1f} hours</h4>
+                            </div>
+                            <a href="{results.get('search_metadata', {}).get('google_flights_url', '#')}" target="_blank" style="background-color:#ff4b2b; color:white; padding:8px 16px; border-radius:8px; text-decoration:none;">View on Google Flights</a>
+                        </div>
+                    </div>
+                    """,
+                    unsafe_allow_html=True
+                )
+
+                # Iterate each leg of the flight
+                flights = selected.get("flights", [])
+                for idx, leg in enumerate(flights, 1):
+                    dep = leg.get("departure_airport", {})
+                    arr = leg.get("arrival_airport", {})
+
+                    st.markdown(
+                        f"""
+                        <div style="
+                            border: 1px solid #555;
+                            border-radius: 12px;
+                            padding: 12px;
+                            margin-bottom: 12px;
+                            background-color: #2a2a2a;
+                            color: #f1f1f1;
+                            box-shadow: 2px 2px 5px rgba(0,0,0,0.3);
+                            position:relative;
+                        ">
+                            <div style="position:absolute; top:12px; left:12px; display:flex; align-items:center;">
+                                <img src="{leg.get('airline_logo', '')}" width="40" style="border-radius:6px; margin-right:6px;">
+                                <b>{leg.get('flight_number', 'N/A')}</b>
+                            </div>
+                            <p style="margin-top:36px;"><b>From:</b> {dep.get('name', 'N/A')} ({dep.get('id', '')}) at {dep.get('time', '')}</p>
+                            <p><b>To:</b> {arr.get('name', 'N/A')} ({arr.get('id', '')}) at {arr.get('time', '')}</p>
+                            <p>⏱️ Duration: {leg.get('duration', 'N/A')/60:.1f} hours | ✈️ Airplane: {leg.get('airplane', 'N/A')} <br> 🎫 Class: {leg.get('travel_class', 'N/A')} | 🦵 Legroom: {leg.get('legroom', 'N/A')}</p>
+                        </div>
+                        """,
+                        unsafe_allow_html=True
+                    )
+
+                    # Extras / extensions
+                    extensions = leg.get("extensions", [])
+                    if extensions:
+                        with st.expander(f"Extras for {leg.get('flight_number', 'N/A')}"):
+                            for ext in extensions:
+                                st.write(f"- {ext}")
+
+                # Layovers
+                layovers = selected.get("layovers", [])
+                if layovers:
+                    with st.expander("Layovers"):
+                        for stop in layovers:
+                            st.write(f"- {stop.get('name', 'N/A')} ({stop.get('duration', 'N/A')/60:.1f} hours)")
+
 
 # -------------------------------
 # Page UI
 # -------------------------------
+validate_prompts()
 st.set_page_config(page_title="Travel Planner Mate", layout="centered", page_icon="✈️")
 st.title("✈️ Travel Planner Mate (MVP)")
 
@@ -140,9 +431,29 @@ if st.button("Search", type="primary"):
     # All good → run TPM
     # ---------------------------
     st.session_state.show_results = True
-    
+    st.session_state.last_search_results = {}
+
+    # Live view: progress log plus each category's cards as soon as its
+    # pipeline finishes; replaced by the tabbed results once all are done
+    live = st.empty()
+    live_box = live.container()
+    status = live_box.status("Running search...", expanded=False)
+
+    def on_event(event):
+        icon = PIPELINE_ICONS.get(event.get("pipeline"), "")
+        if event["type"] == "stage" and event["stage"] in LIVE_STAGES:
+            status.write(f"{icon} {event['pipeline']}: {LIVE_STAGES[event['stage']]} ({event['duration']:.1f}s)")
+        elif event["type"] == "error":
+            status.write(f"❌ {event['pipeline']} failed: {event['error']}")
+        elif event["type"] == "result":
+            status.update(label=f"{icon} {event['pipeline'].capitalize()} ready after {event['elapsed']:.1f}s, still searching...")
+            for category_key, results in result_categories(event["pipeline"], event["result"]):
+                with live_box:
+                    st.subheader(f"{category_key.capitalize()} (ready after {event['elapsed']:.1f}s)")
+                    render_results(category_key, results)
+
     start_time = time.time()
-    with st.spinner("Running search..."):
+    with start_trace("search", destination=destination) as trace:
         st.session_state.last_search_results = run_TPM(
             from_city=departure,
             to_city=destination,
@@ -152,8 +463,12 @@ if st.button("Search", type="primary"):
             run_hotels_flag=hotels_checked,
             run_flights_flag=flights_checked,
             run_tripadvisor_flag=activities_checked,
+            hotel_constraints={"min_price": budget_min, "max_price": budget_max, "currency": "SAR"},
+            on_event=on_event,
         )
+    live.empty()
 
+    st.session_state.last_trace = trace.summary()
     elapsed = time.time() - start_time
     elapsed_rounded = round(elapsed, 1)
 
@@ -177,6 +492,9 @@ if st.session_state.show_results and st.session_state.last_search_results:
     hotels_data = st.session_state.last_search_results.get("hotels", [])
     flights_data = st.session_state.last_search_results.get("flights", [])
 
+    with st.expander("⏱ Timing breakdown"):
+        render_waterfall(st.session_state.last_trace)
+
     # Build menu options dynamically based on available results
     available_categories = []
 
@@ -212,230 +530,4 @@ if st.session_state.show_results and st.session_state.last_search_results:
 
 
         if results:
-            # 1️⃣ Activities → show as boxed cards
-            if category_key == "activities":
-                for act in results:
-                    with st.container():
-                        st.markdown(
-                            f"""
-                            <div style="
-                                display: flex;
-                                border: 1px solid #ddd;
-                                border-radius: 12px;
-                                padding: 10px;
-                                margin-bottom: 15px;
-                                background-color: #f9f9f9;
-                                color: #111;
-                                box-shadow: 2px 2px 5px rgba(0,0,0,0.05);
-                            ">
-                                <div style="flex: 1; min-width: 120px;">
-                                    <img src="{act.get('thumbnail', '')}" style="width: 100%; border-radius: 10px;">
-                                </div>
-                                <div style="flex: 2; padding-left: 15px;">
-                                    <h4 style="color: #111;">{act.get('title', 'No title')}</h4>
-                                    <p><b>Location:</b> {act.get('location', 'N/A')}</p>
-                                    <p><b>Rating:</b> {act.get('rating', 'N/A')} ⭐ | <b>Reviews:</b> {act.get('reviews', 'N/A')}</p>
-                                    <p>{act.get('description', '')[:200]}{'...' if len(act.get('description', ''))>200 else ''}</p>
-                                    <p><a href="{act.get('link', '#')}" target="_blank">View More</a></p>
-                                </div>
-                            </div>
-                            """,
-                            unsafe_allow_html=True
-                        )
-
-            # 2️⃣ Restaurants → show as boxed cards
-            elif category_key == "restaurants":
-                for res in results:
-                    with st.container():
-                        st.markdown(
-                            f"""
-                            <div style="
-                                display: flex;
-                                border: 1px solid #ddd;
-                                border-radius: 12px;
-                                padding: 10px;
-                                margin-bottom: 15px;
-                                background-color: #fefefe;
-                                color: #111;
-                                box-shadow: 2px 2px 5px rgba(0,0,0,0.05);
-                            ">
-                                <div style="flex: 1; min-width: 120px;">
-                                    <img src="{res.get('thumbnail', '')}" style="width: 100%; border-radius: 10px;">
-                                </div>
-                                <div style="flex: 2; padding-left: 15px;">
-                                    <h4 style="color: #111;">{res.get('title', 'No title')}</h4>
-                                    <p><b>Location:</b> {res.get('location', 'N/A')}</p>
-                                    <p><b>Rating:</b> {res.get('rating', 'N/A')} ⭐ | <b>Reviews:</b> {res.get('reviews', 'N/A')}</p>
-                                    <p>{res.get('description', '')[:200]}{'...' if len(res.get('description', ''))>200 else ''}</p>
-                                    <p><a href="{res.get('link', '#')}" target="_blank">View More</a></p>
-                                </div>
-                            </div>
-                            """,
-                            unsafe_allow_html=True
-                        )
-
-            
-            
-        # 3️⃣ Hotels → show as boxed cards with gallery & expander
-            elif category_key == "hotels":
-                for hotel in results:
-                    with st.container():
-                        # Extract first 3 images for gallery preview
-                        images = hotel.get("images", [])[:3]
-                        gallery_html = "".join(
-                            f'<img src="{img.get("thumbnail", "")}" style="width:32%; margin-right:2%; border-radius:8px;">'
-                            for img in images
-                        )
-
-                        # Get pricing info
-                        rate = hotel.get("rate_per_night", {})
-                        total_rate = hotel.get("total_rate", {})
-                        per_night = rate.get("lowest", "N/A")
-                        total = total_rate.get("lowest", "N/A")
-
-                        # Main hotel card
-                        st.markdown(
-                            f"""
-                            <div style="
-                                display: flex;
-                                flex-direction: column;
-                                border: 1px solid #ddd;
-                                border-radius: 12px;
-                                padding: 12px;
-                                margin-bottom: 20px;
-                                background-color: #1e1e1e;
-                                color: #f1f1f1;
-                                box-shadow: 2px 2px 5px rgba(0,0,0,0.3);
-                            ">
-                                <h3 style="color:#f1f1f1;">{hotel.get('name', 'No name')}</h3>
-                                <p><b>Hotel Class:</b> {hotel.get('hotel_class', 'N/A')} | <b>Rating:</b> {hotel.get('overall_rating', 'N/A')} ⭐ ({hotel.get('reviews', '0')} reviews)</p>
-                                <p><b>Price per night:</b> {per_night} | <b>Total for stay:</b> {total}</p>
-                                <div style="display:flex; margin-bottom:10px;">{gallery_html}</div>
-                                <p>{hotel.get('description', '')[:200]}{'...' if len(hotel.get('description', ''))>200 else ''}</p>
-                                <p><a href="{hotel.get('link', '#')}" target="_blank">Visit Hotel Site</a></p>
-                            </div>
-                            """,
-                            unsafe_allow_html=True
-                        )
-
-                        # Expander for more details
-                        with st.expander("More Details"):
-                            # Amenities
-                            amenities = hotel.get("amenities", [])
-                            amenities_str = ", ".join(amenities) if amenities else "N/A"
-
-                            # Check-in/out
-                            check_in = hotel.get("check_in_time", "N/A")
-                            check_out = hotel.get("check_out_time", "N/A")
-
-                            # Nearby places
-                            nearby_places = hotel.get("nearby_places", [])
-                            nearby_html = ""
-                            for place in nearby_places:
-                                name = place.get("name", "")
-                                transports = place.get("transportations", [])
-                                transport_str = ", ".join(f'{t.get("type")}: {t.get("duration")}' for t in transports)
-                                nearby_html += f"<li>{name} ({transport_str})</li>"
-
-                            # Ratings breakdown
-                            ratings_breakdown = hotel.get("reviews_breakdown", [])
-                            ratings_html = ""
-                            for r in ratings_breakdown:
-                                ratings_html += f"<li>{r.get('name')}: {r.get('positive', 0)}👍 / {r.get('negative', 0)}👎 / {r.get('neutral', 0)}😐</li>"
-
-                            st.markdown(
-                                f"""
-                                <p><b>Amenities:</b> {amenities_str}</p>
-                                <p><b>Check-in:</b> {check_in} | <b>Check-out:</b> {check_out}</p>
-                                <p><b>Nearby Places:</b></p>
-                                <ul>{nearby_html}</ul>
-                                <p><b>Review Breakdown:</b></p>
-                                <ul>{ratings_html}</ul>
-                                """,
-                                unsafe_allow_html=True
-                            )
-
-
-            elif category_key == "flights":
-                selected_flights = results.get("selected_flights", [])
-
-                for i, selected in enumerate(selected_flights):
-                    with st.container():
-                        st.write("---")  # separator between flight options
-
-                        # Determine trip type
-                        trip_label = "Outbound" if i == 0 else "Return"
-
-                        # Main container for this flight option
-                        flight_type = selected.get("type", "N/A")
-                        total_duration = selected.get("total_duration", "N/A")
-                        airline_logo = selected.get("airline_logo", "")
-
-                        # Flight option card with top logo + trip label
-                        st.markdown(
-                            f"""
-                            <div style="
-                                border: 2px solid #444;
-                                border-radius: 16px;
-                                padding: 12px;
-                                margin-bottom: 20px;
-                                background-color: #1e1e1e;
-                                box-shadow: 3px 3px 8px rgba(0,0,0,0.5);
-                            ">
-                                <div style="display:flex; align-items:center; justify-content:space-between; margin-bottom:10px;">
-                                    <div style="display:flex; align-items:center;">
-                                        <img src="{airline_logo}" width="70" style="border-radius:8px; margin-right:12px;">
-                                        <h4 style="margin:0; color:#f1f1f1;">{trip_label} | Total Duration: {total_duration/60:.1f} hours</h4>
-                                    </div>
-                                    <a href="{results.get('search_metadata', {}).get('google_flights_url', '#')}" target="_blank" style="background-color:#ff4b2b; color:white; padding:8px 16px; border-radius:8px; text-decoration:none;">View on Google Flights</a>
-                                </div>
-                            </div>
-                            """,
-                            unsafe_allow_html=True
-                        )
-
-                        # Iterate each leg of the flight
-                        flights = selected.get("flights", [])
-                        for idx, leg in enumerate(flights, 1):
-                            dep = leg.get("departure_airport", {})
-                            arr = leg.get("arrival_airport", {})
-
-                            st.markdown(
-                                f"""
-                                <div style="
-                                    border: 1px solid #555;
-                                    border-radius: 12px;
-                                    padding: 12px;
-                                    margin-bottom: 12px;
-                                    background-color: #2a2a2a;
-                                    color: #f1f1f1;
-                                    box-shadow: 2px 2px 5px rgba(0,0,0,0.3);
-                                    position:relative;
-                                ">
-                                    <div style="position:absolute; top:12px; left:12px; display:flex; align-items:center;">
-                                        <img src="{leg.get('airline_logo', '')}" width="40" style="border-radius:6px; margin-right:6px;">
-                                        <b>{leg.get('flight_number', 'N/A')}</b>
-                                    </div>
-                                    <p style="margin-top:36px;"><b>From:</b> {dep.get('name', 'N/A')} ({dep.get('id', '')}) at {dep.get('time', '')}</p>
-                                    <p><b>To:</b> {arr.get('name', 'N/A')} ({arr.get('id', '')}) at {arr.get('time', '')}</p>
-                                    <p>⏱️ Duration: {leg.get('duration', 'N/A')/60:.1f} hours | ✈️ Airplane: {leg.get('airplane', 'N/A')} <br> 🎫 Class: {leg.get('travel_class', 'N/A')} | 🦵 Legroom: {leg.get('legroom', 'N/A')}</p>
-                                </div>
-                                """,
-                                unsafe_allow_html=True
-                            )
-
-                            # Extras / extensions
-                            extensions = leg.get("extensions", [])
-                            if extensions:
-                                with st.expander(f"Extras for {leg.get('flight_number', 'N/A')}"):
-                                    for ext in extensions:
-                                        st.write(f"- {ext}")
-
-                        # Layovers
-                        layovers = selected.get("layovers", [])
-                        if layovers:
-                            with st.expander("Layovers"):
-                                for stop in layovers:
-                                    st.write(f"- {stop.get('name', 'N/A')} ({stop.get('duration', 'N/A')/60:.1f} hours)")
-
-                       
\ No newline at end of file
+            render_results(category_key, results)
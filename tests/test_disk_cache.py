@@ -0,0 +1,100 @@
+import pytest
+
+from Shared import disk_cache
+from Shared.disk_cache import DiskCache, make_key
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1_000_000.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(disk_cache.time, "time", clock)
+    return clock
+
+
+@pytest.fixture
+def cache_dir(tmp_path, monkeypatch):
+    monkeypatch.setattr(disk_cache, "CACHE_DIR", str(tmp_path))
+    return tmp_path
+
+
+def test_make_key_is_stable_and_order_independent():
+    assert make_key("serpapi", {"q": "Rome", "hl": "en"}) == make_key("serpapi", {"hl": "en", "q": "Rome"})
+    assert make_key("serpapi", {"q": "Rome"}) != make_key("serpapi", {"q": "Paris"})
+
+
+def test_round_trip_and_counters(cache_dir):
+    cache = DiskCache("t")
+    assert cache.get("k") is None
+    cache.set("k", {"hotels": [1, 2], "name": "Café"})
+    assert cache.get("k") == {"hotels": [1, 2], "name": "Café"}
+    assert cache.stats["misses"] == 1 and cache.stats["hits"] == 1 and cache.stats["writes"] == 1
+
+
+def test_sets_are_stored_as_sorted_lists(cache_dir):
+    cache = DiskCache("t")
+    cache.set("k", {"amenities": {"3", "1"}})
+    assert cache.get("k") == {"amenities": ["1", "3"]}
+
+
+def test_shared_between_instances(cache_dir):
+    DiskCache("t").set("k", [1])
+    assert DiskCache("t").get("k") == [1]
+    assert DiskCache("other").get("k") is None
+
+
+def test_ttl_expiry_and_age(cache_dir, clock):
+    cache = DiskCache("t")
+    cache.set("k", "v", ttl=60)
+    clock.now += 30
+    assert cache.get_entry("k") == ("v", 30)
+    clock.now += 30
+    assert cache.get_entry("k") == (None, None)
+    assert cache.stats["expired"] == 1
+
+
+def test_no_ttl_never_expires(cache_dir, clock):
+    cache = DiskCache("t")
+    cache.set("k", "v")
+    clock.now += 10 ** 8
+    assert cache.get("k") == "v"
+
+
+def test_evicts_least_recently_used_by_count(cache_dir, clock):
+    cache = DiskCache("t", max_entries=2)
+    cache.set("a", 1)
+    clock.now += 1
+    cache.set("b", 2)
+    clock.now += 1
+    cache.get("a")          # "b" is now the least recently used
+    clock.now += 1
+    cache.set("c", 3)
+    assert cache.get("b") is None
+    assert cache.get("a") == 1 and cache.get("c") == 3
+    assert cache.stats["evictions"] == 1
+
+
+def test_evicts_by_size(cache_dir, clock):
+    cache = DiskCache("t", max_bytes=20)   # each value is 12 bytes of JSON
+    cache.set("a", "x" * 10)
+    clock.now += 1
+    cache.set("b", "y" * 10)
+    assert cache.get("a") is None
+    assert cache.get("b") == "y" * 10
+
+
+def test_delete_and_clear(cache_dir):
+    cache = DiskCache("t")
+    cache.set("a", 1)
+    cache.set("b", 2)
+    cache.delete("a")
+    assert cache.get("a") is None and cache.get("b") == 2
+    cache.clear()
+    assert cache.get("b") is None
@@ -0,0 +1,130 @@
+import pytest
+
+from Shared.parsing import safe_parse, scan_values, validate, SCHEMAS, parse_stats
+from Shared.json_stream import ArrayItemParser, parse_literal
+
+
+# --------------------------------------------------------------------
+# safe_parse
+# --------------------------------------------------------------------
+def test_plain_json():
+    assert safe_parse('{"city": "Vienna"}', "fix_city") == {"city": "Vienna"}
+
+
+def test_code_fences():
+    text = '```json\n{"city": "Vienna"}\n```'
+    assert safe_parse(text, "fix_city") == {"city": "Vienna"}
+
+
+def test_assignment_prefix():
+    text = 'params = {"engine": "google_hotels", "q": "Hotels in Vienna", "check_in_date": "2026-12-10"}'
+    assert safe_parse(text, "hotel_params")["q"] == "Hotels in Vienna"
+
+
+def test_trailing_commas():
+    assert safe_parse('[{"i": 1, "reason": "ok",},]', "top_items") == [{"i": 1, "reason": "ok"}]
+
+
+def test_python_literal():
+    text = "{'top_hotels': [{'i': 2, 'reason': 'Close to the centre', 'sponsored': None, 'pool': True}]}"
+    parsed = safe_parse(text, "top_hotels")
+    assert parsed["top_hotels"][0]["i"] == 2
+    assert parsed["top_hotels"][0]["pool"] is True
+
+
+def test_prose_around_value_with_apostrophes():
+    text = "Here's what I'd pick: [{\"i\": 3, \"reason\": \"It's central\"}] Let me know if that's fine."
+    assert safe_parse(text, "top_items") == [{"i": 3, "reason": "It's central"}]
+
+
+def test_brackets_inside_strings():
+    text = 'Sure: [{"i": 0, "reason": "Rooms [renovated] {2024}"}]'
+    assert safe_parse(text, "top_items") == [{"i": 0, "reason": "Rooms [renovated] {2024}"}]
+
+
+def test_largest_value_wins():
+    text = 'Picked [{"i": 4, "reason": "a"}, {"i": 1, "reason": "b"}] from [1, 2]'
+    assert [p["i"] for p in safe_parse(text, "top_items")] == [4, 1]
+
+
+def test_skips_values_that_fail_the_schema():
+    text = 'Example: {"note": "x"} Answer: {"city": "Rome"}'
+    assert safe_parse(text, "fix_city") == {"city": "Rome"}
+
+
+def test_truncated_array_keeps_complete_items():
+    text = '{"top_hotels": [{"i": 0, "reason": "a"}, {"i": 5, "reason": "b"}, {"i": 7, "rea'
+    assert safe_parse(text, "top_hotels") == [{"i": 0, "reason": "a"}, {"i": 5, "reason": "b"}]
+
+
+@pytest.mark.parametrize("text", ["no json here", "{broken", ""])
+def test_failure_returns_none(text):
+    assert safe_parse(text, "fix_city") is None
+
+
+def test_schema_mismatch_returns_none():
+    assert safe_parse('{"town": "Rome"}', "fix_city") is None
+
+
+def test_structured_value_is_validated_only():
+    assert safe_parse({"city": "Rome"}, "fix_city") == {"city": "Rome"}
+    assert safe_parse({"town": "Rome"}, "fix_city") is None
+    assert safe_parse(None, "fix_city") is None
+
+
+def test_outcomes_are_counted():
+    before = parse_stats().get("top_flights", {}).get("salvaged", 0)
+    safe_parse('{"final_flights": [{"i": 1, "reason": "a"}, {"i"', "top_flights")
+    assert parse_stats()["top_flights"]["salvaged"] == before + 1
+
+
+# --------------------------------------------------------------------
+# scanner / schemas
+# --------------------------------------------------------------------
+def test_scan_values_spans():
+    text = 'a {"x": [1]} b [2, {"y": "]"}] c'
+    assert [text[a:b] for a, b in scan_values(text)] == ['{"x": [1]}', '[2, {"y": "]"}]']
+
+
+def test_scan_values_drops_mismatched():
+    assert list(scan_values("{ ] [1]")) == [(4, 7)]
+
+
+def test_validate_any_of_and_items():
+    assert validate({"top_hotels": []}, SCHEMAS["top_hotels"])
+    assert validate([{"i": 1}], SCHEMAS["top_hotels"])
+    assert not validate([{"reason": "no index"}], SCHEMAS["top_items"])
+    assert not validate({"city": 3}, SCHEMAS["fix_city"])
+
+
+# --------------------------------------------------------------------
+# json_stream
+# --------------------------------------------------------------------
+def test_parse_literal():
+    assert parse_literal('{"a": [1, 2,],}') == {"a": [1, 2]}
+    assert parse_literal("{'a': None}") == {"a": None}
+    with pytest.raises(ValueError):
+        parse_literal("not a value")
+
+
+def test_array_parser_streams_items_across_chunks():
+    reply = '```json\n{"top_hotels": [{"i": 1, "reason": "a, b"}, {"i": 2, "reason": "c}"}]}\n```'
+    parser = ArrayItemParser(keys=("top_hotels",))
+    items = []
+    for n in range(0, len(reply), 7):
+        items += parser.feed(reply[n:n + 7])
+    assert items == [{"i": 1, "reason": "a, b"}, {"i": 2, "reason": "c}"}]
+    assert parser.done and parser.count == 2
+
+
+def test_array_parser_bare_array_with_prose_and_single_quotes():
+    parser = ArrayItemParser()
+    items = parser.feed("Here's the list: [{'i': 0, 'reason': 'It\\'s quiet'}, {'i': 3, 'reason': 'x'}")
+    assert items == [{"i": 0, "reason": "It's quiet"}, {"i": 3, "reason": "x"}]
+    assert not parser.done
+
+
+def test_array_parser_ignores_other_keys():
+    parser = ArrayItemParser(keys=("items",))
+    items = parser.feed('{"notes": [{"i": 9}], "items": [{"i": 4}]}')
+    assert items == [{"i": 4}]
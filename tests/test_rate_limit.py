@@ -0,0 +1,97 @@
+import time, asyncio, threading
+from concurrent.futures import ThreadPoolExecutor
+
+from Shared import rate_limit
+from Shared.rate_limit import RateLimiter, rate_limiter, throttled
+
+
+def _timed(fn):
+    start = time.monotonic()
+    fn()
+    return time.monotonic() - start
+
+
+def test_unlimited_never_waits():
+    limiter = RateLimiter("t")
+    assert _timed(lambda: [limiter.acquire() for _ in range(50)]) < 0.05
+
+
+def test_burst_then_refill_rate():
+    limiter = RateLimiter("t", rate=20, burst=3)
+
+    def take(n):
+        for _ in range(n):
+            with limiter.slot():
+                pass
+
+    assert _timed(lambda: take(3)) < 0.02           # the bucket starts full
+    assert 0.08 < _timed(lambda: take(2)) < 0.3    # then one token every 50 ms
+    assert limiter.stats["requests"] == 5 and limiter.stats["queued"] >= 1
+
+
+def test_concurrency_cap():
+    limiter = RateLimiter("t", concurrency=2)
+    lock, active, peak = threading.Lock(), [0], [0]
+
+    def work(_):
+        with limiter.slot():
+            with lock:
+                active[0] += 1
+                peak[0] = max(peak[0], active[0])
+            time.sleep(0.03)
+            with lock:
+                active[0] -= 1
+
+    with ThreadPoolExecutor(6) as pool:
+        list(pool.map(work, range(6)))
+    assert peak[0] == 2
+    assert limiter.stats["in_flight"] == 0 and limiter.stats["waiting"] == 0
+
+
+def test_async_concurrency_cap():
+    limiter = RateLimiter("t", concurrency=1)
+    active, peak = [0], [0]
+
+    async def work():
+        async with limiter.slot_async():
+            active[0] += 1
+            peak[0] = max(peak[0], active[0])
+            await asyncio.sleep(0.02)
+            active[0] -= 1
+
+    async def main():
+        await asyncio.gather(*(work() for _ in range(4)))
+
+    assert _timed(lambda: asyncio.run(main())) >= 0.08
+    assert peak[0] == 1
+
+
+def test_release_after_error():
+    limiter = RateLimiter("t", concurrency=1)
+    try:
+        with limiter.slot():
+            raise RuntimeError
+    except RuntimeError:
+        pass
+    assert _timed(limiter.acquire) < 0.02
+
+
+def test_pause_holds_every_caller():
+    limiter = RateLimiter("t")
+    limiter.pause(0.1)
+    assert _timed(limiter.acquire) >= 0.09
+    assert limiter.stats["throttled"] == 1
+
+
+def test_throttled_reads_retry_after(monkeypatch):
+    limiter = RateLimiter("t")
+    monkeypatch.setitem(rate_limit._limiters, "t", limiter)
+    throttled("t", {"retry-after": "0.1"})
+    assert _timed(limiter.acquire) >= 0.09
+    throttled("t", {"retry-after": "soon"}, default=0.05)
+    assert limiter.stats["throttled"] == 2
+
+
+def test_one_limiter_per_provider():
+    assert rate_limiter("serpapi") is rate_limiter("serpapi")
+    assert rate_limiter("serpapi") is not rate_limiter("anthropic")
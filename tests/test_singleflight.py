@@ -0,0 +1,209 @@
+import time, asyncio, threading
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from Shared import singleflight
+from Shared.singleflight import SingleFlight
+from Shared.resilience import search_budget, call_timeout, DeadlineExceeded
+
+
+def _slow(calls, result, delay=0.1):
+    def fn():
+        calls.append(1)
+        time.sleep(delay)
+        return result
+    return fn
+
+
+def test_concurrent_calls_share_one_run():
+    group, calls = SingleFlight("t"), []
+    fn = _slow(calls, {"hotels": [1]})
+    with ThreadPoolExecutor(4) as pool:
+        results = list(pool.map(lambda _: group.do("k", fn), range(4)))
+    assert len(calls) == 1
+    assert results == [{"hotels": [1]}] * 4
+    assert group.stats == {"calls": 4, "shared": 3}
+
+
+def test_followers_get_copies():
+    group, calls = SingleFlight("t"), []
+    fn = _slow(calls, {"hotels": [1]})
+    with ThreadPoolExecutor(2) as pool:
+        results = list(pool.map(lambda _: group.do("k", fn), range(2)))
+    results[0]["hotels"].append(2)
+    assert results[1] == {"hotels": [1]}
+
+
+def test_different_keys_run_separately():
+    group, calls = SingleFlight("t"), []
+    fn = _slow(calls, 1)
+    with ThreadPoolExecutor(2) as pool:
+        list(pool.map(lambda key: group.do(key, fn), ["a", "b"]))
+    assert len(calls) == 2
+
+
+def test_nothing_is_kept_after_the_call():
+    group, calls = SingleFlight("t"), []
+    fn = _slow(calls, 1, delay=0)
+    group.do("k", fn)
+    group.do("k", fn)
+    assert len(calls) == 2
+
+
+def test_exception_reaches_every_caller():
+    group, started = SingleFlight("t"), threading.Event()
+
+    def fail():
+        started.set()
+        time.sleep(0.1)
+        raise RuntimeError("upstream down")
+
+    def call():
+        try:
+            group.do("k", fail)
+        except RuntimeError as e:
+            return str(e)
+
+    with ThreadPoolExecutor(3) as pool:
+        leader = pool.submit(call)
+        started.wait()
+        followers = [pool.submit(call) for _ in range(2)]
+        errors = [leader.result()] + [f.result() for f in followers]
+    assert errors == ["upstream down"] * 3
+    assert group.stats["shared"] == 2
+
+
+def test_disabled(monkeypatch):
+    monkeypatch.setattr(singleflight, "SINGLE_FLIGHT", False)
+    group, calls = SingleFlight("t"), []
+    fn = _slow(calls, 1)
+    with ThreadPoolExecutor(3) as pool:
+        list(pool.map(lambda _: group.do("k", fn), range(3)))
+    assert len(calls) == 3
+
+
+def test_async_tasks_share_one_run():
+    group, calls = SingleFlight("t"), []
+
+    async def fetch():
+        calls.append(1)
+        await asyncio.sleep(0.05)
+        return [1]
+
+    async def main():
+        return await asyncio.gather(*(group.do_async("k", fetch) for _ in range(3)))
+
+    assert asyncio.run(main()) == [[1]] * 3
+    assert len(calls) == 1
+
+
+def test_cancelled_follower_does_not_cancel_the_leader():
+    group = SingleFlight("t")
+
+    async def fetch():
+        await asyncio.sleep(0.05)
+        return "done"
+
+    async def main():
+        leader = asyncio.ensure_future(group.do_async("k", fetch))
+        await asyncio.sleep(0)
+        follower = asyncio.ensure_future(group.do_async("k", fetch))
+        await asyncio.sleep(0)
+        follower.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await follower
+        return await leader
+
+    assert asyncio.run(main()) == "done"
+
+
+def test_cancelled_leader_does_not_cancel_the_follower():
+    group, calls = SingleFlight("t"), []
+
+    async def fetch():
+        calls.append(1)
+        await asyncio.sleep(0.05)
+        return "done"
+
+    async def main():
+        leader = asyncio.ensure_future(group.do_async("k", fetch))
+        await asyncio.sleep(0)
+        follower = asyncio.ensure_future(group.do_async("k", fetch))
+        await asyncio.sleep(0)
+        leader.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await leader
+        return await follower
+
+    assert asyncio.run(main()) == "done"
+    assert len(calls) == 2   # the follower re-ran the call as the new leader
+
+
+def test_abandoned_call_is_shared_again():
+    group, calls = SingleFlight("t"), []
+
+    async def fetch():
+        calls.append(1)
+        await asyncio.sleep(0.05)
+        return [1]
+
+    async def main():
+        leader = asyncio.ensure_future(group.do_async("k", fetch))
+        await asyncio.sleep(0)
+        followers = [asyncio.ensure_future(group.do_async("k", fetch)) for _ in range(3)]
+        await asyncio.sleep(0)
+        leader.cancel()
+        return await asyncio.gather(*followers)
+
+    assert asyncio.run(main()) == [[1]] * 3
+    assert len(calls) == 2
+
+
+def test_leader_deadline_is_not_shared():
+    group, calls, started = SingleFlight("t"), [], threading.Event()
+
+    def fetch():
+        calls.append(1)
+        started.set()
+        time.sleep(0.15)
+        call_timeout(5)     # raises once the caller's own budget is spent
+        return "done"
+
+    def search(seconds):
+        with search_budget(seconds):
+            try:
+                return group.do("k", fetch)
+            except DeadlineExceeded:
+                return "deadline"
+
+    with ThreadPoolExecutor(2) as pool:
+        leader = pool.submit(search, 0.1)
+        started.wait()
+        follower = pool.submit(search, 30)
+        assert leader.result() == "deadline"
+        assert follower.result() == "done"
+    assert len(calls) == 2
+
+
+def test_leader_deadline_is_not_shared_async():
+    group = SingleFlight("t")
+
+    async def fetch():
+        await asyncio.sleep(0.15)
+        call_timeout(5)
+        return "done"
+
+    async def search(seconds):
+        with search_budget(seconds):
+            try:
+                return await group.do_async("k", fetch)
+            except DeadlineExceeded:
+                return "deadline"
+
+    async def main():
+        leader = asyncio.ensure_future(search(0.1))
+        await asyncio.sleep(0)
+        return await asyncio.gather(leader, search(30))
+
+    assert asyncio.run(main()) == ["deadline", "done"]